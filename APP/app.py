@@ -1,95 +1,429 @@
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, jsonify, redirect, url_for, abort, g, Response
 import base64
-from io import BytesIO
-import matplotlib
-matplotlib.use('Agg')  # Set the backend to non-interactive
-import matplotlib.pyplot as plt
-from portfolio import Portfolio
-from optimizedportfolio import OptimizedPortfolio
-import numpy as np
-from etfanalyzer import ETFAnalyzer
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from jobqueue import JobQueue
+from instrumentation import metrics, count, start_request_timings, server_timing_header
+
+# Non-interactive matplotlib backend, for whichever module imports pyplot first
+os.environ['MPLBACKEND'] = 'Agg'
+
+# pandas, matplotlib, seaborn, yfinance... are only imported by the requests that need them (imports inside
+# the functions below), a GET of the forms does not load them. prewarm() imports them ahead of the first request.
+HEAVY_MODULES = ('numpy', 'pandas', 'matplotlib.pyplot', 'seaborn', 'chartcache', 'downsampling', 'meanvariance',
+                 'portfolio', 'visualizer', 'optimizedportfolio', 'backtestsweep', 'etfanalyzer')
 
 app = Flask(__name__)
 
+# Job mode: POSTs are computed in the background and answered with a job id (also enabled per request with ?async=1)
+app.config['ASYNC_JOBS'] = os.environ.get('ASYNC_JOBS', '0') == '1'
+job_queue = JobQueue(max_workers=int(os.environ.get('JOB_WORKERS', 4)))
+# Client charts: the page gets downsampled JSON series drawn in the browser instead of PNGs (also ?charts=client)
+app.config['CLIENT_CHARTS'] = os.environ.get('CLIENT_CHARTS', '0') == '1'
+DEFAULT_CHART_POINTS = 500
+# Largest grid /api/sweep evaluates in one request
+MAX_SWEEP_SCENARIOS = int(os.environ.get('MAX_SWEEP_SCENARIOS', 5000))
+
+# Per-request cProfile capture with ?profile=1, answered with the profile instead of the page (opt-in, PROFILING=1)
+app.config['PROFILING'] = os.environ.get('PROFILING', '0') == '1'
+# Import the HEAVY_MODULES in a background thread as soon as the app is loaded (PREWARM=1)
+app.config['PREWARM'] = os.environ.get('PREWARM', '0') == '1'
+
+INVESTMENT_STAGES = ['fetch', 'simulate', 'optimize', 'render']
+ANALYSIS_STAGES = ['fetch', 'simulate', 'render']
+
+
+def prewarm(modules=HEAVY_MODULES, background=True):
+    """Import the heavy modules ahead of the first request that needs them, in a daemon thread by default
+    (returns it). A request arriving meanwhile waits for the module it needs, as with any concurrent import.
+    With a preforking server, call it from each worker (e.g. gunicorn's post_worker_init hook)."""
+    def load():
+        for module in modules:
+            try:
+                __import__(module)  # unlike importlib.import_module, shows up in python -X importtime
+            except Exception as e:
+                print(f"Error pre-loading {module}: {e}")
+
+    if not background:
+        load()
+        return None
+    thread = threading.Thread(target=load, name='prewarm', daemon=True)
+    thread.start()
+    return thread
+
 
 def fig_to_base64(fig):
     """Convert matplotlib figure to base64 encoded image"""
-    buf = BytesIO()
-    fig.savefig(buf, format='png', bbox_inches='tight')
-    buf.seek(0)
-    return base64.b64encode(buf.getvalue()).decode('utf-8')
+    from chartcache import chart_cache, fig_to_png
+    return base64.b64encode(fig_to_png(fig, chart_cache.dpi)).decode('utf-8')
+
+
+# Process-wide caches as (name, module, attribute), reported once their module has been loaded
+CACHES = (('benchmark', 'benchmarkcache', 'benchmark_cache'), ('chart', 'chartcache', 'chart_cache'),
+          ('return_model', 'meanvariance', 'return_model_cache'))
+
+
+def cache_metrics():
+    """Gauges of the process-wide caches and of the job queue, read on every /metrics scrape"""
+    for name, module, attribute in CACHES:
+        if module not in sys.modules:
+            continue
+        stats = getattr(sys.modules[module], attribute).stats()
+        for field in ('hits', 'misses', 'entries', 'bytes'):
+            yield (f'etf_cache_{field}', f"Cache {field}", {'cache': name}, stats[field])
+    yield ('etf_jobs_in_flight', "Background jobs queued or running", {}, job_queue.in_flight_count())
+
+
+metrics.register_collector(cache_metrics)
+
+
+@app.before_request
+def start_instrumentation():
+    g.request_start = time.perf_counter()
+    g.timings = start_request_timings()
+    g.profiler = None
+    if app.config['PROFILING'] and request.args.get('profile') == '1':
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+@app.after_request
+def finish_instrumentation(response):
+    if 'request_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unknown'
+    metrics.observe('http_request_duration_seconds', elapsed, endpoint=endpoint)
+    count('http_requests_total', endpoint=endpoint, status=str(response.status_code))
+    response.headers['Server-Timing'] = server_timing_header(g.timings, elapsed)
+
+    if g.profiler is not None:
+        g.profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(g.profiler, stream=out).sort_stats('cumulative').print_stats(request.args.get('top', 60, type=int))
+        response = Response(out.getvalue(), mimetype='text/plain', headers={'Server-Timing': response.headers['Server-Timing']})
+    return response
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def use_jobs():
+    return app.config['ASYNC_JOBS'] or request.args.get('async') == '1'
+
+
+def use_client_charts():
+    return app.config['CLIENT_CHARTS'] or request.args.get('charts') == 'client'
+
+
+def chart_points():
+    """Points per series returned to the client charts (?points=), clamped to a sane range"""
+    try:
+        points = int(request.args.get('points', DEFAULT_CHART_POINTS))
+    except ValueError:
+        points = DEFAULT_CHART_POINTS
+    return max(3, min(points, 10000))
+
+
+JOB_FAILED_MESSAGE = "The computation failed, please try again later"
+
+
+def enqueue(endpoint, form, func, stages):
+    """Start (or join) the background job for this form and answer with its id"""
+    def run(job):
+        try:
+            return func(job)
+        except Exception as e:
+            if str(e).startswith('Error:'):
+                raise  # input errors are shown to the user as they are
+            # Anything else is logged here and reaches the job pages (and the client) as a generic message
+            app.logger.exception("Job %s (%s) failed", job.id, endpoint)
+            raise RuntimeError(JOB_FAILED_MESSAGE) from e
+
+    key = (endpoint, tuple(sorted(form.items())), tuple(sorted(request.args.items())))
+    job = job_queue.submit(key, run, stages, context={'endpoint': endpoint, 'form': form})
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(job.to_dict()), 202
+    return redirect(url_for('job_page', job_id=job.id))
+
+
+def parse_investment_form(form):
+    """Read and validate the investment form, raises ValueError with the message shown to the user"""
+    initial_amount = float(form['initial_amount'])
+    monthly_amount = float(form['monthly_amount'])
+    start_date = form['start_date']
+    duration = int(form['duration'])
+    frequency = form['investment_frequency']
+
+    # Get ETFs from form
+    etfs = []
+    i = 1
+    while f'etf_ticker_{i}' in form:
+        ticker = form[f'etf_ticker_{i}']
+        proportion = float(form[f'etf_proportion_{i}'])
+        etfs.append((ticker, proportion))
+        i += 1
+
+    # Check proportions sum to 1
+    total_prop = sum([p for _, p in etfs])
+    if abs(total_prop - 1.0) > 0.001:
+        raise ValueError("Error: The sum of proportions must equal 1")
+    return initial_amount, monthly_amount, start_date, duration, etfs, frequency
+
+
+def compute_investment_results(initial_amount, monthly_amount, start_date, duration, etfs, frequency, job=None,
+                               client_charts=False, points=DEFAULT_CHART_POINTS):
+    """Simulate the user portfolio, its benchmark and the optimized portfolio, and render the plots
+    (or return their downsampled series when client_charts is set)"""
+    from portfolio import Portfolio
+    from optimizedportfolio import OptimizedPortfolio
+    from downsampling import downsample_series
+
+    def stage(name):
+        if job is not None:
+            job.set_stage(name)
+
+    # Calculate metrics for user's portfolio
+    stage('fetch')
+    portfolio = Portfolio()
+    portfolio.configure_from_input(initial_amount, monthly_amount, start_date, duration, etfs, frequency)
+    stage('simulate')
+    metrics = portfolio.calculate_all_metrics(render_plots=not client_charts)
+
+    # Create and compare with optimized portfolio
+    stage('optimize')
+    optimized_portfolio = OptimizedPortfolio()
+    optimized_composition, _ = optimized_portfolio.create_optimized_portfolio(
+        initial_amount, monthly_amount, start_date, duration, frequency
+    )
+
+    # Generate comparison plot (plots come encoded, from the chart cache when already drawn)
+    stage('render')
+    plots, series = [], None
+    if client_charts:
+        series = portfolio.visualizer.get_series(points)
+        comparison_data = optimized_portfolio.comparison_data(metrics['data'])
+        series['optimized_pnl_percentage'] = downsample_series(comparison_data['optimized'], points)
+    else:
+        comparison_plot = optimized_portfolio.encoded_comparison_plot(metrics['data'])
+
+        # Add comparison plot
+        plots = list(metrics['plots'])
+        plots.append(comparison_plot)
+
+    # Format optimized composition for display
+    optimized_display = "\n".join([
+        f"{etf[0]} ({etf[1]*100:.1f}%)" for etf in optimized_composition
+    ])
+
+    # Prepare results
+    return {
+        'sharpe_ratio': metrics['sharpe_ratio'],
+        'global_cagr': metrics['cagr'].loc['TOTAL', 'CAGR'],
+        'acwi_cagr': metrics['acwi_cagr'],
+        'acwi_sharpe': metrics['acwi_sharpe'],
+        'cagr_table': metrics['cagr'].to_html(classes='data-table', float_format='%.2f'),
+        'plots': plots,
+        'series': series,
+        'optimized_composition': optimized_display,
+        'optimized_cagr': optimized_portfolio.apply_CAGR_ratio().loc['TOTAL', 'CAGR'],
+        'optimized_sharpe': optimized_portfolio.apply_SHARPE_ratio()[1]
+    }
+
 
 @app.route('/', methods=['GET', 'POST'])
 def investment_form():
     if request.method == 'POST':
         # Get form data
-        initial_amount = float(request.form['initial_amount'])
-        monthly_amount = float(request.form['monthly_amount'])
-        start_date = request.form['start_date']
-        duration = int(request.form['duration'])
-        frequency = request.form['investment_frequency']
-        
-        # Get ETFs from form
-        etfs = []
-        i = 1
-        while f'etf_ticker_{i}' in request.form:
-            ticker = request.form[f'etf_ticker_{i}']
-            proportion = float(request.form[f'etf_proportion_{i}'])
-            etfs.append((ticker, proportion))
-            i += 1
-        
-        # Check proportions sum to 1
-        total_prop = sum([p for _, p in etfs])
-        if abs(total_prop - 1.0) > 0.001:
-            return "Error: The sum of proportions must equal 1", 400 
-        
-        # Calculate metrics for user's portfolio
-        portfolio = Portfolio()
-        portfolio.configure_from_input(initial_amount, monthly_amount, start_date, duration, etfs, frequency)
-        metrics = portfolio.calculate_all_metrics()
-        
-        # Create and compare with optimized portfolio
-        optimized_portfolio = OptimizedPortfolio()
-        optimized_composition, _ = optimized_portfolio.create_optimized_portfolio(
-            initial_amount, monthly_amount, start_date, duration, frequency
-        )
-        
-        # Generate comparison plot
-        comparison_fig = optimized_portfolio.compare_with_user_portfolio(metrics['data'])
-        comparison_plot = fig_to_base64(comparison_fig)
-        plt.close(comparison_fig)
-        
-        # Generate plots
-        plots = []
-        for fig in metrics['plots']:
-            plots.append(fig_to_base64(fig))
-            plt.close(fig)
-        
-        # Add comparison plot
-        plots.append(comparison_plot)
-        
-        # Format optimized composition for display
-        optimized_display = "\n".join([
-            f"{etf[0]} ({etf[1]*100:.1f}%)" for etf in optimized_composition
-        ])
-             
-        # Prepare results
-        results = {
-            'sharpe_ratio': metrics['sharpe_ratio'],
-            'global_cagr': metrics['cagr'].loc['TOTAL', 'CAGR'],
-            'acwi_cagr': metrics['acwi_cagr'],
-            'acwi_sharpe': metrics['acwi_sharpe'],
-            'cagr_table': metrics['cagr'].to_html(classes='data-table', float_format='%.2f'),
-            'plots': plots,
-            'optimized_composition': optimized_display,
-            'optimized_cagr': optimized_portfolio.apply_CAGR_ratio().loc['TOTAL', 'CAGR'],
-            'optimized_sharpe': optimized_portfolio.apply_SHARPE_ratio()[1]
-        }
-        
+        try:
+            params = parse_investment_form(request.form)
+        except ValueError as e:
+            return str(e), 400
+
+        client_charts, points = use_client_charts(), chart_points()
+        if use_jobs():
+            return enqueue('investment_form', request.form.to_dict(),
+                           lambda job: compute_investment_results(*params, job=job, client_charts=client_charts, points=points),
+                           INVESTMENT_STAGES)
+
+        from etfdataretrieval import DownloadError
+        try:
+            results = compute_investment_results(*params, client_charts=client_charts, points=points)
+        except DownloadError as e:
+            return str(e), 400
         return render_template('index.html', results=results)
-    
+
     return render_template('index.html')
 
+
+@app.route('/api/portfolio', methods=['POST'])
+def portfolio_series_api():
+    """Metrics and downsampled series of a portfolio and its benchmark as JSON, takes the fields of the / form"""
+    from etfdataretrieval import DownloadError
+    from portfolio import Portfolio
+    form = request.get_json(silent=True) or request.form
+    try:
+        params = parse_investment_form({k: str(v) for k, v in form.items()})
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    portfolio = Portfolio()
+    try:
+        portfolio.configure_from_input(*params)
+        metrics = portfolio.calculate_all_metrics(render_plots=False)  # downloads the benchmark ticker
+    except DownloadError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'metrics': {
+            'cagr': float(metrics['cagr'].loc['TOTAL', 'CAGR']),
+            'sharpe_ratio': float(metrics['sharpe_ratio']),
+            'benchmark_cagr': float(metrics['acwi_cagr']),
+            'benchmark_sharpe_ratio': float(metrics['acwi_sharpe'])
+        },
+        'series': portfolio.visualizer.get_series(chart_points())
+    })
+
+
+def parse_sweep_request(data):
+    """Read and validate a /api/sweep body, raises ValueError with the message returned to the client"""
+    import pandas as pd
+    from backtestsweep import BacktestSweep
+    etfs = [(str(ticker), float(proportion)) for ticker, proportion in data['etfs']]
+    if abs(sum(p for _, p in etfs) - 1.0) > 0.001:
+        raise ValueError("Error: The sum of proportions must equal 1")
+    if 'start_dates' in data:
+        start_dates = pd.to_datetime(data['start_dates'])
+    else:
+        start_dates = BacktestSweep.start_dates(data['first_start'], data['last_start'], data.get('step', 'YS'))
+    durations = [int(d) for d in data['durations']]
+    frequencies = list(data.get('frequencies', ['M']))
+    amounts = [(float(initial), float(periodic)) for initial, periodic in data.get('amounts', [(1000, 100)])]
+    size = len(start_dates) * len(durations) * len(frequencies) * len(amounts)
+    if size == 0:
+        raise ValueError("Error: The grid has no scenario")
+    if size > MAX_SWEEP_SCENARIOS:
+        raise ValueError(f"Error: The grid has {size} scenarios, the limit is {MAX_SWEEP_SCENARIOS}")
+    return etfs, start_dates, durations, frequencies, amounts
+
+
+@app.route('/api/sweep', methods=['POST'])
+def backtest_sweep_api():
+    """Backtests of one allocation over a grid of start dates x durations x frequencies x amounts, as JSON.
+
+    Body: {"etfs": [[ticker, proportion], ...], "start_dates": [...] (or "first_start", "last_start" and a pandas
+    "step" such as "YS"), "durations": [years, ...], "frequencies": ["M", ...], "amounts": [[initial, periodic], ...]}
+    """
+    from backtestsweep import BacktestSweep
+    try:
+        etfs, start_dates, durations, frequencies, amounts = parse_sweep_request(request.get_json(force=True))
+        sweep = BacktestSweep(etfs)
+        results = sweep.run(start_dates, durations, frequencies, amounts)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Through pandas' JSON writer, which turns NaN (a scenario without data, a single-scenario std) into null
+    summary = BacktestSweep.summarize(results)
+    summary.columns = [f"{metric}_{stat}" if stat else metric for metric, stat in summary.columns]
+    scenarios = results.assign(start_date=results['start_date'].dt.strftime('%Y-%m-%d'),
+                               end_date=results['end_date'].dt.strftime('%Y-%m-%d'))
+    return jsonify({
+        'scenarios': json.loads(scenarios.to_json(orient='records')),
+        'summary': json.loads(summary.reset_index().to_json(orient='records'))
+    })
+
+
+class NoDataError(Exception):
+    pass
+
+
+def compute_analysis(tickers, start_date, job=None):
+    """Run the EMA regression on the tickers and render its plots, returns the analyze.html context"""
+    import numpy as np
+    from etfanalyzer import ETFAnalyzer
+    from chartcache import chart_cache
+    from visualizer import new_figure
+
+    def stage(name):
+        if job is not None:
+            job.set_stage(name)
+
+    # Perform analysis
+    stage('fetch')
+    analyzer = ETFAnalyzer()
+    data = analyzer.get_data(tickers, start_date)
+
+    if data.empty:
+        raise NoDataError("Error: No data found for the given ETFs and date range")
+
+    stage('simulate')
+    results = analyzer.batch_ema_regression(data)
+
+    # Generate plots
+    stage('render')
+    plots = []
+
+    # Regression plots
+    def regression_plot(etf, group):
+        fig, ax = new_figure(figsize=(10, 6))
+        ax.scatter(group['Close'], group['Actual_EMA_10'], alpha=0.6, label='Actual EMA_10')
+        intercept = group['intercept'].iloc[0]
+        slope = group['slope'].iloc[0]
+        x_line = np.array([group['Close'].min(), group['Close'].max()])
+        y_line = intercept + slope * x_line
+        ax.plot(x_line, y_line, 'r-', label='Regression Line')
+        eqn = f"EMA_10 = {slope:.2f}*Close + {intercept:.2f}"
+        ax.text(0.05, 0.95, eqn, transform=ax.transAxes, fontsize=11,
+                verticalalignment='top', bbox=dict(facecolor='white', alpha=0.7))
+        ax.legend()
+        ax.set_title(f"{etf} EMA Regression")
+        ax.set_xlabel('Close Price')
+        ax.set_ylabel('EMA_10 Price')
+        fig.tight_layout()
+        return fig
+
+    # Time series plots
+    def time_series_plot(etf, group):
+        fig, ax = new_figure(figsize=(14, 7))
+        ax.plot(group.index, group['Actual_EMA_10'], label='Actual')
+        ax.plot(group.index, group['Predicted_EMA_10'], label='Predicted')
+        ax.set_title(f"{etf} EMA Time Series")
+        ax.set_xlabel('Date')
+        ax.set_ylabel('EMA_10 Price')
+        ax.legend()
+        fig.tight_layout()
+        return fig
+
+    for plot_type, plot in (('regression', regression_plot), ('timeseries', time_series_plot)):
+        for etf, group in results.groupby('ETF'):
+            key = chart_cache.make_key(plot_type, etf, group.drop(columns='ETF'))
+            plots.append(chart_cache.get_or_render(key, lambda plot=plot, etf=etf, group=group: plot(etf, group)))
+
+    # Prepare metrics for display
+    metrics = []
+    for etf, group in results.groupby('ETF'):
+        metrics.append({
+            'ticker': etf,
+            'r2': group['R²'].mean(),
+            'mae': group['MAE'].mean(),
+            'equation': f"EMA_10 = {group['slope'].iloc[0]:.2f}*Close + {group['intercept'].iloc[0]:.2f}"
+        })
+
+    return {
+        'plots': plots,
+        'metrics': metrics,
+        'tickers': ", ".join(tickers),
+        'start_date': start_date
+    }
+
+
 @app.route('/analyze', methods=['GET', 'POST'])
 def analyze_etfs():
     if request.method == 'POST':
@@ -97,69 +431,46 @@ def analyze_etfs():
         tickers = request.form['tickers'].upper().split(',')
         tickers = [t.strip() for t in tickers]
         start_date = request.form['start_date']
-        
-        # Perform analysis
-        analyzer = ETFAnalyzer()
-        data = analyzer.get_data(tickers, start_date)
-        
-        if data.empty:
-            return "Error: No data found for the given ETFs and date range", 400
-        
-        results = analyzer.apply_to_etfs(data, analyzer.calculate_ema_regression)
-        
-        # Generate plots
-        plots = []
-        
-        # Regression plots
-        for etf, group in results.groupby('ETF'):
-            fig = plt.figure(figsize=(10, 6))
-            plt.scatter(group['Close'], group['Actual_EMA_10'], alpha=0.6, label='Actual EMA_10')
-            intercept = group['intercept'].iloc[0]
-            slope = group['slope'].iloc[0]
-            x_line = np.array([group['Close'].min(), group['Close'].max()])
-            y_line = intercept + slope * x_line
-            plt.plot(x_line, y_line, 'r-', label='Regression Line')
-            eqn = f"EMA_10 = {slope:.2f}*Close + {intercept:.2f}"
-            plt.text(0.05, 0.95, eqn, transform=plt.gca().transAxes, fontsize=11, 
-                    verticalalignment='top', bbox=dict(facecolor='white', alpha=0.7))
-            plt.legend()
-            plt.title(f"{etf} EMA Regression")
-            plt.xlabel('Close Price')
-            plt.ylabel('EMA_10 Price')
-            plt.tight_layout()
-            plots.append(fig_to_base64(fig))
-            plt.close(fig)
-        
-        # Time series plots
-        for etf, group in results.groupby('ETF'):
-            fig = plt.figure(figsize=(14, 7))
-            plt.plot(group.index, group['Actual_EMA_10'], label='Actual')
-            plt.plot(group.index, group['Predicted_EMA_10'], label='Predicted')
-            plt.title(f"{etf} EMA Time Series")
-            plt.xlabel('Date')
-            plt.ylabel('EMA_10 Price')
-            plt.legend()
-            plt.tight_layout()
-            plots.append(fig_to_base64(fig))
-            plt.close(fig)
-        
-        # Prepare metrics for display
-        metrics = []
-        for etf, group in results.groupby('ETF'):
-            metrics.append({
-                'ticker': etf,
-                'r2': group['R²'].mean(),
-                'mae': group['MAE'].mean(),
-                'equation': f"EMA_10 = {group['slope'].iloc[0]:.2f}*Close + {group['intercept'].iloc[0]:.2f}"
-            })
-        
-        return render_template('analyze.html', 
-                             plots=plots, 
-                             metrics=metrics,
-                             tickers=", ".join(tickers),
-                             start_date=start_date)
-    
+
+        if use_jobs():
+            return enqueue('analyze_etfs', request.form.to_dict(),
+                           lambda job: compute_analysis(tickers, start_date, job=job), ANALYSIS_STAGES)
+
+        try:
+            context = compute_analysis(tickers, start_date)
+        except NoDataError as e:
+            return str(e), 400
+        return render_template('analyze.html', **context)
+
     return render_template('analyze.html')
 
+
+@app.route('/jobs/<job_id>/status')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>')
+def job_page(job_id):
+    """Progress page while the job runs, then the result page of the endpoint that submitted it"""
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    if job.status == 'failed':
+        if job.error.startswith('Error:'):
+            return job.error, 400
+        return JOB_FAILED_MESSAGE, 500
+    if job.status != 'done':
+        return render_template('job.html', job=job.to_dict())
+    if job.context['endpoint'] == 'analyze_etfs':
+        return render_template('analyze.html', **job.result)
+    return render_template('index.html', results=job.result, form=job.context['form'])
+
+if app.config['PREWARM']:
+    prewarm()
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+from etfdataretrieval import ETFDataRetrieval
+from contributionschedule import FREQUENCY_OFFSETS, WEEKLY_FREQUENCIES, period_starts, schedule_phase
+from purchaseengine import purchase_step
+from portfoliomatrix import compensated_row_sum
+from instrumentation import timed, count
+
+SCENARIO_COLUMNS = ['start_date', 'duration', 'frequency', 'initial_amount', 'periodic_amount']
+RESULT_COLUMNS = SCENARIO_COLUMNS + ['end_date', 'contributions', 'invested', 'final_net_worth', 'pnl_pct', 'cagr',
+                                     'volatility', 'sharpe_ratio']
+SUMMARY_PERCENTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+class BacktestSweep:
+    """Backtests of one allocation over a grid of start dates x durations x frequencies x amounts.
+
+    Prices are loaded once for the whole grid. The first trading day of every investment period is indexed
+    once per ticker and frequency, so the contribution dates of a scenario are a slice of that index between
+    its first periodic date and its end date. Scenarios with the same frequency run the whole-unit purchase
+    recurrence together, one vectorized step per contribution date.
+
+    Each scenario gives the CAGR, volatility and Sharpe ratio Portfolio computes for the same inputs, as long as
+    the business day before the start date is a trading day (Portfolio drops that row).
+    """
+
+    def __init__(self, etfs, data_retrieval=None):
+        self.etfs = list(etfs)  # [(ticker, allocation)]
+        self.data_retrieval = data_retrieval if data_retrieval is not None else ETFDataRetrieval()
+        self.tickers = []
+        self.allocations = None
+        self.dates = None  # union of the trading days of the tickers
+        self.previous_close = None  # dates x tickers, previous close of each ticker on its own trading days
+        self.fees = None
+        self._calendars = []  # per ticker, the rows of self.dates it trades on
+        self._periods = {}  # (ticker index, frequency, phase) -> (rows, period starts) of first trading days
+        self._loaded_range = None
+
+    @staticmethod
+    def start_dates(first, last, step='YS'):
+        """Rolling start dates from first to last, every `step` (a pandas frequency, 'YS', 'QS', 'MS'...)"""
+        return pd.date_range(first, last, freq=step)
+
+    def load_prices(self, start_date, end_date):
+        """Download the allocation once for every scenario starting from start_date and ending by end_date"""
+        start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        if self._loaded_range is not None and self._loaded_range[0] <= start_date and end_date <= self._loaded_range[1]:
+            return
+        data_dict = self.data_retrieval.portfolio_data_retrieval(
+            self.etfs, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+        )
+
+        # Same cleaning as Portfolio, every ticker on its own trading days
+        closes, fees, allocations = {}, {}, {}
+        for (ticker, _), data in data_dict.items():
+            cleaned = self.data_retrieval.data_cleaning({ticker: data})
+            if cleaned.empty:
+                print(f"Error processing {ticker}: no price data")
+                continue
+            cleaned.index = pd.to_datetime(cleaned.index).tz_localize(None)
+            closes[ticker] = cleaned['Close']
+            fees[ticker] = float(cleaned['fees'].iloc[0])
+            allocations[ticker] = float(cleaned['etf_allocation'].iloc[0])  # rounded by the cleaning, as in Portfolio
+        if not closes:
+            raise ValueError("No price data for the allocation")
+
+        close = pd.DataFrame(closes).sort_index()
+        self.tickers = list(close.columns)
+        self.dates = close.index.values
+        self.previous_close = close.ffill().shift(1).where(close.notna()).to_numpy()
+        self.fees = np.array([fees[t] for t in self.tickers])
+        self.allocations = np.array([allocations[t] for t in self.tickers])
+        self._calendars = [np.flatnonzero(close[t].notna().to_numpy()) for t in self.tickers]
+        self._periods = {}
+        self._loaded_range = (start_date, end_date)
+
+    def _first_trading_days(self, j, frequency, phase):
+        """Rows (in self.dates) of the first trading day of every period of ticker j, and the start of each period"""
+        key = (j, frequency, phase)
+        if key not in self._periods:
+            rows = self._calendars[j]
+            first_of_period, period_start = period_starts(self.dates[rows], frequency, phase)
+            self._periods[key] = (rows[first_of_period], period_start[first_of_period])
+        return self._periods[key]
+
+    @timed('sweep')
+    def run(self, start_dates, durations, frequencies=('M',), amounts=((1000, 100),), chunk_size=512):
+        """Backtest every combination of the grid, returns one row per scenario (RESULT_COLUMNS).
+
+        amounts are (initial amount, periodic amount) pairs. Scenarios are simulated chunk_size at a time.
+        """
+        for frequency in frequencies:
+            if frequency not in FREQUENCY_OFFSETS:
+                raise ValueError(f"Unknown investment frequency: {frequency}")
+        grid = pd.MultiIndex.from_product(
+            [pd.DatetimeIndex(start_dates), list(durations), list(frequencies), list(amounts)],
+            names=['start_date', 'duration', 'frequency', 'amounts']
+        ).to_frame(index=False)
+        grid['initial_amount'] = [float(a[0]) for a in grid['amounts']]
+        grid['periodic_amount'] = [float(a[1]) for a in grid['amounts']]
+        grid = grid.drop(columns='amounts')
+        # Same end date as Portfolio.configure_from_input
+        grid['end_date'] = [start + pd.DateOffset(years=int(duration))
+                            for start, duration in zip(grid['start_date'], grid['duration'])]
+        grid['end_date'] = pd.to_datetime(grid['end_date']).dt.normalize()
+        if grid.empty:
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        self.load_prices(grid['start_date'].min(), grid['end_date'].max())
+
+        results = []
+        for frequency, scenarios in grid.groupby('frequency', sort=False):
+            initial_row, lo, hi, phases = self._schedule(scenarios, frequency)
+            # Weekly periods depend on the week of each initial date, scenarios run with others of the same phase
+            for phase in dict.fromkeys(map(tuple, phases)):
+                selected = np.flatnonzero((phases == phase).all(axis=1))
+                for first in range(0, len(selected), chunk_size):
+                    chunk = selected[first:first + chunk_size]
+                    results.append(self._simulate(scenarios.iloc[chunk], frequency, phase,
+                                                  initial_row[chunk], lo[chunk], hi[chunk]))
+        count('etf_backtests_total', len(grid))
+        return pd.concat(results).loc[grid.index, RESULT_COLUMNS].reset_index(drop=True)
+
+    def _schedule(self, scenarios, frequency):
+        """Per scenario and ticker: row of the initial investment (-1 if none), the [lo, hi) slice of the
+        ticker's first trading days that are periodic investment dates, and the weekly phase"""
+        n_tickers = len(self.tickers)
+        starts = scenarios['start_date'].to_numpy(dtype='datetime64[ns]')
+        ends = scenarios['end_date'].to_numpy(dtype='datetime64[ns]')
+        initial_row = np.full((len(scenarios), n_tickers), -1)
+        initial_dates = np.empty((len(scenarios), n_tickers), dtype='datetime64[ns]')
+        phases = np.zeros((len(scenarios), n_tickers), dtype=np.int64)
+        lo = np.zeros((len(scenarios), n_tickers), dtype=np.int64)
+        hi = np.zeros((len(scenarios), n_tickers), dtype=np.int64)
+
+        for j, rows in enumerate(self._calendars):
+            calendar = self.dates[rows]
+            position = np.searchsorted(calendar, starts)
+            found = position < len(rows)
+            position = np.minimum(position, len(rows) - 1)
+            # Portfolio only downloads [start - 1 business day, end), the initial date must be before the end
+            found &= calendar[position] < ends
+            initial_row[found, j] = rows[position[found]]
+            initial_dates[:, j] = np.where(found, calendar[position], starts)
+            if frequency in WEEKLY_FREQUENCIES:
+                phases[:, j] = [schedule_phase(d, frequency) for d in initial_dates[:, j]]
+
+            first_periodic = (pd.DatetimeIndex(initial_dates[:, j]) + FREQUENCY_OFFSETS[frequency]).values
+            for phase in np.unique(phases[:, j]):
+                first_rows, period_start = self._first_trading_days(j, frequency, phase)
+                selected = phases[:, j] == phase
+                lo[selected, j] = np.searchsorted(period_start, first_periodic[selected])
+                hi[selected, j] = np.searchsorted(self.dates[first_rows], ends[selected])
+        hi = np.where(initial_row >= 0, np.maximum(hi, lo), lo)  # empty slices when there is no initial date
+        return initial_row, lo, hi, phases
+
+    def _simulate(self, scenarios, frequency, phases, initial_row, lo, hi):
+        """Purchase recurrence of a chunk of scenarios sharing a frequency and phases, one step per row of
+        self.dates where any of them invests"""
+        n_scenarios, n_tickers = len(scenarios), len(self.tickers)
+
+        # Position of every row in each ticker's list of first trading days (-1 for the other rows)
+        positions = np.full((n_tickers, len(self.dates)), -1)
+        steps = np.zeros(len(self.dates), dtype=bool)
+        steps[initial_row[initial_row >= 0]] = True
+        for j in range(n_tickers):
+            rows, _ = self._first_trading_days(j, frequency, phases[j])
+            positions[j, rows] = np.arange(len(rows))
+            # Union of the [lo, hi) slices of all scenarios, as a cumulative sum of +1/-1 at the slice bounds
+            bounds = np.zeros(len(rows) + 1, dtype=np.int64)
+            np.add.at(bounds, lo[:, j], 1)
+            np.add.at(bounds, hi[:, j], -1)
+            steps[rows[np.cumsum(bounds)[:-1] > 0]] = True
+        steps = np.flatnonzero(steps)
+
+        initial_amount = scenarios['initial_amount'].to_numpy()[:, None] * self.allocations
+        periodic_amount = scenarios['periodic_amount'].to_numpy()[:, None] * self.allocations
+        price_factor = 1 + self.fees
+        leftover = np.zeros((n_scenarios, n_tickers))
+        total_units = np.zeros((n_scenarios, n_tickers))
+        invested = np.zeros((n_scenarios, n_tickers))
+        last_net_worth = np.zeros((n_scenarios, n_tickers))
+        last_invested = np.zeros((n_scenarios, n_tickers))
+        cumulative_investment = np.zeros(n_scenarios)
+        # Portfolio_PnL_% of every step and the number of ETFs invested that day (its rows in the long frame)
+        pnl = np.full((len(steps), n_scenarios), np.nan)
+        rows_per_step = np.zeros((len(steps), n_scenarios), dtype=np.int64)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for k, row in enumerate(steps):
+                position = positions[:, row]
+                contribution = (np.where((lo <= position) & (position < hi), periodic_amount, 0.0)
+                                + np.where(initial_row == row, initial_amount, 0.0))
+                active = contribution != 0
+                price = self.previous_close[row] * price_factor
+                _, leftover, total_units, net_worth = purchase_step(contribution, leftover, total_units, price,
+                                                                    active & np.isfinite(price))
+                invested += contribution
+                last_net_worth = np.where(active, net_worth, last_net_worth)
+                last_invested = np.where(active, invested, last_invested)
+
+                # Portfolio totals of the day, summed over the ETFs invested that day as compute_totals does
+                cumulative_investment += compensated_row_sum(contribution, active)
+                portfolio_net_worth = compensated_row_sum(net_worth, active)
+                pnl[k] = ((portfolio_net_worth / cumulative_investment - 1) * 100).round(2)
+                rows_per_step[k] = active.sum(axis=1)
+
+            weights = np.where(np.isnan(pnl), 0, rows_per_step)
+            values = np.where(weights > 0, pnl, 0.0)
+            n_rows = weights.sum(axis=0)
+            mean = (weights * values).sum(axis=0) / n_rows
+            volatility = np.sqrt((weights * (values - mean) ** 2).sum(axis=0) / (n_rows - 1)).round(2)
+            taken = rows_per_step > 0
+            last_step = len(steps) - 1 - np.argmax(taken[::-1], axis=0) if len(steps) else np.zeros(n_scenarios, int)
+            final_pnl = pnl[last_step, np.arange(n_scenarios)] if len(steps) else np.full(n_scenarios, np.nan)
+
+            final_net_worth = last_net_worth.sum(axis=1)
+            total_invested = last_invested.sum(axis=1)
+            durations = scenarios['duration'].to_numpy(dtype=float)
+            cagr = (((final_net_worth / total_invested) ** (1 / durations) - 1) * 100).round(2)
+            sharpe = ((final_pnl - 2) / volatility).round(2)
+
+        result = scenarios.copy()
+        result['contributions'] = taken.sum(axis=0)
+        result['invested'] = total_invested
+        result['final_net_worth'] = final_net_worth
+        result['pnl_pct'] = final_pnl
+        result['cagr'] = cagr
+        result['volatility'] = volatility
+        result['sharpe_ratio'] = sharpe
+        missing = result['contributions'] == 0
+        result.loc[missing, ['invested', 'final_net_worth', 'pnl_pct', 'cagr', 'volatility', 'sharpe_ratio']] = np.nan
+        return result
+
+    @staticmethod
+    def summarize(results, by=('duration', 'frequency', 'initial_amount', 'periodic_amount'),
+                  metrics=('cagr', 'final_net_worth', 'volatility')):
+        """Distribution of the metrics across start dates: count, mean, std, min, percentiles and max per group,
+        and the share of scenarios ending below the amount invested"""
+        results = results.dropna(subset=['final_net_worth'])
+        grouped = results.groupby(list(by))
+        summary = grouped[list(metrics)].describe(percentiles=SUMMARY_PERCENTILES)
+        summary[('probability_of_loss', '')] = (results['final_net_worth'] < results['invested']).groupby(
+            [results[col] for col in by]).mean()
+        return summary
@@ -0,0 +1,617 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+import numpy as np
+import pandas as pd
+from purchaseengine import simulate_purchases
+
+
+def legacy_purchase_loop(df):
+    """Row-by-row .at implementation apply_ETF_purchase used before the array kernel, kept as reference"""
+    df = df.copy()
+    df['etf_units_purchased'] = 0
+    df['total_etf_units'] = 0
+    df['cash'] = 0.0
+    df['ETF_net_worth'] = 0.0
+    df['ETF_PnL'] = 0.0
+    df['ETF_PnL_%'] = 0.0
+
+    leftover = 0.0
+    total_units = 0.0
+    for idx in df.index:
+        investment = df.at[idx, 'investment'] + leftover
+        price = df.at[idx, 'previous_day_price_closure'] * (1 + df.at[idx, 'fees'])
+        units_bought = np.floor(investment / price)
+        spent = units_bought * price
+        leftover = investment - spent
+        total_units += units_bought
+
+        df.at[idx, 'etf_units_purchased'] = units_bought
+        df.at[idx, 'cash'] = leftover
+        df.at[idx, 'total_etf_units'] = total_units
+        df.at[idx, 'ETF_net_worth'] = total_units * price + leftover
+        df.at[idx, 'ETF_PnL'] = df.at[idx, 'ETF_net_worth'] - df.at[idx, 'etf_cumulative_investment']
+        df.at[idx, 'ETF_PnL_%'] = ((df.at[idx, 'ETF_net_worth'] / df.at[idx, 'etf_cumulative_investment'] - 1) * 100).round(2)
+    return df
+
+
+def synthetic_purchase_frames(n_dates, n_tickers, seed=0):
+    """Contribution frames shaped like the output of apply_periodic_investment"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('1990-01-01', periods=n_dates, name='Date')
+    frames = {}
+    for i in range(n_tickers):
+        close = 50 * np.exp(np.cumsum(rng.normal(0.0003, 0.012, n_dates)))
+        investment = np.full(n_dates, 200.0)
+        investment[0] = 1000.0
+        frames[f"ETF{i}"] = pd.DataFrame({
+            'previous_day_price_closure': close.round(2),
+            'fees': rng.uniform(0, 0.008),
+            'investment': investment,
+            'etf_cumulative_investment': investment.cumsum()
+        }, index=dates)
+    return frames
+
+
+def benchmark_purchase_kernel(n_dates=1560, n_tickers=20, repeat=3):
+    """Time the legacy .at loop against the array kernel (per ticker and as one matrix call)"""
+    frames = synthetic_purchase_frames(n_dates, n_tickers)
+    columns = ['etf_units_purchased', 'total_etf_units', 'cash', 'ETF_net_worth', 'ETF_PnL', 'ETF_PnL_%']
+
+    start = time.perf_counter()
+    legacy = {ticker: legacy_purchase_loop(df) for ticker, df in frames.items()}
+    legacy_time = time.perf_counter() - start
+
+    def run_series():
+        return {ticker: simulate_purchases(df['investment'].to_numpy(), df['previous_day_price_closure'].to_numpy(),
+                                           df['fees'].to_numpy()) for ticker, df in frames.items()}
+
+    def run_matrix():
+        stack = lambda col: np.column_stack([df[col].to_numpy() for df in frames.values()])
+        return simulate_purchases(stack('investment'), stack('previous_day_price_closure'), stack('fees'))
+
+    timings = {}
+    for name, func in (('series', run_series), ('matrix', run_matrix)):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            best = min(best, time.perf_counter() - start)
+        timings[name] = (best, result)
+
+    # Results must be identical to the legacy loop, not only close
+    series, matrix = timings['series'][1], timings['matrix'][1]
+    for i, (ticker, df) in enumerate(legacy.items()):
+        for col in columns:
+            expected = df[col].to_numpy(dtype=float)
+            assert np.array_equal(series[ticker][col], expected), (ticker, col)
+            assert np.array_equal(matrix[col][:, i], expected), (ticker, col)
+
+    print(f"\n=== Purchase kernel: {n_tickers} ETFs x {n_dates} contribution dates ===")
+    print(f"legacy .at loop : {legacy_time * 1000:10.1f} ms")
+    for name in ('series', 'matrix'):
+        best = timings[name][0]
+        print(f"kernel ({name}) : {best * 1000:10.1f} ms  ({legacy_time / best:6.0f}x)")
+
+
+
+PIPELINE_STAGES = ['configure', 'periodic_investment', 'purchase', 'metrics', 'optimize', 'render']
+DEFAULT_ETF_COUNTS = [1, 10, 50]
+DEFAULT_DURATIONS = [1, 10, 40]
+DEFAULT_FREQUENCIES = ['M', 'W']
+PIPELINE_END_DATE = pd.Timestamp('2025-01-01')
+
+
+def run_pipeline(data_retrieval, n_etfs, duration, frequency, optimize=True, on_stage=None):
+    """Run the / request pipeline once on the given data source, returns {stage: seconds}.
+
+    on_stage(stage) is called right after each stage finished.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from portfolio import Portfolio
+    from optimizedportfolio import OptimizedPortfolio
+    from benchmarkcache import benchmark_cache
+    from chartcache import fig_to_png
+
+    benchmark_cache.clear()  # every run simulates the benchmark, as a first request would
+    etfs = [(f"SYN{i:02d}", 1.0 / n_etfs) for i in range(n_etfs)]
+    start_date = (PIPELINE_END_DATE - pd.DateOffset(years=duration)).strftime('%Y-%m-%d')
+    timings = {}
+
+    def timed(stage, func):
+        start = time.perf_counter()
+        result = func()
+        timings[stage] = time.perf_counter() - start
+        if on_stage is not None:
+            on_stage(stage)
+        return result
+
+    portfolio = Portfolio(data_retrieval=data_retrieval)
+    timed('configure', lambda: portfolio.configure_from_input(1000, 200, start_date, duration, etfs, frequency))
+    timed('periodic_investment', portfolio.apply_periodic_investment)
+    timed('purchase', portfolio.apply_ETF_purchase)
+    metrics = timed('metrics', lambda: portfolio.calculate_all_metrics(render_plots=False))
+
+    figures = []
+    if optimize:
+        optimized = OptimizedPortfolio(data_retrieval=data_retrieval)
+        timed('optimize', lambda: optimized.create_optimized_portfolio(1000, 200, start_date, duration, frequency))
+        figures.append(lambda: optimized.compare_with_user_portfolio(metrics['data']))
+
+    def render():
+        # Drawn and encoded without the chart cache, which would hide the rendering cost
+        for fig in list(portfolio.visualizer.get_plots()) + [make() for make in figures]:
+            fig_to_png(fig, 72)
+            plt.close(fig)
+    timed('render', render)
+    return timings
+
+
+def benchmark_pipeline(etf_counts=DEFAULT_ETF_COUNTS, durations=DEFAULT_DURATIONS, frequencies=DEFAULT_FREQUENCIES,
+                       repeat=3, optimize=True, fixture_dir=None):
+    """Time every pipeline stage across portfolio sizes, durations and frequencies on synthetic prices.
+
+    Timings come from `repeat` plain runs (mean and p95), the peak memory of each stage from one more
+    run under tracemalloc, which would otherwise distort the timings.
+    """
+    from syntheticprices import SyntheticDataRetrieval
+    data_retrieval = SyntheticDataRetrieval(fixture_dir=fixture_dir)
+    # Warm-up: generates every ticker's prices and loads matplotlib before anything is timed
+    run_pipeline(data_retrieval, max(etf_counts), min(durations), frequencies[0], optimize)
+    cases = []
+    for n_etfs in etf_counts:
+        for duration in durations:
+            for frequency in frequencies:
+                runs = [run_pipeline(data_retrieval, n_etfs, duration, frequency, optimize) for _ in range(repeat)]
+
+                peaks = {}
+
+                def record_peak(stage):
+                    peaks[stage] = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.reset_peak()
+
+                tracemalloc.start()
+                try:
+                    run_pipeline(data_retrieval, n_etfs, duration, frequency, optimize, on_stage=record_peak)
+                finally:
+                    tracemalloc.stop()
+
+                stages = {}
+                for stage in runs[0]:
+                    seconds = np.array([run[stage] for run in runs])
+                    stages[stage] = {
+                        'mean_ms': round(float(seconds.mean()) * 1000, 3),
+                        'p95_ms': round(float(np.percentile(seconds, 95)) * 1000, 3),
+                        'peak_mb': round(peaks.get(stage, 0) / 1024 ** 2, 3)
+                    }
+                total = np.array([sum(run.values()) for run in runs])
+                case = {
+                    'etfs': n_etfs,
+                    'years': duration,
+                    'frequency': frequency,
+                    'stages': stages,
+                    'total': {'mean_ms': round(float(total.mean()) * 1000, 3),
+                              'p95_ms': round(float(np.percentile(total, 95)) * 1000, 3)}
+                }
+                cases.append(case)
+                print(format_case(case))
+    return {
+        'created': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor()
+        },
+        'repeat': repeat,
+        'cases': cases
+    }
+
+
+def benchmark_montecarlo(paths=100_000, years=(10, 30), frequencies=('M', 'W'), n_etfs=5, seed=0):
+    """Throughput of the Monte Carlo forecaster (paths per second) for each method on synthetic history"""
+    from montecarlo import MonteCarloForecaster, METHODS
+    from syntheticprices import SyntheticPriceProvider
+    provider = SyntheticPriceProvider()
+    tickers = [f"SYN{i:02d}" for i in range(n_etfs)]
+    close = pd.DataFrame({t: provider.ticker_history(t, '2005-01-01', '2025-01-01')['Close'] for t in tickers})
+    forecaster = MonteCarloForecaster(close, {t: 0.002 for t in tickers}, {t: 1 / n_etfs for t in tickers})
+
+    print(f"\n=== Monte Carlo forecast: {paths:,} paths, {n_etfs} ETFs ===")
+    results = []
+    for duration in years:
+        for frequency in frequencies:
+            for method in METHODS:
+                tracemalloc.start()
+                start = time.perf_counter()
+                result = forecaster.forecast(1000, 200, duration, frequency, paths=paths, method=method, seed=seed)
+                seconds = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                results.append({'years': duration, 'frequency': frequency, 'method': method,
+                                'paths_per_second': round(paths / seconds), 'peak_mb': round(peak / 1024 ** 2, 1)})
+                print(f"{duration:>2}y {frequency:<2} {method:<16} {paths / seconds:12,.0f} paths/s  "
+                      f"peak {peak / 1024 ** 2:7.1f} MB  median final {np.median(result.final_net_worth):12,.0f}")
+    return results
+
+
+def benchmark_sweep(n_etfs=3, durations=(5, 10, 20), frequencies=('M', 'W'), starts=20, check=10, seed=0):
+    """Cost per scenario of a rolling-start sweep against one Portfolio run per scenario, on synthetic prices.
+
+    `check` scenarios drawn at random are also run through Portfolio, their metrics must be identical.
+    """
+    from backtestsweep import BacktestSweep
+    from portfolio import Portfolio
+    from syntheticprices import SyntheticDataRetrieval
+    data_retrieval = SyntheticDataRetrieval()
+    etfs = [(f"SYN{i:02d}", 1.0 / n_etfs) for i in range(n_etfs)]
+    start_dates = pd.date_range('1995-01-01', periods=starts, freq='QS')
+    amounts = [(1000, 200), (10000, 0), (0, 500)]
+
+    sweep = BacktestSweep(etfs, data_retrieval=data_retrieval)
+    start = time.perf_counter()
+    sweep.load_prices(start_dates[0], start_dates[-1] + pd.DateOffset(years=max(durations)))
+    load_time = time.perf_counter() - start
+    results = sweep.run(start_dates, durations, frequencies, amounts)
+    sweep_time = time.perf_counter() - start - load_time
+
+    rng = np.random.default_rng(seed)
+    portfolio_time = 0.0
+    for i in rng.choice(len(results), min(check, len(results)), replace=False):
+        scenario = results.iloc[i]
+        start = time.perf_counter()
+        portfolio = Portfolio(data_retrieval=data_retrieval)
+        portfolio.configure_from_input(scenario['initial_amount'], scenario['periodic_amount'],
+                                       scenario['start_date'].strftime('%Y-%m-%d'), int(scenario['duration']),
+                                       etfs, scenario['frequency'])
+        cagr = portfolio.apply_CAGR_ratio().loc['TOTAL', 'CAGR']
+        volatility, sharpe = portfolio.apply_SHARPE_ratio()
+        portfolio_time += time.perf_counter() - start
+        assert (cagr, volatility.loc['TOTAL', 'volatility'], sharpe) == \
+            (scenario['cagr'], scenario['volatility'], scenario['sharpe_ratio']), dict(scenario)
+
+    per_portfolio = portfolio_time / min(check, len(results))
+    per_scenario = sweep_time / len(results)
+    print(f"\n=== Rolling-start sweep: {len(results)} scenarios, {n_etfs} ETFs ===")
+    print(f"price load (once)          : {load_time * 1000:10.1f} ms")
+    print(f"sweep                      : {sweep_time * 1000:10.1f} ms  {per_scenario * 1000:8.2f} ms/scenario")
+    print(f"Portfolio per scenario     : {per_portfolio * 1000:10.1f} ms  ({per_portfolio / per_scenario:6.0f}x)")
+    return {'scenarios': len(results), 'load_ms': load_time * 1000, 'sweep_ms': sweep_time * 1000, 'portfolio_ms': per_portfolio * 1000}
+
+
+def benchmark_rebalancing(n_tickers=20, years=30, repeat=3, seed=0):
+    """Time the rebalancing kernel on a daily date x ticker matrix with monthly contributions"""
+    from contributionschedule import build_contribution_schedule
+    from rebalancing import simulate_rebalancing
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('1990-01-01', periods=252 * years)
+    close = 50 * np.exp(np.cumsum(rng.normal(0.0003, 0.012, (len(dates), n_tickers)), axis=0))
+    previous_close = np.vstack([np.full(n_tickers, np.nan), close[:-1]]).round(2)
+    weights = rng.dirichlet(np.ones(n_tickers))
+    initial_date, periodic_dates = build_contribution_schedule(dates[1:], dates[1], 'M')
+    investment = np.zeros(close.shape)
+    investment[dates.get_indexer(periodic_dates)] = 1000 * weights
+    investment[dates.get_loc(initial_date)] += 10000 * weights
+
+    print(f"\n=== Rebalancing: {n_tickers} ETFs x {len(dates)} trading days ===")
+    for name, options in (('no rebalancing', {}),
+                          ('quarterly', {'rebalance_dates': dates.isin(build_contribution_schedule(dates, dates[1], 'Q')[1])}),
+                          ('yearly', {'rebalance_dates': dates.isin(build_contribution_schedule(dates, dates[1], 'Y')[1])}),
+                          ('drift > 5%', {'threshold': 0.05}),
+                          ('drift > 1%', {'threshold': 0.01})):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows, columns, rebalanced = simulate_rebalancing(investment, previous_close, 0.002, weights, **options)
+            best = min(best, time.perf_counter() - start)
+        print(f"{name:<16} {best * 1000:8.1f} ms  {len(rows):5d} rows  {int(rebalanced.sum()):4d} rebalances")
+
+
+def benchmark_analysis(ticker_counts=(10, 100, 500), start_date='2015-01-01'):
+    """Batched EMA regression against the per-ticker sklearn loop of apply_to_etfs, on synthetic prices"""
+    from etfanalyzer import ETFAnalyzer
+    from syntheticprices import SyntheticDataRetrieval
+    analyzer = ETFAnalyzer()
+    analyzer.data_handler = SyntheticDataRetrieval()
+    print("\n=== EMA regression ===")
+    for n_tickers in ticker_counts:
+        data = analyzer.get_data([f"SYN{i:03d}" for i in range(n_tickers)], start_date)
+        start = time.perf_counter()
+        batched = analyzer.batch_ema_regression(data)
+        batch_time = time.perf_counter() - start
+        start = time.perf_counter()
+        looped = analyzer.apply_to_etfs(data, analyzer.calculate_ema_regression)
+        loop_time = time.perf_counter() - start
+        assert batched.index.equals(looped.index) and np.allclose(batched['slope'], looped['slope'], rtol=1e-9)
+        print(f"{n_tickers:4d} tickers  batched {batch_time * 1000:8.1f} ms  per ticker {loop_time * 1000:8.1f} ms"
+              f"  ({loop_time / batch_time:5.0f}x)")
+
+
+def benchmark_walk_forward(n_tickers=(1, 10, 50), years=20, horizons=(1, 5, 20), window=252):
+    """Walk-forward forecasts refitted every day over `years` of synthetic daily prices"""
+    from etfanalyzer import ETFAnalyzer
+    from syntheticprices import SyntheticDataRetrieval
+    analyzer = ETFAnalyzer()
+    analyzer.data_handler = SyntheticDataRetrieval()
+    start_date = (pd.Timestamp.today() - pd.DateOffset(years=years)).strftime('%Y-%m-%d')
+    print(f"\n=== Walk-forward forecasts: {years} years, horizons {horizons}, {window}-day windows ===")
+    for n in n_tickers:
+        data = analyzer.get_data([f"SYN{i:03d}" for i in range(n)], start_date)
+        for expanding in (False, True):
+            start = time.perf_counter()
+            summary = analyzer.walk_forward_forecast(data, horizons, window, expanding=expanding)
+            elapsed = time.perf_counter() - start
+            print(f"{n:4d} tickers {'expanding' if expanding else 'rolling':>9}  {elapsed * 1000:8.1f} ms"
+                  f"  {int(summary['windows'].sum()):8d} refits")
+
+
+def benchmark_incremental(n_etfs=5, years=(5, 20), repeat=5):
+    """One new daily bar applied to a saved PortfolioState against a full recompute of the portfolio"""
+    from portfolio import Portfolio
+    from portfoliostate import PortfolioState
+    from syntheticprices import SyntheticDataRetrieval
+    data_retrieval = SyntheticDataRetrieval()
+    etfs = [(f"SYN{i:02d}", 1.0 / n_etfs) for i in range(n_etfs)]
+    print(f"\n=== Incremental update: {n_etfs} ETFs, one new bar ===")
+    for duration in years:
+        portfolio = Portfolio(data_retrieval=data_retrieval)
+        portfolio.configure_from_input(1000, 100, '2000-01-03', duration, etfs, 'W')
+        saved = portfolio.simulation_state().to_dict()
+        end = pd.Timestamp(portfolio.end_date)
+        bars = data_retrieval.fetch_batch([t for t, _ in etfs], end, end + pd.offsets.BDay(1)).data
+
+        advance_time = recompute_time = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            PortfolioState.from_dict(saved, data_retrieval).advance(bars)
+            advance_time = min(advance_time, time.perf_counter() - start)
+            start = time.perf_counter()
+            recompute = Portfolio(data_retrieval=data_retrieval)
+            recompute.configure_from_input(1000, 100, '2000-01-03', duration, etfs, 'W')
+            recompute.simulation_matrix
+            recompute_time = min(recompute_time, time.perf_counter() - start)
+        print(f"{duration:3d} years  advance {advance_time * 1000:7.2f} ms  full recompute {recompute_time * 1000:8.1f} ms"
+              f"  ({recompute_time / advance_time:5.0f}x)")
+
+
+def process_memory():
+    """Private (RssAnon) and file-backed (RssFile, shared page cache) resident memory of this process in MB,
+    from /proc/self/status (Linux)"""
+    with open('/proc/self/status') as f:
+        fields = dict(line.split(':', 1) for line in f)
+    return {key: int(fields[key].split()[0]) / 1024 for key in ('RssAnon', 'RssFile')}
+
+
+def load_prices_worker(source, tickers, start_date):
+    """Load the histories of the tickers as a web worker would (from the segment at `source`, or synthetic
+    prices downloaded into pandas frames), keep them and return the memory this took"""
+    before = process_memory()
+    start = time.perf_counter()
+    if source is None:
+        from syntheticprices import SyntheticPriceProvider
+        provider = SyntheticPriceProvider()
+    else:
+        from priceproviders import SharedSegmentProvider
+        provider = SharedSegmentProvider(source)
+    end_date = pd.Timestamp.today().normalize()
+    frames = [provider.ticker_history(ticker, start_date, end_date) for ticker in tickers]
+    total = sum(float(frame['Close'].sum()) for frame in frames)  # touch every page like a computation would
+    elapsed = time.perf_counter() - start
+    after = process_memory()
+    return {key: after[key] - before[key] for key in after}, elapsed, total
+
+
+def benchmark_segment(workers=4, n_tickers=100, start_date='1995-01-01'):
+    """Memory of `workers` processes holding the histories of n_tickers, each with its own pandas copies
+    against all of them reading one shared price segment"""
+    import multiprocessing
+    import tempfile
+    from pricesegment import PriceSegment
+    from syntheticprices import SyntheticPriceProvider
+    tickers = [f"SYN{i:03d}" for i in range(n_tickers)]
+    provider = SyntheticPriceProvider()
+    end_date = pd.Timestamp.today().normalize()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'prices.seg')
+        start = time.perf_counter()
+        PriceSegment.write(path, {ticker: provider.ticker_history(ticker, start_date, end_date) for ticker in tickers})
+        print(f"\n=== Shared price segment: {workers} workers, {n_tickers} tickers since {start_date} ===")
+        print(f"segment written in {time.perf_counter() - start:.1f} s, {os.path.getsize(path) / 2 ** 20:.1f} MB")
+        context = multiprocessing.get_context('spawn')  # fresh workers, nothing inherited from this process
+        for label, source in (('pandas copies', None), ('shared segment', path)):
+            with context.Pool(workers) as pool:
+                results = pool.starmap(load_prices_worker, [(source, tickers, start_date)] * workers)
+            private = sum(memory['RssAnon'] for memory, _, _ in results)
+            mapped = max(memory['RssFile'] for memory, _, _ in results)
+            load = max(elapsed for _, elapsed, _ in results)
+            print(f"{label:>15}  private {private:8.1f} MB total ({private / workers:7.1f} MB per worker)"
+                  f"  file-backed {mapped:7.1f} MB shared  load {load * 1000:8.1f} ms")
+
+
+def import_tree(code):
+    """Run code in a fresh interpreter with -X importtime, returns (its stdout, the imports as (level, module,
+    cumulative ms, children) trees in import order, top-level ones only)"""
+    run = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                         capture_output=True, text=True, check=True)
+    pending = {}  # level -> imports done at that level since their parent started
+    for line in run.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        node = (level, name.strip(), int(cumulative) / 1000, pending.pop(level + 1, []))
+        pending.setdefault(level, []).append(node)
+    return run.stdout, pending.get(0, [])
+
+
+def benchmark_startup(repeat=5):
+    """Wall and per-module import times of app.py, and of the modules it loads lazily (prewarm), best of
+    `repeat` fresh interpreters. Modules: app and what it imports, then each of app.HEAVY_MODULES."""
+    timer = "import time; start = time.perf_counter(); {}; print((time.perf_counter() - start) * 1000)"
+    totals, modules = {}, {}
+
+    def keep(name, value):
+        modules[name] = min(modules.get(name, value), value)
+
+    for _ in range(repeat):
+        out, tree = import_tree(timer.format('import app'))
+        totals['import_app_ms'] = min(totals.get('import_app_ms', float('inf')), float(out))
+        for _, name, ms, children in tree:
+            if name == 'app':
+                keep('app', ms)
+                for _, child, child_ms, _ in children:
+                    keep(f"app > {child}", child_ms)
+        out, tree = import_tree("import app; " + timer.format('app.prewarm(background=False)'))
+        totals['prewarm_ms'] = min(totals.get('prewarm_ms', float('inf')), float(out))
+        seen_app = False
+        for _, name, ms, _ in tree:
+            if seen_app:
+                keep(f"prewarm > {name}", ms)
+            seen_app = seen_app or name == 'app'
+
+    print("\n=== Startup (python -X importtime, best of %d) ===" % repeat)
+    print(f"import app                       {totals['import_app_ms']:9.1f} ms")
+    print(f"prewarm (lazy modules)           {totals['prewarm_ms']:9.1f} ms")
+    for name, ms in sorted(modules.items(), key=lambda item: -item[1]):
+        if ms >= 1:
+            print(f"  {name:<30} {ms:9.1f} ms")
+    return {
+        'created': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'startup': {**totals, 'modules': modules}
+    }
+
+
+def compare_startup(report, baseline, threshold=1.2, min_delta_ms=20):
+    """Print the import times against a saved startup baseline, returns the regressions above threshold
+    (and at least min_delta_ms slower, import times of a few ms are noisy)"""
+    old, new = baseline['startup'], report['startup']
+    regressions = []
+    print(f"\n=== Against baseline of {baseline['created']} (regression above {threshold:.2f}x) ===")
+    rows = [(name, old[name], new[name]) for name in ('import_app_ms', 'prewarm_ms')]
+    rows += [(name, old['modules'][name], ms) for name, ms in new['modules'].items() if name in old['modules']]
+    for name, before, after in rows:
+        if after >= 1 or before >= 1:
+            ratio = after / before if before else float('inf')
+            flag = ''
+            if ratio > threshold and after - before >= min_delta_ms:
+                regressions.append((name, ratio))
+                flag = '  REGRESSION'
+            print(f"{name:<32} {before:9.1f}ms -> {after:9.1f}ms ({ratio:5.2f}x){flag}")
+    for name in new['modules'].keys() - old['modules'].keys():
+        if new['modules'][name] >= min_delta_ms:
+            regressions.append((name, float('inf')))
+            print(f"{name:<32} new import {new['modules'][name]:9.1f}ms  REGRESSION")
+    return regressions
+
+
+def case_id(case):
+    return f"{case['etfs']} ETFs / {case['years']}y / {case['frequency']}"
+
+
+def format_case(case):
+    stages = '  '.join(f"{stage} {values['mean_ms']:.1f}ms" for stage, values in case['stages'].items())
+    return f"{case_id(case):<20} total {case['total']['mean_ms']:9.1f}ms (p95 {case['total']['p95_ms']:.1f})  {stages}"
+
+
+def compare_with_baseline(report, baseline, threshold=1.2):
+    """Print the change of every stage against a saved baseline, returns the regressions above threshold"""
+    previous = {case_id(case): case for case in baseline['cases']}
+    regressions = []
+    print(f"\n=== Against baseline of {baseline['created']} (regression above {threshold:.2f}x) ===")
+    for case in report['cases']:
+        old = previous.get(case_id(case))
+        if old is None:
+            continue
+        for stage, values in case['stages'].items():
+            if stage not in old['stages'] or not old['stages'][stage]['mean_ms']:
+                continue
+            ratio = values['mean_ms'] / old['stages'][stage]['mean_ms']
+            flag = ''
+            if ratio > threshold:
+                regressions.append((case_id(case), stage, ratio))
+                flag = '  REGRESSION'
+            print(f"{case_id(case):<20} {stage:<20} {old['stages'][stage]['mean_ms']:9.1f}ms -> "
+                  f"{values['mean_ms']:9.1f}ms ({ratio:5.2f}x){flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the portfolio pipeline on synthetic prices")
+    parser.add_argument('--kernel', action='store_true', help="only run the purchase kernel benchmark")
+    parser.add_argument('--montecarlo', type=int, metavar='PATHS', help="only run the forecast throughput benchmark")
+    parser.add_argument('--sweep', action='store_true', help="only run the rolling-start sweep benchmark")
+    parser.add_argument('--rebalance', action='store_true', help="only run the rebalancing kernel benchmark")
+    parser.add_argument('--analysis', action='store_true', help="only run the EMA regression benchmark")
+    parser.add_argument('--walk-forward', action='store_true', help="only run the walk-forward forecast benchmark")
+    parser.add_argument('--incremental', action='store_true', help="only run the incremental daily update benchmark")
+    parser.add_argument('--segment', type=int, metavar='WORKERS',
+                        help="only run the shared price segment memory benchmark with this many worker processes")
+    parser.add_argument('--startup', action='store_true',
+                        help="only run the import time benchmark (with --save/--compare for a startup baseline)")
+    parser.add_argument('--etfs', type=int, nargs='+', default=DEFAULT_ETF_COUNTS)
+    parser.add_argument('--years', type=int, nargs='+', default=DEFAULT_DURATIONS)
+    parser.add_argument('--frequencies', nargs='+', default=DEFAULT_FREQUENCIES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-optimize', action='store_true', help="skip the optimized portfolio stage")
+    parser.add_argument('--fixtures', help="directory of <TICKER>.csv/.parquet files (and metadata.json) served instead of synthetic prices")
+    parser.add_argument('--save', help="write the results to this baseline JSON file")
+    parser.add_argument('--compare', help="baseline JSON file to compare the results with")
+    parser.add_argument('--threshold', type=float, default=1.2, help="slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+    warnings.simplefilter('ignore', RuntimeWarning)  # flat one-year synthetic portfolios have a zero volatility
+
+    if args.kernel:
+        benchmark_purchase_kernel()
+        return 0
+    if args.montecarlo:
+        benchmark_montecarlo(args.montecarlo, args.years, args.frequencies)
+        return 0
+    if args.sweep:
+        benchmark_sweep()
+        return 0
+    if args.rebalance:
+        benchmark_rebalancing()
+        return 0
+    if args.analysis:
+        benchmark_analysis()
+        return 0
+    if args.walk_forward:
+        benchmark_walk_forward()
+        return 0
+    if args.incremental:
+        benchmark_incremental()
+        return 0
+    if args.segment:
+        benchmark_segment(args.segment)
+        return 0
+
+    if args.startup:
+        report, compare = benchmark_startup(args.repeat), compare_startup
+    else:
+        report = benchmark_pipeline(args.etfs, args.years, args.frequencies, args.repeat,
+                                    not args.no_optimize, args.fixtures)
+        compare = compare_with_baseline
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class BenchmarkCache:
+    """Process-wide LRU cache of benchmark simulations (data, CAGR, Sharpe) bounded by memory size"""
+
+    def __init__(self, max_bytes=256 * 1024 ** 2, tickers=('ACWI',), open_window_ttl=3600):
+        self.max_bytes = max_bytes
+        self.tickers = list(tickers)  # benchmarks precomputed by precompute()
+        # Seconds a benchmark whose window reaches today is kept: new bars extend it, like the price store ranges
+        self.open_window_ttl = open_window_ttl
+        self._entries = OrderedDict()  # key -> (result, size in bytes, monotonic expiry or None)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(ticker, initial_amount, periodic_amount, start_date, duration, frequency, source='yfinance'):
+        """source is the name of the price provider the benchmark prices come from"""
+        return (ticker, float(initial_amount), float(periodic_amount), str(start_date)[:10], int(duration), frequency,
+                source)
+
+    def get(self, key, compute, ttl=None):
+        """Return the cached result for key, or compute() it and cache it (for ttl seconds when given)"""
+        with self._lock:
+            if key in self._entries:
+                result, size, expires = self._entries[key]
+                if expires is None or time.monotonic() < expires:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self._entries[key]
+                self.current_bytes -= size
+            self.misses += 1
+
+        result = compute()
+        self._put(key, result, ttl)
+        return result
+
+    def _put(self, key, result, ttl=None):
+        size = self._size_of(result)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (result, size, expires)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def _size_of(self, result):
+        data = result.get('data')
+        size = 1024  # key, scalars and dict overhead
+        if data is not None:
+            size += int(data.nbytes)  # PortfolioMatrix
+        return size
+
+    def precompute(self, initial_amount, periodic_amount, start_date, duration, frequency='M', tickers=None):
+        """Simulate the configured benchmarks for a standard set of parameters ahead of the requests"""
+        from portfolio import Portfolio  # portfolio imports this module
+        for ticker in tickers or self.tickers:
+            Portfolio.benchmark_metrics(ticker, initial_amount, periodic_amount, start_date, duration, frequency)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+# Shared by every Portfolio of the process, configured by ETF_BENCHMARK_CACHE_MB, ETF_BENCHMARK_TICKERS and
+# ETF_PRICE_STORE_MAX_STALENESS (seconds, the same staleness as the stored bars of the user's portfolio)
+benchmark_cache = BenchmarkCache(
+    max_bytes=int(float(os.environ.get('ETF_BENCHMARK_CACHE_MB', 256)) * 1024 ** 2),
+    tickers=[t.strip() for t in os.environ.get('ETF_BENCHMARK_TICKERS', 'ACWI').split(',') if t.strip()],
+    open_window_ttl=float(os.environ.get('ETF_PRICE_STORE_MAX_STALENESS', 3600))
+)
@@ -0,0 +1,132 @@
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+import pandas as pd
+from instrumentation import timed
+
+
+def fig_to_png(fig, dpi=None):
+    """Encode a matplotlib figure as PNG bytes"""
+    buf = BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight', dpi=dpi if dpi is not None else 'figure')
+    return buf.getvalue()
+
+
+class ChartCache:
+    """Rendered charts (PNG bytes) keyed by a hash of the plotted series and the plot type.
+
+    Memory is an LRU bounded by total PNG size, an optional directory keeps charts across restarts
+    and workers. A hit returns the encoded image without touching matplotlib.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 ** 2, directory=None, max_disk_entries=10000, dpi=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self.dpi = dpi  # resolution of the charts that are rendered, None keeps the figure dpi
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._disk_writes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def make_key(self, plot_type, *data):
+        """Hash of the plot type, the render resolution and the values and index of every series or frame drawn
+        in it. The resolution is part of it so the disk tier does not serve old PNGs after CHART_DPI changed."""
+        digest = hashlib.sha1(plot_type.encode())
+        digest.update(repr(self.dpi).encode())
+        for item in data:
+            if isinstance(item, (pd.Series, pd.DataFrame)):
+                digest.update(str(list(item.columns) if isinstance(item, pd.DataFrame) else item.name).encode())
+                digest.update(pd.util.hash_pandas_object(item, index=True).to_numpy().tobytes())
+            else:
+                digest.update(repr(item).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        if self.directory:
+            try:
+                with open(os.path.join(self.directory, f"{key}.png"), 'rb') as f:
+                    png = f.read()
+            except OSError:
+                return None
+            self._remember(key, png)
+            return png
+        return None
+
+    def put(self, key, png):
+        self._remember(key, png)
+        if self.directory:
+            path = os.path.join(self.directory, f"{key}.png")
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+            self._disk_writes += 1
+            if self._disk_writes % 100 == 0:
+                self._prune_disk()
+
+    def get_or_render(self, key, render):
+        """Base64 PNG for key, calling render() (which returns a figure) only on a miss. Renderers called from
+        several threads build their figures with matplotlib.figure.Figure, pyplot's current figure is global"""
+        png = self.get(key)
+        if png is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            with timed('chart_render'):
+                fig = render()
+                try:
+                    png = fig_to_png(fig, self.dpi)
+                finally:
+                    if fig.canvas.manager is not None:  # created through pyplot, which keeps it open
+                        import matplotlib.pyplot as plt
+                        plt.close(fig)
+            self.put(key, png)
+        return base64.b64encode(png).decode('utf-8')
+
+    def _remember(self, key, png):
+        if len(png) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= len(self._entries.pop(key))
+            self._entries[key] = png
+            self.current_bytes += len(png)
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def _prune_disk(self):
+        """Drop the least recently written files beyond max_disk_entries"""
+        try:
+            paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.png')]
+            if len(paths) <= self.max_disk_entries:
+                return
+            paths.sort(key=os.path.getmtime)
+            for path in paths[:len(paths) - self.max_disk_entries]:
+                os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'bytes': self.current_bytes}
+
+
+# Shared by the Visualizer and the Flask views, configured by CHART_CACHE_MB, CHART_CACHE_DIR and CHART_DPI
+chart_cache = ChartCache(
+    max_bytes=int(float(os.environ.get('CHART_CACHE_MB', 64)) * 1024 ** 2),
+    directory=os.environ.get('CHART_CACHE_DIR') or None,
+    dpi=float(os.environ.get('CHART_DPI', 72))
+)
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+
+# Investment frequency codes: calendar months per period, or weeks per period for the weekly codes
+MONTHLY_FREQUENCIES = {'M': 1, 'Q': 3, '6M': 6, 'Y': 12}
+WEEKLY_FREQUENCIES = {'W': 1, '2W': 2}
+
+FREQUENCY_OFFSETS = {
+    'M': pd.DateOffset(months=1),
+    'Q': pd.DateOffset(months=3),
+    '6M': pd.DateOffset(months=6),
+    'Y': pd.DateOffset(years=1),
+    'W': pd.DateOffset(weeks=1),
+    '2W': pd.DateOffset(weeks=2)
+}
+
+
+def _week_number(days):
+    # 1970-01-01 is a Thursday, shifting by 3 days makes weeks start on Monday
+    return (days.astype(np.int64) + 3) // 7
+
+
+def schedule_phase(anchor, frequency):
+    """Weekly periods are counted from the week of the anchor (the initial investment date), only that week
+    modulo the weeks per period matters. Monthly periods are calendar periods, their phase is always 0."""
+    if frequency in WEEKLY_FREQUENCIES:
+        week = _week_number(np.datetime64(pd.Timestamp(anchor).date(), 'D'))
+        return int(week % WEEKLY_FREQUENCIES[frequency])
+    return 0
+
+
+def period_starts(calendar, frequency, phase=0):
+    """For every day of a sorted trading calendar: whether it is the first trading day of its investment
+    period, and the day that period starts (datetime64[ns])"""
+    days = pd.DatetimeIndex(calendar).values.astype('datetime64[D]')
+    if frequency in MONTHLY_FREQUENCIES:
+        months_per_period = MONTHLY_FREQUENCIES[frequency]
+        # Months since 1970-01, a January, so periods line up with calendar quarters, halves and years
+        key = days.astype('datetime64[M]').astype(np.int64) // months_per_period
+        period_start = (key * months_per_period).astype('datetime64[M]')
+    else:
+        weeks_per_period = WEEKLY_FREQUENCIES[frequency]
+        key = (_week_number(days) - phase) // weeks_per_period
+        period_start = ((phase + key * weeks_per_period) * 7 - 3).astype('datetime64[D]')
+
+    first_of_period = np.ones(len(days), dtype=bool)
+    first_of_period[1:] = key[1:] != key[:-1]
+    return first_of_period, period_start.astype('datetime64[ns]')
+
+
+def build_contribution_schedule(calendar, start_date, frequency):
+    """Contribution dates on a sorted trading calendar, in one pass over the calendar.
+
+    Returns (initial_date, periodic_dates): the first trading day on or after start_date (None when the
+    calendar ends before it) and the first trading day of every period that starts at least one
+    period after the initial date.
+    """
+    if frequency not in FREQUENCY_OFFSETS:
+        raise ValueError(f"Unknown investment frequency: {frequency}")
+
+    calendar = pd.DatetimeIndex(calendar)
+    start_date = pd.Timestamp(start_date)
+    position = calendar.searchsorted(start_date)
+    initial_date = calendar[position] if position < len(calendar) else None
+    anchor = initial_date if initial_date is not None else start_date
+    first_periodic_date = anchor + FREQUENCY_OFFSETS[frequency]
+
+    first_of_period, period_start = period_starts(calendar, frequency, schedule_phase(anchor, frequency))
+    eligible = first_of_period & (period_start >= first_periodic_date.to_datetime64())
+    return initial_date, calendar[eligible]
+
+
+def next_contribution_date(anchor, last_date, frequency):
+    """Day the next periodic contribution is due after last_date, for a schedule whose initial investment was
+    on `anchor`: the start of the first period after the one of last_date that build_contribution_schedule
+    invests in. The contribution goes to the first trading day on or after it."""
+    offset = FREQUENCY_OFFSETS[frequency]
+    phase = schedule_phase(anchor, frequency)
+
+    def start_of_period(day):
+        return pd.Timestamp(period_starts([day], frequency, phase)[1][0])
+
+    earliest = max(pd.Timestamp(anchor) + offset, start_of_period(last_date) + offset)
+    start = start_of_period(earliest)
+    return start if start == earliest else start + offset
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+
+def lttb(x, y, n_out):
+    """Indices of the n_out points kept by Largest-Triangle-Three-Buckets downsampling.
+
+    The first and last points are always kept. Every bucket in between keeps the point that forms the
+    largest triangle with the point kept in the previous bucket and the mean of the next bucket, which
+    preserves peaks and troughs much better than taking every k-th point.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (n_out - 2)
+    edges = np.floor(np.arange(n_out - 1) * every).astype(int) + 1
+    edges[-1] = n - 1
+
+    selected = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample_series(series, n_out):
+    """A date-indexed series reduced to n_out points, as JSON-ready {'dates', 'values'} lists"""
+    series = series.dropna()
+    dates = pd.DatetimeIndex(series.index)
+    keep = lttb(dates.asi8 / 86400e9, series.to_numpy(), n_out)
+    return {
+        'dates': dates[keep].strftime('%Y-%m-%d').tolist(),
+        'values': np.round(series.to_numpy()[keep].astype(float), 2).tolist()
+    }
@@ -1,14 +1,20 @@
+import math
 import pandas as pd
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import r2_score, mean_absolute_error
-from sklearn.model_selection import train_test_split
 import matplotlib.pyplot as plt
 from etfdataretrieval import ETFDataRetrieval
+from instrumentation import timed, count
+
+# Columns of the regression results, indexed by Date
+RESULT_COLUMNS = ['ETF', 'Actual_EMA_10', 'Predicted_EMA_10', 'Close', 'R²', 'MAE', 'intercept', 'slope']
+# Columns of the walk-forward forecasts: one row per ETF and horizon, and one per refit with per_window=True
+FORECAST_SUMMARY_COLUMNS = ['ETF', 'horizon', 'windows', 'MAE', 'RMSE', 'MAPE', 'bias', 'hit_rate', 'mean_R²']
+FORECAST_WINDOW_COLUMNS = ['ETF', 'horizon', 'target_date', 'Close', 'Actual_EMA_10', 'Predicted_EMA_10', 'error',
+                           'R²']
 
 class ETFAnalyzer:
-    def __init__(self):
-        self.data_handler = ETFDataRetrieval()
+    def __init__(self, provider=None):
+        self.data_handler = ETFDataRetrieval(provider=provider)
     
     def get_analysis_inputs(self):
         """Used to get input from the user to get the data"""
@@ -22,14 +28,17 @@ class ETFAnalyzer:
         today = pd.Timestamp.today().normalize() # getting today's date
         all_data = []
 
-        for ticker in tickers: # fetching all historical data for each ETF(ticker) mentioned by the user
-            try:
-                df = self.data_handler.fetch_historical_data(ticker, start_date, today)
-                if not df.empty:
-                    df['ETF'] = ticker
-                    all_data.append(df)
-            except Exception as e:
-                print(f"Error fetching {ticker}: {e}")
+        # fetching all historical data for the ETFs(tickers) mentioned by the user in one concurrent batch
+        batch = self.data_handler.fetch_historical_batch(tickers, start_date, today)
+        for ticker in tickers:
+            if ticker in batch.errors:
+                print(f"Error fetching {ticker}: {batch.errors[ticker]}")
+                continue
+            df = batch.data.get(ticker)
+            if df is not None and not df.empty:
+                df = df.copy()
+                df['ETF'] = ticker
+                all_data.append(df)
         
         return pd.concat(all_data) if all_data else pd.DataFrame()
 
@@ -43,6 +52,11 @@ class ETFAnalyzer:
 
     def calculate_ema_regression(self, df, ticker):
         """Calculate EMA regression for a single ETF using native pandas"""
+        # sklearn is only needed by this per-ticker path, batch_ema_regression does without it
+        from sklearn.linear_model import LinearRegression
+        from sklearn.metrics import r2_score, mean_absolute_error
+        from sklearn.model_selection import train_test_split
+
         # Calcul de l'EMA avec pandas
         df['EMA_10'] = df['Close'].ewm(span=10, adjust=False).mean()
         
@@ -73,6 +87,213 @@ class ETFAnalyzer:
         
         return results
 
+    @staticmethod
+    def price_matrix(df):
+        """Close prices of every ETF of a get_data frame as one (observations x tickers) matrix.
+
+        Column j holds the closes of tickers[j] in date order from row 0, NaN-padded after its last one, so
+        every ETF keeps its own trading days (a calendar-aligned matrix would put gaps in the EMA).
+        Returns (tickers, close, rows, lengths), rows being the position in df of each close.
+        """
+        codes, tickers = pd.factorize(df['ETF'], sort=True)
+        order = df.index.argsort(kind='stable')
+        order = order[np.argsort(codes[order], kind='stable')]  # by ticker, then date
+        codes = codes[order]
+        lengths = np.bincount(codes, minlength=len(tickers))
+        position = np.arange(len(codes)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        close = np.full((lengths.max(initial=0), len(tickers)), np.nan)
+        close[position, codes] = df['Close'].to_numpy(dtype=float)[order]
+        rows = np.zeros(close.shape, dtype=np.int64)
+        rows[position, codes] = order
+        return list(tickers), close, rows, lengths
+
+    @staticmethod
+    def split_positions(n, test_size=0.3, random_state=42):
+        """(test, train) row positions of sklearn's train_test_split(test_size, random_state) on n rows"""
+        n_test = math.ceil(test_size * n)
+        permutation = np.random.RandomState(random_state).permutation(n)
+        return permutation[:n_test], permutation[n_test:]
+
+    @timed('ema_regression')
+    def batch_ema_regression(self, df, span=10, test_size=0.3, random_state=42):
+        """calculate_ema_regression for every ETF of df at once, same results frame as
+        apply_to_etfs(df, calculate_ema_regression).
+
+        The EMA runs on the price_matrix, the single-feature least squares fit, R² and MAE are closed-form
+        masked reductions over all the tickers. Each ETF gets the same seeded train/test split as
+        train_test_split; ETFs with fewer than 2 rows are left out (train_test_split rejects them).
+        """
+        if df.empty:
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        tickers, close, rows, lengths = self.price_matrix(df)
+        ema = pd.DataFrame(close).ewm(span=span, adjust=False).mean().to_numpy()
+
+        # Train mask and the test rows of every ETF in train_test_split order, one permutation per length
+        train = np.zeros(close.shape, dtype=bool)
+        test_rows = [None] * len(tickers)
+        for n in np.unique(lengths[lengths >= 2]):
+            columns = np.flatnonzero(lengths == n)
+            test, fit = self.split_positions(n, test_size, random_state)
+            train[np.ix_(fit, columns)] = True
+            for j in columns:
+                test_rows[j] = test
+        kept = [j for j in range(len(tickers)) if test_rows[j] is not None]
+        for j in range(len(tickers)):
+            if test_rows[j] is None:
+                print(f"Not enough data for the EMA regression of {tickers[j]}")
+
+        # Least squares on the centered training rows
+        n_train = train.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_mean = np.where(train, close, 0.0).sum(axis=0) / n_train
+            y_mean = np.where(train, ema, 0.0).sum(axis=0) / n_train
+            dx = np.where(train, close - x_mean, 0.0)
+            dy = np.where(train, ema - y_mean, 0.0)
+            slope = (dx * dy).sum(axis=0) / (dx * dx).sum(axis=0)
+            slope = np.where(np.isfinite(slope), slope, 0.0)  # constant closes: flat line through the mean
+            intercept = y_mean - slope * x_mean
+
+            # Test rows of every kept ETF, one after the other
+            column = np.repeat(kept, [len(test_rows[j]) for j in kept])
+            row = np.concatenate([test_rows[j] for j in kept]) if kept else np.array([], dtype=int)
+            x, y = close[row, column], ema[row, column]
+            predicted = intercept[column] + slope[column] * x
+            residual = y - predicted
+            n_test = np.bincount(column, minlength=len(tickers))
+            mae = np.bincount(column, np.abs(residual), minlength=len(tickers)) / n_test
+            ss_res = np.bincount(column, residual ** 2, minlength=len(tickers))
+            y_test_mean = np.bincount(column, y, minlength=len(tickers)) / n_test
+            ss_tot = np.bincount(column, (y - y_test_mean[column]) ** 2, minlength=len(tickers))
+            # r2_score conventions: NaN on a single test row, 1 or 0 when the actual values are constant
+            r2 = np.where(ss_tot > 0, 1 - ss_res / ss_tot, np.where(ss_res == 0, 1.0, 0.0))
+            r2 = np.where(n_test < 2, np.nan, r2)
+        count('etf_regressions_total', len(kept))
+
+        results = pd.DataFrame({
+            'ETF': np.array(tickers, dtype=object)[column],
+            'Actual_EMA_10': y,
+            'Predicted_EMA_10': predicted,
+            'Close': x,
+            'R²': r2[column],
+            'MAE': mae[column],
+            'intercept': intercept[column],
+            'slope': slope[column]
+        }, index=df.index[rows[row, column]].rename('Date'))
+        return results.sort_index()
+
+    @staticmethod
+    def _window_fits(x, y, window, step, expanding, max_chunk_elements=4_000_000):
+        """Least squares y = a + b*x on every window of the (rows x tickers) pair matrices.
+
+        Window k ends on row k*step + window - 1 and starts window rows before it (rolling) or on row 0
+        (expanding). Rolling windows are strided views of x and y fitted in chunks with centered sums,
+        expanding ones come from prefix sums. Returns the (windows x tickers) means, slope and R² of the
+        fits, NaN where a window reaches past the data of a ticker.
+        """
+        ends = np.arange(window - 1, len(x), step)
+        if len(ends) == 0:
+            empty = np.empty((0, x.shape[1]))
+            return ends, empty, empty, empty, empty
+        if expanding:
+            size = (ends + 1)[:, None]
+            sums = {name: np.cumsum(values, axis=0)[ends] for name, values in
+                    (('x', x), ('y', y), ('xx', x * x), ('xy', x * y), ('yy', y * y))}
+            x_mean, y_mean = sums['x'] / size, sums['y'] / size
+            sxx = sums['xx'] - size * x_mean * x_mean
+            sxy = sums['xy'] - size * x_mean * y_mean
+            syy = sums['yy'] - size * y_mean * y_mean
+        else:
+            x_windows = np.lib.stride_tricks.sliding_window_view(x, window, axis=0)[::step]
+            y_windows = np.lib.stride_tricks.sliding_window_view(y, window, axis=0)[::step]
+            shape = x_windows.shape[:2]
+            x_mean, y_mean, sxx, sxy, syy = (np.empty(shape) for _ in range(5))
+            chunk = max(1, max_chunk_elements // max(shape[1] * window, 1))
+            for first in range(0, shape[0], chunk):
+                part = slice(first, first + chunk)
+                x_mean[part] = x_windows[part].mean(axis=-1)
+                y_mean[part] = y_windows[part].mean(axis=-1)
+                dx = x_windows[part] - x_mean[part, :, None]
+                dy = y_windows[part] - y_mean[part, :, None]
+                sxx[part] = np.einsum('ktw,ktw->kt', dx, dx)
+                sxy[part] = np.einsum('ktw,ktw->kt', dx, dy)
+                syy[part] = np.einsum('ktw,ktw->kt', dy, dy)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = np.where(sxx > 0, sxy / sxx, 0.0)
+            r2 = np.where(sxx * syy > 0, sxy * sxy / (sxx * syy), np.nan)
+        return ends, x_mean, y_mean, slope, r2
+
+    @timed('walk_forward')
+    def walk_forward_forecast(self, df, horizons=(1, 5, 20), window=252, step=1, expanding=False, span=10,
+                              per_window=False):
+        """Out-of-sample forecasts of EMA_10 `horizon` trading days ahead from today's Close, refitted as
+        the data comes in, for every ETF of df.
+
+        At every refit date t (every `step` rows of each ETF), the regression EMA_10[s + h] = a + b*Close[s]
+        is fitted on the last `window` pairs known at t (all of them with expanding=True, `window` being
+        the first one) and predicts EMA_10[t + h] from Close[t]. Returns the FORECAST_SUMMARY_COLUMNS table
+        (one row per ETF and horizon: errors of the forecasts, MAPE in %, hit_rate: share of forecasts on
+        the right side of EMA_10[t], mean_R²: mean in-window fit), and with per_window=True also the
+        FORECAST_WINDOW_COLUMNS of every refit indexed by its date t.
+        """
+        if df.empty:
+            summary = pd.DataFrame(columns=FORECAST_SUMMARY_COLUMNS)
+            return (summary, pd.DataFrame(columns=FORECAST_WINDOW_COLUMNS)) if per_window else summary
+        tickers, close, rows, lengths = self.price_matrix(df)
+        ema = pd.DataFrame(close).ewm(span=span, adjust=False).mean().to_numpy()
+        ema[np.isnan(close)] = np.nan  # no EMA carried past the last close of an ETF
+        # Shifted by their mean, so the window sums of large prices keep their precision
+        x_offset, y_offset = np.nanmean(close, axis=0), np.nanmean(ema, axis=0)
+        x, y = close - x_offset, ema - y_offset
+
+        summaries, windows = [], []
+        for horizon in horizons:
+            # Pair s is (Close[s], EMA_10[s + h]), the window ending on pair s is used at t = s + h to
+            # forecast EMA_10[t + h], so only the pairs with t + h inside the matrix are windowed
+            pairs = max(len(close) - 2 * horizon, 0)
+            ends, x_mean, y_mean, slope, r2 = self._window_fits(x[:pairs], y[horizon:horizon + pairs], window, step,
+                                                                expanding)
+            t = ends + horizon
+            predicted = y_mean + slope * (x[t] - x_mean) + y_offset
+            actual = y[t + horizon] + y_offset
+            current = y[t] + y_offset
+            error = predicted - actual
+            valid = np.isfinite(error)
+            n = valid.sum(axis=0)
+
+            def mean(values):
+                return np.where(valid, values, 0.0).sum(axis=0) / n
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                summaries.append(pd.DataFrame({
+                    'ETF': tickers,
+                    'horizon': horizon,
+                    'windows': n,
+                    'MAE': mean(np.abs(error)),
+                    'RMSE': np.sqrt(mean(error * error)),
+                    'MAPE': mean(np.abs(error / actual)) * 100,
+                    'bias': mean(error),
+                    'hit_rate': mean(np.sign(predicted - current) == np.sign(actual - current)),
+                    'mean_R²': mean(np.nan_to_num(r2))
+                }))
+            if per_window:
+                window_row, column = np.nonzero(valid.T)[::-1]  # by ticker, then date
+                windows.append(pd.DataFrame({
+                    'ETF': np.array(tickers, dtype=object)[column],
+                    'horizon': horizon,
+                    'target_date': df.index[rows[t[window_row] + horizon, column]],
+                    'Close': x[t[window_row], column] + x_offset[column],
+                    'Actual_EMA_10': actual[window_row, column],
+                    'Predicted_EMA_10': predicted[window_row, column],
+                    'error': error[window_row, column],
+                    'R²': r2[window_row, column]
+                }, index=df.index[rows[t[window_row], column]].rename('Date')))
+            count('etf_forecast_refits_total', int(n.sum()))
+
+        summary = pd.concat(summaries).sort_values(['ETF', 'horizon'], kind='stable').reset_index(drop=True)
+        if per_window:
+            return summary, pd.concat(windows).sort_values(['ETF', 'horizon'], kind='stable')
+        return summary
+
     def plot_results(self, results_df, plot_type='regression'):
         '''Execution of the plots based on the ETFs'''
         for etf, group in results_df.groupby('ETF'):
@@ -126,7 +347,7 @@ class ETFAnalyzer:
             data = portfolio_data
 
         if not data.empty:
-            results = self.apply_to_etfs(data, self.calculate_ema_regression)
+            results = self.batch_ema_regression(data)
             self.generate_reports(results)
             self.plot_results(results, plot_type='regression')
             self.plot_results(results, plot_type='timeseries')
@@ -1,30 +1,119 @@
+import time
 import pandas as pd
 from pandas.tseries.offsets import BDay
-import yfinance as yf
+from priceproviders import YFinanceProvider, default_price_provider
+from instrumentation import timed, count
 
 
+class DownloadError(ValueError):
+    """Tickers of a portfolio could not be downloaded"""
+
+
+class BatchResult:
+    """Outcome of a batch download: data for the tickers that succeeded, the exception for the others"""
+    def __init__(self):
+        self.data = {}
+        self.info = {}
+        self.errors = {}
+
 
 class ETFDataRetrieval:
+    def __init__(self, provider=None, price_store=None, metadata=None, max_workers=8, timeout=30, retries=2,
+                 retry_backoff=0.5):
+        # Where bars and ETF info come from, ETF_PRICE_PROVIDER (yfinance by default) unless given.
+        # price_store and metadata configure the yfinance provider built when none is configured.
+        if provider is None:
+            if price_store is not None or metadata is not None:
+                provider = YFinanceProvider(price_store, metadata)
+            else:
+                provider = default_price_provider()
+        self.provider = provider
+        self.max_workers = max_workers
+        self.timeout = timeout  # seconds allowed per ticker download
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.errors = {}  # per-ticker errors of the last portfolio_data_retrieval call
+
+    def get_history(self, ticker_symbol, start_date, end_date, timeout=None):
+        """Daily bars for [start_date, end_date) from the provider"""
+        timeout = self.timeout if timeout is None else timeout
+        return self.provider.ticker_history(ticker_symbol, start_date, end_date, timeout=timeout)
+
+    def _fetch_info(self, tickers):
+        """ETF info of the tickers as ({ticker: info}, {ticker: exception}), the yfinance ones downloaded together"""
+        try:
+            self.prefetch_metadata(tickers)
+        except Exception:
+            pass  # the tickers that failed fail again below, one by one
+        infos, errors = {}, {}
+        for ticker in tickers:
+            try:
+                infos[ticker] = self.get_etf_info(ticker)
+            except Exception as e:
+                errors[ticker] = e
+        return infos, errors
+
+    @timed('fetch')
+    def fetch_batch(self, tickers, start_date, end_date, with_info=False):
+        """Download several tickers through the provider's bulk download, a failing ticker does not fail the
+        batch. The tickers that failed are downloaded again, up to `retries` times with an exponential backoff."""
+        result = BatchResult()
+        pending = list(dict.fromkeys(tickers))
+        for attempt in range(self.retries + 1):
+            if not pending:
+                break
+            if attempt:
+                count('etf_fetch_retries_total', len(pending))
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            frames, errors = self.provider.download(pending, start_date, end_date, timeout=self.timeout,
+                                                    max_workers=self.max_workers)
+            if with_info and frames:
+                infos, info_errors = self._fetch_info(list(frames))
+                for ticker, error in info_errors.items():
+                    del frames[ticker]
+                    errors[ticker] = error
+                result.info.update(infos)
+            result.data.update(frames)
+            result.errors = errors
+            pending = list(errors)
+        count('etf_tickers_fetched_total', len(result.data))
+        count('etf_fetch_errors_total', len(result.errors))
+        return result
+
     def get_etf_info(self, ticker_symbol):
-        ticker = yf.Ticker(ticker_symbol)
-        info = ticker.info
-        return {'fees': info.get('netExpenseRatio'), 'ticker': info.get('ticker', ticker_symbol)}
+        return self.provider.ticker_metadata(ticker_symbol)
+
+    def prefetch_metadata(self, tickers):
+        """Load the info of many tickers at once (concurrently for yfinance)"""
+        return self.provider.metadata(tickers)
+
+    def portfolio_data_retrieval(self, etf_list, investment_start_date, end_date, allow_missing=False):
+        """Bars of the (ticker, allocation) list with their fees and allocation. A ticker that fails to download
+        raises DownloadError (a ValueError) naming the failed tickers, unless allow_missing (the screener): it is then left out"""
+        investment_start_date = pd.to_datetime(investment_start_date)
+        investment_start_date = investment_start_date - BDay(1)  #used to get the previous_day_price_closure in the metrics_test.py file
+        end_date = pd.to_datetime(end_date)
+        batch = self.fetch_batch([etf[0] for etf in etf_list], investment_start_date, end_date, with_info=True)
+        self.errors = batch.errors
+        if batch.errors and not allow_missing:
+            # A portfolio simulated without some of its ETFs would show metrics of another allocation
+            failed = ", ".join(f"{ticker} ({error})" for ticker, error in batch.errors.items())
+            raise DownloadError(f"Error: Could not download {failed}")
 
-    def portfolio_data_retrieval(self, etf_list, investment_start_date, end_date):
         data_dict = {}
         for etf in etf_list:
-            etf_info = self.get_etf_info(etf[0])
-            ticker_obj = yf.Ticker(etf[0])
-            investment_start_date = pd.to_datetime(investment_start_date)
-            investment_start_date = investment_start_date - BDay(1)  #used to get the previous_day_price_closure in the metrics_test.py file
-            end_date = pd.to_datetime(end_date)
-            data = ticker_obj.history(start=investment_start_date, end=end_date)
+            if etf[0] in batch.errors:
+                print(f"Error fetching {etf[0]}: {batch.errors[etf[0]]}")
+                continue
+            etf_info = batch.info[etf[0]]
+            data = batch.data[etf[0]].copy()
             data['fees'] = etf_info['fees']
             data['ticker'] = etf_info['ticker']
             data['etf_allocation'] = etf[1]
             data_dict[etf] = data
         return data_dict
 
+    @timed('data_cleaning')
     def data_cleaning(self, data_dict):
         cleaned_list = []
         for symbol, data in data_dict.items():
@@ -41,6 +130,9 @@ class ETFDataRetrieval:
 
 
     def fetch_historical_data(self, ticker_symbol, start_date, end_date):
-        ticker_obj = yf.Ticker(ticker_symbol)
         start_date = pd.to_datetime(start_date) - BDay(1)
-        return ticker_obj.history(start=start_date, end=end_date)
\ No newline at end of file
+        return self.get_history(ticker_symbol, start_date, end_date)
+
+    def fetch_historical_batch(self, tickers, start_date, end_date):
+        start_date = pd.to_datetime(start_date) - BDay(1)
+        return self.fetch_batch(tickers, start_date, end_date)
@@ -0,0 +1,176 @@
+import copy
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+DEFAULT_METADATA_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'investment_forecasting', 'etf_metadata.json')
+
+DAY = 24 * 3600
+
+
+class ETFMetadataService:
+    """ETF metadata (expense ratio) cached in memory (LRU) and in a JSON file shared by all processes"""
+
+    def __init__(self, path=DEFAULT_METADATA_PATH, ttl=90 * DAY, missing_ttl=DAY, maxsize=1024):
+        self.path = path
+        self.ttl = ttl  # seconds before a fetched entry is refreshed
+        self.missing_ttl = missing_ttl  # shorter lifetime for tickers whose info has no expense ratio
+        self.maxsize = maxsize
+        self._memory = OrderedDict()
+        self._overrides = {}
+        self._file_cache = (None, {})  # (mtime and size, parsed content) of the last file read
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, ticker_symbol):
+        """Return {'fees', 'ticker'} for a ticker, downloading its info only when the cached entry expired"""
+        overrides = {**self._load_file().get('overrides', {}), **self._overrides}
+        if ticker_symbol in overrides:
+            entry = self._cached(ticker_symbol) or {'fees': None, 'ticker': ticker_symbol}
+            return {**self._public(entry), **overrides[ticker_symbol]}
+
+        entry = self._cached(ticker_symbol)
+        with self._lock:
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is not None:
+            return self._public(entry)
+
+        entry = self._fetch(ticker_symbol)
+        self._store({ticker_symbol: entry})
+        return self._public(entry)
+
+    def prefetch(self, tickers, max_workers=8, timeout=30):
+        """Load the metadata of a whole universe at once, only expired or unknown tickers are downloaded.
+        Each ticker gets `timeout` seconds once a worker is free, the ones still running then are errors."""
+        missing = [t for t in dict.fromkeys(tickers) if self._cached(t) is None]
+        if not missing:
+            return {}
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(missing)))
+        try:
+            futures = {executor.submit(self._fetch, t): t for t in missing}
+            deadline = -(-len(missing) // max_workers) * timeout
+            done, not_done = wait(futures, timeout=deadline)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        entries, errors = {}, {}
+        for future in done:
+            try:
+                entries[futures[future]] = future.result()
+            except Exception as e:
+                errors[futures[future]] = e
+        for future in not_done:
+            errors[futures[future]] = TimeoutError(f"info download did not finish within {deadline:g}s")
+        self._store(entries)
+        return errors
+
+    def set_override(self, ticker_symbol, **fields):
+        """Pin metadata fields (e.g. fees=0.0003) for a ticker whose Yahoo info is missing or wrong"""
+        with self._lock:
+            self._overrides.setdefault(ticker_symbol, {}).update(fields)
+            content = self._load_file(for_update=True)
+            content.setdefault('overrides', {}).setdefault(ticker_symbol, {}).update(fields)
+            self._save_file(content)
+
+    def remove_override(self, ticker_symbol):
+        with self._lock:
+            self._overrides.pop(ticker_symbol, None)
+            content = self._load_file(for_update=True)
+            if content.get('overrides', {}).pop(ticker_symbol, None) is not None:
+                self._save_file(content)
+
+    def _fetch(self, ticker_symbol):
+        import yfinance as yf  # only loaded by the first download, like the other heavy modules
+        info = yf.Ticker(ticker_symbol).info
+        return {
+            'fees': info.get('netExpenseRatio'),
+            'ticker': info.get('ticker', ticker_symbol),
+            'fetched_at': time.time()
+        }
+
+    def _public(self, entry):
+        return {'fees': entry['fees'], 'ticker': entry['ticker']}
+
+    def _is_fresh(self, entry):
+        ttl = self.ttl if entry.get('fees') is not None else self.missing_ttl
+        return time.time() - entry.get('fetched_at', 0) < ttl
+
+    def _cached(self, ticker_symbol):
+        with self._lock:
+            entry = self._memory.get(ticker_symbol)
+            if entry is not None:
+                if self._is_fresh(entry):
+                    self._memory.move_to_end(ticker_symbol)
+                    return entry
+                del self._memory[ticker_symbol]
+
+        # Another worker may have refreshed the file since this process cached the entry
+        entry = self._load_file().get('entries', {}).get(ticker_symbol)
+        if entry is None or not self._is_fresh(entry):
+            return None
+        self._remember(ticker_symbol, entry)
+        return entry
+
+    def _remember(self, ticker_symbol, entry):
+        with self._lock:
+            self._memory[ticker_symbol] = entry
+            self._memory.move_to_end(ticker_symbol)
+            while len(self._memory) > self.maxsize:
+                self._memory.popitem(last=False)
+
+    def _store(self, entries):
+        if not entries:
+            return
+        for ticker_symbol, entry in entries.items():
+            self._remember(ticker_symbol, entry)
+        if self.path is None:
+            return
+        with self._lock:
+            content = self._load_file(for_update=True)
+            content.setdefault('entries', {}).update(entries)
+            self._save_file(content)
+
+    def _load_file(self, for_update=False):
+        """Parsed file content, re-read only when the file changed on disk"""
+        if self.path is None:
+            return {}
+        try:
+            stat = os.stat(self.path)
+            version = (stat.st_mtime_ns, stat.st_size)
+            if version != self._file_cache[0]:
+                with open(self.path) as f:
+                    self._file_cache = (version, json.load(f))
+            content = self._file_cache[1]
+        except (OSError, ValueError):
+            content = {}
+        return copy.deepcopy(content) if for_update else content
+
+    def _save_file(self, content):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(content, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)  # atomic, readers never see a half-written file
+
+
+_default_service = None
+_default_service_lock = threading.Lock()
+
+
+def default_metadata_service():
+    """Process-wide service, its file is configured by ETF_METADATA_CACHE (empty keeps it in memory only)"""
+    global _default_service
+    path = os.environ.get('ETF_METADATA_CACHE', DEFAULT_METADATA_PATH) or None
+    with _default_service_lock:
+        if _default_service is None or _default_service.path != path:
+            _default_service = ETFMetadataService(path)
+        return _default_service
@@ -0,0 +1,271 @@
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from etfdataretrieval import ETFDataRetrieval
+from contributionschedule import build_contribution_schedule
+from purchaseengine import simulate_purchases
+from instrumentation import timed, count
+
+
+DEFAULT_UNIVERSE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'etf_universe.json')
+
+# Date x ticker matrices produced by the purchase kernel
+SIMULATION_COLUMNS = ['etf_units_purchased', 'total_etf_units', 'cash', 'ETF_net_worth',
+                      'etf_cumulative_investment', 'ETF_PnL', 'ETF_PnL_%']
+
+
+_process_pools = {}  # number of workers -> pool, started on first use and kept for the life of the process
+_process_pools_lock = threading.Lock()
+
+
+def process_pool(workers):
+    """Long-lived pool of `workers` processes for the screener. They are started by a forkserver (spawn where
+    there is none), never forked from the web process, whose job, prewarm and download threads may hold locks."""
+    with _process_pools_lock:
+        pool = _process_pools.get(workers)
+        if pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            pool = _process_pools[workers] = ProcessPoolExecutor(max_workers=workers,
+                                                                 mp_context=multiprocessing.get_context(method))
+        return pool
+
+
+def _discard_pool(workers, pool):
+    """Drop a pool a dead worker broke, the next call starts a new one"""
+    with _process_pools_lock:
+        if _process_pools.get(workers) is pool:
+            del _process_pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _simulate_columns(investment, previous_close, fees, out, tickers):
+    """Run the purchase kernel on a block of columns and write the results into `out`.
+
+    A failing block is retried column by column so one bad ticker only loses its own column.
+    Returns {ticker: error message} for the columns that failed.
+    """
+    errors = {}
+    try:
+        result = simulate_purchases(investment, previous_close, fees)
+        for col in SIMULATION_COLUMNS:
+            out[col][...] = result[col]
+        return errors
+    except Exception:
+        pass
+    for j, ticker in enumerate(tickers):
+        try:
+            result = simulate_purchases(investment[:, j], previous_close[:, j], fees[j])
+            for col in SIMULATION_COLUMNS:
+                out[col][:, j] = result[col]
+        except Exception as e:
+            errors[ticker] = str(e)
+            for col in SIMULATION_COLUMNS:
+                out[col][:, j] = np.nan
+    return errors
+
+
+def _simulate_shared_block(blocks, shape, start, stop, fees, tickers):
+    """Process pool task: simulate columns [start, stop) of matrices held in shared memory"""
+    attached = {name: shared_memory.SharedMemory(name=shm_name) for name, shm_name in blocks.items()}
+    arrays = out = None
+    try:
+        arrays = {name: np.ndarray(shape, dtype=np.float64, buffer=shm.buf) for name, shm in attached.items()}
+        out = {col: arrays[col][:, start:stop] for col in SIMULATION_COLUMNS}
+        return _simulate_columns(
+            arrays['investment'][:, start:stop], arrays['previous_close'][:, start:stop], fees, out, tickers
+        )
+    finally:
+        del arrays, out
+        for shm in attached.values():
+            shm.close()
+
+
+class ETFScreener:
+    """Screens a universe of ETFs on one aligned date x ticker price matrix with a single DCA simulation"""
+
+    def __init__(self, universe, data_retrieval=None, workers=1):
+        self.universe = universe  # {category: [tickers]}
+        self.data_retrieval = data_retrieval if data_retrieval is not None else ETFDataRetrieval()
+        self.workers = workers  # > 1 spreads the ticker columns over a process pool
+        self.raw_data = {}  # downloaded frames per ticker, reused to build portfolios without refetching
+        self.close = None
+        self.previous_close = None
+        self.fees = None
+        self.simulation = None
+        self._loaded_range = None
+
+    @staticmethod
+    def load_universe(path=None):
+        """Read the {category: [tickers]} universe from a JSON file (ETF_UNIVERSE or etf_universe.json)"""
+        path = path or os.environ.get('ETF_UNIVERSE') or DEFAULT_UNIVERSE_PATH
+        with open(path) as f:
+            return json.load(f)
+
+    @property
+    def tickers(self):
+        return list(dict.fromkeys(etf for etfs in self.universe.values() for etf in etfs))
+
+    def category_of(self, ticker):
+        return next(category for category, etfs in self.universe.items() if ticker in etfs)
+
+    def load_prices(self, start_date, end_date):
+        """Download the universe once and align it into date x ticker matrices"""
+        if self._loaded_range == (start_date, end_date):
+            return
+        data_dict = self.data_retrieval.portfolio_data_retrieval(
+            [(etf, 1.0) for etf in self.tickers], start_date, end_date, allow_missing=True
+        )
+        self.raw_data = {etf[0]: data for etf, data in data_dict.items()}
+
+        # Same cleaning as a single-ETF Portfolio, so every column matches its per-ETF simulation
+        closes, fees = {}, {}
+        for ticker, data in self.raw_data.items():
+            cleaned = self.data_retrieval.data_cleaning({ticker: data})
+            if cleaned.empty:
+                print(f"Error processing {ticker}: no price data")
+                continue
+            cleaned.index = pd.to_datetime(cleaned.index).tz_localize(None)
+            closes[ticker] = cleaned['Close']
+            fees[ticker] = float(cleaned['fees'].iloc[0])
+
+        self.close = pd.DataFrame(closes).sort_index()
+        # Previous close of each ticker on its own trading days, gaps of other tickers are skipped
+        self.previous_close = self.close.ffill().shift(1).where(self.close.notna())
+        self.fees = pd.Series(fees)
+        self._loaded_range = (start_date, end_date)
+
+    def investment_matrix(self, initial_amount, monthly_amount, start_date, frequency):
+        """Contributions of a 100% allocation to each ticker, on each ticker's own trading calendar"""
+        tradable = self.close.notna() & self.previous_close.notna()
+        investment = np.zeros(self.close.shape)
+        schedules = {}  # tickers sharing a calendar share its schedule
+        for j, ticker in enumerate(self.close.columns):
+            mask = tradable[ticker].to_numpy()
+            calendar_key = hash(mask.tobytes())
+            if calendar_key not in schedules:
+                calendar = self.close.index[mask]
+                initial_date, periodic_dates = build_contribution_schedule(calendar, start_date, frequency)
+                rows = self.close.index.get_indexer(periodic_dates)
+                initial_row = self.close.index.get_loc(initial_date) if initial_date is not None else None
+                schedules[calendar_key] = (initial_row, rows)
+            initial_row, rows = schedules[calendar_key]
+            investment[rows, j] = monthly_amount * 1.0
+            if initial_row is not None:
+                investment[initial_row, j] += initial_amount * 1.0
+        return investment
+
+    @timed('screen')
+    def screen(self, initial_amount, monthly_amount, start_date, duration, frequency='M'):
+        """Simulate every ETF of the universe at 100% allocation and rank them by final PnL %"""
+        start = pd.to_datetime(start_date)
+        end_date = (start + pd.DateOffset(years=duration)).strftime("%Y-%m-%d")
+        self.load_prices(start_date, end_date)
+
+        investment = self.investment_matrix(initial_amount, monthly_amount, start, frequency)
+        previous_close = self.previous_close.to_numpy()
+        fees = self.fees[self.close.columns].to_numpy()
+        tickers = list(self.close.columns)
+        if self.workers and self.workers > 1 and len(tickers) > 1:
+            self.simulation, errors = self._simulate_parallel(investment, previous_close, fees, tickers)
+        else:
+            self.simulation = {col: np.empty(investment.shape) for col in SIMULATION_COLUMNS}
+            errors = _simulate_columns(investment, previous_close, fees, self.simulation, tickers)
+        self.simulation['investment'] = investment
+        count('etf_screened_total', len(tickers))
+
+        active = investment != 0
+        ranking = []
+        for j, ticker in enumerate(tickers):
+            if ticker in errors:
+                print(f"Error processing {ticker}: {errors[ticker]}")
+                continue
+            rows = np.flatnonzero(active[:, j])
+            if len(rows) == 0:
+                print(f"Error processing {ticker}: no investment date in the period")
+                continue
+            last = rows[-1]
+            ranking.append({
+                'ticker': ticker,
+                'category': self.category_of(ticker),
+                'final_pnl': self.simulation['ETF_PnL_%'][last, j],
+                'final_net_worth': self.simulation['ETF_net_worth'][last, j],
+                'cumulative_investment': self.simulation['etf_cumulative_investment'][last, j]
+            })
+        if not ranking:
+            return pd.DataFrame(columns=['category', 'final_pnl', 'final_net_worth', 'cumulative_investment'])
+        ranking = sorted(ranking, key=lambda x: x['final_pnl'], reverse=True)
+        return pd.DataFrame(ranking).set_index('ticker')
+
+    def _simulate_parallel(self, investment, previous_close, fees, tickers):
+        """Simulate contiguous blocks of columns in worker processes.
+
+        Inputs and outputs live in shared memory, workers only receive the block names and their column
+        range. Columns are independent so the result does not depend on the number of workers.
+        """
+        shape = investment.shape
+        names = ['investment', 'previous_close'] + SIMULATION_COLUMNS
+        nbytes = max(investment.nbytes, 1)
+        blocks = {name: shared_memory.SharedMemory(create=True, size=nbytes) for name in names}
+        try:
+            arrays = {name: np.ndarray(shape, dtype=np.float64, buffer=shm.buf) for name, shm in blocks.items()}
+            arrays['investment'][...] = investment
+            arrays['previous_close'][...] = previous_close
+
+            bounds = np.linspace(0, len(tickers), min(self.workers, len(tickers)) + 1).astype(int)
+            errors = {}
+            shared = {n: b.name for n, b in blocks.items()}
+            for attempt in range(2):  # a pool broken by an earlier call is replaced once
+                executor = process_pool(self.workers)
+                try:
+                    futures = [
+                        executor.submit(_simulate_shared_block, shared, shape, start, stop, fees[start:stop],
+                                        tickers[start:stop])
+                        for start, stop in zip(bounds[:-1], bounds[1:])
+                    ]
+                    break
+                except BrokenProcessPool:
+                    _discard_pool(self.workers, executor)
+                    if attempt:
+                        raise
+            for future, start, stop in zip(futures, bounds[:-1], bounds[1:]):
+                try:
+                    errors.update(future.result())
+                except Exception as e:  # the worker itself died, only its block is lost
+                    errors.update({ticker: str(e) for ticker in tickers[start:stop]})
+                    if isinstance(e, BrokenProcessPool):
+                        _discard_pool(self.workers, executor)
+
+            simulation = {col: arrays[col].copy() for col in SIMULATION_COLUMNS}
+            del arrays
+            return simulation, errors
+        finally:
+            for shm in blocks.values():
+                shm.close()
+                shm.unlink()
+
+    def etf_simulation(self, ticker):
+        """Simulation of one screened ETF on its investment dates, as a long frame"""
+        j = self.close.columns.get_loc(ticker)
+        rows = np.flatnonzero(self.simulation['investment'][:, j] != 0)
+        columns = ['investment', 'etf_cumulative_investment', 'etf_units_purchased', 'total_etf_units',
+                   'cash', 'ETF_net_worth', 'ETF_PnL', 'ETF_PnL_%']
+        df = pd.DataFrame({col: self.simulation[col][rows, j] for col in columns}, index=self.close.index[rows])
+        df.index.name = 'Date'
+        df.insert(0, 'previous_day_price_closure', self.previous_close[ticker].to_numpy()[rows])
+        df['ticker'] = ticker
+        return df.reset_index()
+
+    def portfolio_data(self, composition):
+        """Downloaded frames for a [(ticker, allocation)] composition, ready for Portfolio.configure_from_data"""
+        data_dict = {}
+        for ticker, allocation in composition:
+            data = self.raw_data[ticker].copy()
+            data['etf_allocation'] = allocation
+            data_dict[(ticker, allocation)] = data
+        return data_dict
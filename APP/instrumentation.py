@@ -0,0 +1,174 @@
+import contextvars
+import math
+import threading
+import time
+from contextlib import ContextDecorator
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stages timed during the current request, in order, for the Server-Timing header
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class MetricsRegistry:
+    """Process-wide counters and latency histograms, exported in the Prometheus text format"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}  # name -> {labels: value}
+        self._histograms = {}  # name -> {labels: [bucket counts..., sum, count]}
+        self._help = {}
+        self._collectors = []  # callables returning [(name, help, labels dict, value)] gauges
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._counters.setdefault(name, {})
+            values[key] = values.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._histograms.setdefault(name, {})
+            state = values.get(key)
+            if state is None:
+                state = values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    state[i] += 1
+            state[-2] += seconds
+            state[-1] += 1
+
+    def register_collector(self, collect):
+        """collect() is called on every export and returns gauges as (name, help, labels, value) tuples"""
+        self._collectors.append(collect)
+
+    def counter_value(self, name, **labels):
+        with self._lock:
+            return self._counters.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counters = {name: dict(values) for name, values in self._counters.items()}
+            histograms = {name: {k: list(v) for k, v in values.items()} for name, values in self._histograms.items()}
+
+        for name in sorted(counters):
+            lines += self._header(name, 'counter')
+            for labels, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+        for name in sorted(histograms):
+            lines += self._header(name, 'histogram')
+            for labels, state in sorted(histograms[name].items()):
+                for bound, count in zip(self.buckets, state):
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {count}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {state[-1]}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(state[-2])}")
+                lines.append(f"{name}_count{_labels(labels)} {state[-1]}")
+
+        gauges = {}
+        for collect in self._collectors:
+            try:
+                for name, help_text, labels, value in collect():
+                    self._help.setdefault(name, help_text)
+                    gauges.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+        for name in sorted(gauges):
+            lines += self._header(name, 'gauge')
+            for labels, value in gauges[name]:
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, name, kind):
+        header = [f"# HELP {name} {self._help[name]}"] if name in self._help else []
+        return header + [f"# TYPE {name} {kind}"]
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+metrics = MetricsRegistry()
+for _name, _help in (
+        ('etf_stage_duration_seconds', "Time spent in each stage of the portfolio pipeline"),
+        ('etf_tickers_fetched_total', "Tickers whose prices were fetched successfully"),
+        ('etf_fetch_errors_total', "Tickers whose prices could not be fetched"),
+        ('etf_fetch_retries_total', "Ticker downloads retried after an error"),
+        ('etf_rows_simulated_total', "Rows of portfolio simulations computed"),
+        ('etf_screened_total', "ETFs simulated by the screener"),
+        ('etf_forecast_paths_total', "Monte Carlo paths simulated by forecast method"),
+        ('etf_backtests_total', "Scenarios backtested by rolling-start sweeps"),
+        ('etf_optimizer_candidates_total', "Candidate weight vectors evaluated by the mean-variance optimizer"),
+        ('etf_regressions_total', "ETFs fitted by the batched EMA regression"),
+        ('etf_forecast_refits_total', "Walk-forward regression refits with an out-of-sample forecast"),
+        ('http_requests_total', "HTTP requests by endpoint and status"),
+        ('http_request_duration_seconds', "HTTP request latency by endpoint")):
+    metrics.describe(_name, _help)
+
+
+class timed(ContextDecorator):
+    """Time a stage (as `with timed('fetch'):` or `@timed('fetch')`) into the stage histogram
+    and the Server-Timing entries of the current request"""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._starts = threading.local()  # a decorated method can run in several threads at once
+
+    def __enter__(self):
+        self._starts.__dict__.setdefault('stack', []).append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self._starts.stack.pop()
+        metrics.observe('etf_stage_duration_seconds', seconds, stage=self.stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((self.stage, seconds))
+        return False
+
+
+def count(name, amount=1, **labels):
+    """Increase a counter, e.g. count('etf_tickers_fetched_total', 5)"""
+    metrics.inc(name, amount, **labels)
+
+
+def start_request_timings():
+    """Collect the stages timed from now on in this context (a request), returns the list they go to"""
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings, total=None):
+    """Server-Timing value for the collected stages, stages timed several times are summed"""
+    totals = {}
+    for stage, seconds in timings:
+        duration, calls = totals.get(stage, (0.0, 0))
+        totals[stage] = (duration + seconds, calls + 1)
+    entries = [f'{stage};dur={duration * 1000:.1f}' + (f';desc="{calls}x"' if calls > 1 else '')
+               for stage, (duration, calls) in totals.items()]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
@@ -0,0 +1,93 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """A computation running in the background, with its current stage"""
+
+    def __init__(self, key, stages, context=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.context = context or {}  # what the caller needs to present the result
+        self.stages = list(stages)
+        self.stage = None
+        self.status = 'queued'  # queued -> running -> done | failed
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def set_stage(self, stage):
+        self.stage = stage
+
+    @property
+    def in_flight(self):
+        return self.status in ('queued', 'running')
+
+    def to_dict(self):
+        done = self.stages.index(self.stage) if self.stage in self.stages else 0
+        if self.status == 'done':
+            done = len(self.stages)
+        return {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'stages': self.stages,
+            'progress': round(done / len(self.stages), 2) if self.stages else 1.0,
+            'error': self.error
+        }
+
+
+class JobQueue:
+    """In-process job backend: a thread pool, identical in-flight jobs are submitted only once"""
+
+    def __init__(self, max_workers=4, ttl=3600):
+        self.ttl = ttl  # seconds a finished job stays available
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._in_flight = {}  # key -> job
+        self._lock = threading.Lock()
+
+    def submit(self, key, func, stages=(), context=None):
+        """Run func(job) in the background, or return the in-flight job already computing the same key"""
+        with self._lock:
+            self._expire()
+            job = self._in_flight.get(key)
+            if job is not None and job.in_flight:
+                return job
+            job = Job(key, stages, context)
+            self._jobs[job.id] = job
+            self._in_flight[key] = job
+        self._executor.submit(self._run, job, func)
+        return job
+
+    def in_flight_count(self):
+        with self._lock:
+            return sum(1 for job in self._in_flight.values() if job.in_flight)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, func):
+        job.status = 'running'
+        try:
+            job.result = func(job)
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                if self._in_flight.get(job.key) is job:
+                    del self._in_flight[job.key]
+
+    def _expire(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
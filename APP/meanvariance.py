@@ -0,0 +1,339 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from instrumentation import timed, count
+
+TRADING_DAYS = 252
+RISK_FREE_RATE = 0.02  # the 2% the Sharpe ratios of Portfolio subtract
+OBJECTIVES = ('max_sharpe', 'min_variance')
+
+
+class ReturnModelCache:
+    """Process-wide LRU cache of annualized mean returns and covariance matrices per (universe, window, source)"""
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (mean, covariance)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(tickers, start_date, end_date, source='yfinance'):
+        return (tuple(tickers), str(start_date)[:10], str(end_date)[:10], source)
+
+    def get(self, key, compute):
+        """Return the cached model for key, or compute() it and cache it"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        model = compute()
+        with self._lock:
+            self._entries[key] = model
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return model
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': sum(mean.nbytes + covariance.nbytes for mean, covariance in self._entries.values())
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by every optimizer of the process, sized by ETF_RETURN_MODEL_CACHE_ENTRIES
+return_model_cache = ReturnModelCache(max_entries=int(os.environ.get('ETF_RETURN_MODEL_CACHE_ENTRIES', 64)))
+
+
+def estimate_return_model(close):
+    """Annualized mean and covariance of the daily returns, on the days every ticker traded"""
+    returns = close.dropna().pct_change().iloc[1:].to_numpy(dtype=float)
+    if len(returns) < 2:
+        raise ValueError("Not enough common price history to estimate the covariance")
+    mean = returns.mean(axis=0) * TRADING_DAYS
+    covariance = np.atleast_2d(np.cov(returns, rowvar=False)) * TRADING_DAYS
+    return mean, covariance
+
+
+class OptimizationResult:
+    """Weights of an optimized portfolio and their expected return, volatility and Sharpe ratio (annualized)"""
+
+    def __init__(self, weights, expected_return, volatility, sharpe_ratio, objective):
+        self.weights = weights  # Series indexed by ticker
+        self.expected_return = expected_return
+        self.volatility = volatility
+        self.sharpe_ratio = sharpe_ratio
+        self.objective = objective
+
+    def composition(self, decimals=2):
+        """[(ticker, allocation)] for configure_from_input: allocations rounded (Portfolio keeps 2 decimals),
+        still summing to 1, and tickers rounded to zero left out"""
+        unit = 10 ** decimals
+        scaled = self.weights.to_numpy() * unit
+        rounded = np.floor(scaled)
+        # Largest remainders get the units lost by rounding down
+        missing = int(round(unit - rounded.sum()))
+        rounded[np.argsort(rounded - scaled, kind='stable')[:missing]] += 1
+        return [(ticker, float(units / unit)) for ticker, units in zip(self.weights.index, rounded) if units > 0]
+
+
+class MeanVarianceOptimizer:
+    """Max-Sharpe and min-variance portfolios and the efficient frontier of a set of ETFs.
+
+    Candidate weight vectors are drawn on the simplex, repaired into the weight bounds and category bounds,
+    and evaluated by blocks with matrix products. The best candidates are refined by drawing new ones
+    around them, for every frontier target at once, then polished by SLSQP from there: the draws alone stop
+    short of the optimum of large universes.
+    """
+
+    def __init__(self, mean, covariance, tickers, bounds=(0.0, 1.0), categories=None, category_bounds=None,
+                 risk_free_rate=RISK_FREE_RATE):
+        self.tickers = list(tickers)
+        self.mean = np.asarray(mean, dtype=float)
+        self.covariance = np.asarray(covariance, dtype=float)
+        self.risk_free_rate = risk_free_rate
+        n = len(self.tickers)
+
+        # bounds: one (min, max) pair for every ETF, or {ticker: (min, max)}
+        if isinstance(bounds, dict):
+            pairs = [bounds.get(t, (0.0, 1.0)) for t in self.tickers]
+        else:
+            pairs = [bounds] * n
+        self.lower = np.array([p[0] for p in pairs], dtype=float)
+        self.upper = np.array([p[1] for p in pairs], dtype=float)
+
+        # categories: {category: [tickers]} as etf_categories, category_bounds: {category: (min, max)}
+        self.category_names = []
+        membership = []
+        for category, (low, high) in (category_bounds or {}).items():
+            members = set((categories or {}).get(category, []))
+            if not members & set(self.tickers):
+                if low > 0:
+                    raise ValueError(f"No ETF of category {category} to allocate {low:.0%} to")
+                continue
+            self.category_names.append((category, low, high))
+            membership.append([t in members for t in self.tickers])
+        self.membership = np.array(membership, dtype=float).reshape(len(membership), n)
+        self.category_lower = np.array([low for _, low, _ in self.category_names])
+        self.category_upper = np.array([high for _, _, high in self.category_names])
+
+        if self.lower.sum() > 1 + 1e-9 or self.upper.sum() < 1 - 1e-9:
+            raise ValueError("The weight bounds do not allow weights summing to 1")
+
+    @classmethod
+    def from_prices(cls, close, source='yfinance', **constraints):
+        """Optimizer on a date x ticker close matrix, its return model shared through return_model_cache"""
+        close = close.dropna(axis=1, how='all')
+        key = ReturnModelCache.make_key(close.columns, close.index[0], close.index[-1], source)
+        mean, covariance = return_model_cache.get(key, lambda: estimate_return_model(close))
+        return cls(mean, covariance, close.columns, **constraints)
+
+    def evaluate(self, weights):
+        """Expected return, volatility and Sharpe ratio of every row of a (candidates x ETFs) weight matrix"""
+        expected_return = weights @ self.mean
+        volatility = np.sqrt(np.maximum(((weights @ self.covariance) * weights).sum(axis=1), 0.0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sharpe_ratio = (expected_return - self.risk_free_rate) / volatility
+        return expected_return, volatility, sharpe_ratio
+
+    def repair(self, weights, iterations=30):
+        """Move candidates into the bounds: alternately clip the weights, rescale the categories out of their
+        bounds and bring the sum back to 1, until every constraint is met. Returns the weights and a mask of the
+        candidates meeting every constraint."""
+        weights = self._repair_pass(np.array(weights, dtype=float))
+        if not len(self.category_names):
+            return weights, self.feasible(weights)  # without categories one pass meets the bounds exactly
+        # Candidates leave the loop once they meet the bounds to rounding, a looser tolerance would let the
+        # search prefer candidates slightly outside them
+        met = self.feasible(weights, tolerance=1e-12)
+        for _ in range(iterations - 1):
+            pending = np.flatnonzero(~met)
+            if not len(pending):
+                break
+            weights[pending] = self._repair_pass(weights[pending])
+            met[pending] = self.feasible(weights[pending], tolerance=1e-12)
+        return weights, self.feasible(weights)
+
+    def _repair_pass(self, weights):
+        weights = np.clip(weights, self.lower, self.upper)
+        if len(self.category_names):
+            totals = weights @ self.membership.T
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scale = np.where(totals > self.category_upper, self.category_upper / totals,
+                                 np.where(totals < self.category_lower, self.category_lower / totals, 1.0))
+            # A category with no weight at all gets its minimum split evenly between its ETFs
+            empty = (totals <= 0) & (self.category_lower > 0)
+            scale = np.where(empty, 1.0, scale)
+            weights = weights * np.exp(np.log(scale) @ self.membership)
+            weights += (empty * self.category_lower / self.membership.sum(axis=1)) @ self.membership
+        # Fill the gap to a sum of 1 from the room each ETF has within its bounds, which keeps them met
+        weights = np.clip(weights, self.lower, self.upper)
+        gap = 1 - weights.sum(axis=1, keepdims=True)
+        room = np.where(gap > 0, self.upper - weights, weights - self.lower)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return weights + np.nan_to_num(gap * room / room.sum(axis=1, keepdims=True))
+
+    def feasible(self, weights, tolerance=1e-6):
+        ok = ((weights >= self.lower - tolerance) & (weights <= self.upper + tolerance)).all(axis=1)
+        if len(self.category_names):
+            totals = weights @ self.membership.T
+            ok &= ((totals >= self.category_lower - tolerance) & (totals <= self.category_upper + tolerance)).all(axis=1)
+        return ok & np.isfinite(weights).all(axis=1)
+
+    def sample(self, rng, n_candidates, center=None, scale=None):
+        """Feasible candidates drawn uniformly on the simplex, or around `center` (rows of weights, one per
+        target) moved by gaussian steps of standard deviation `scale`"""
+        if center is None:
+            draws = rng.dirichlet(np.ones(len(self.tickers)), n_candidates)
+        else:
+            steps = rng.normal(0.0, scale, (len(center), n_candidates, len(self.tickers)))
+            draws = (center[:, None, :] + steps).reshape(-1, len(self.tickers))
+        return self.repair(draws)
+
+    def _polish(self, score, best, min_return=None):
+        """Each target's best weights, shape (targets, ETFs), refined by scipy's SLSQP within the weight bounds,
+        the sum of 1, the category bounds and an expected return of at least min_return (one per target).
+
+        The gradient goes through the expected return and volatility: score's slopes in both are taken by
+        central differences (it is any function of them), times their gradients mean and covariance @ w / vol.
+        A solution is kept only if it meets the bounds and lowers the score, so the result is never worse."""
+        from scipy.optimize import minimize  # scipy comes with sklearn, loaded by the first optimization only
+
+        def value(weights, row, epsilon=0.0, by=None):
+            expected_return, volatility, _ = self.evaluate(weights[None, :])
+            expected_return = expected_return + (epsilon if by == 'return' else 0.0)
+            volatility = volatility + (epsilon if by == 'volatility' else 0.0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                sharpe = (expected_return - self.risk_free_rate) / volatility
+            shape = (len(best), 1)  # score() takes (targets x candidates) arrays
+            values = score(*(np.broadcast_to(v, shape) for v in (expected_return, volatility, sharpe)))
+            return float(np.broadcast_to(values, shape)[row, 0])
+
+        def gradient(weights, row, epsilon=1e-7):
+            volatility = max(float(self.evaluate(weights[None, :])[1][0]), 1e-12)
+            by_return, by_volatility = (
+                (value(weights, row, epsilon, by) - value(weights, row, -epsilon, by)) / (2 * epsilon)
+                for by in ('return', 'volatility'))
+            return by_return * self.mean + by_volatility * (self.covariance @ weights) / volatility
+
+        def acceptable(weights, row):
+            ok = self.feasible(weights[None, :])[0]
+            if min_return is not None:
+                ok &= weights @ self.mean >= min_return[row] - 1e-6
+            return ok
+
+        constraints = [{'type': 'eq', 'fun': lambda w: w.sum() - 1, 'jac': lambda w: np.ones_like(w)}]
+        if len(self.category_names):
+            constraints += [
+                {'type': 'ineq', 'fun': lambda w: self.membership @ w - self.category_lower,
+                 'jac': lambda w: self.membership},
+                {'type': 'ineq', 'fun': lambda w: self.category_upper - self.membership @ w,
+                 'jac': lambda w: -self.membership}
+            ]
+        best = best.copy()
+        for row in range(len(best)):
+            row_constraints = constraints
+            if min_return is not None:
+                row_constraints = constraints + [{'type': 'ineq', 'fun': lambda w, r=row: w @ self.mean - min_return[r],
+                                                  'jac': lambda w: self.mean}]
+            solution = minimize(value, best[row], args=(row,), jac=gradient, method='SLSQP',
+                                bounds=list(zip(self.lower, self.upper)), constraints=row_constraints,
+                                options={'ftol': 1e-15, 'maxiter': 500})
+            weights = np.clip(solution.x, self.lower, self.upper)
+            if not np.isfinite(weights).all() or not acceptable(weights, row):
+                continue
+            start = value(best[row], row) if acceptable(best[row], row) else np.inf
+            if value(weights, row) < start:
+                best[row] = weights
+        return best
+
+    def _search(self, score, targets, candidates, rounds, seed, initial=None, polish=True):
+        """Weights with the lowest score for every target, shape (targets, ETFs).
+
+        score(expected_return, volatility, sharpe) gets (1 x candidates) arrays for the uniform draw shared by
+        all targets, then (targets x candidates) arrays for the rounds of draws around each target's best and
+        (targets x 1) arrays for the polish of the best. `initial` are feasible weights added to the uniform draw."""
+        rng = np.random.default_rng(seed)
+        weights, ok = self.sample(rng, candidates)
+        equal = self.repair(np.full((1, len(self.tickers)), 1 / len(self.tickers)))[0]
+        weights = np.vstack([weights[ok], equal] + ([initial] if initial is not None else []))
+        weights = weights[self.feasible(weights)]
+        if not len(weights):
+            raise ValueError("No weights meet the weight and category bounds")
+        evaluated = len(weights)
+        scores = np.broadcast_to(score(*(values[None, :] for values in self.evaluate(weights))),
+                                 (targets, len(weights)))
+        best = weights[np.argmin(scores, axis=1)]
+        best_score = scores.min(axis=1)
+
+        for round_ in range(rounds):
+            local, ok = self.sample(rng, candidates, best, 0.1 * 0.7 ** round_)
+            local = np.where(ok[:, None], local, 0.0)
+            evaluated += int(ok.sum())
+            values = (v.reshape(targets, candidates) for v in self.evaluate(local))
+            own = np.where(ok.reshape(targets, candidates), score(*values), np.inf)
+            choice = np.argmin(own, axis=1)
+            improved = own[np.arange(targets), choice] < best_score
+            best[improved] = local.reshape(targets, candidates, -1)[improved, choice[improved]]
+            best_score = np.where(improved, own[np.arange(targets), choice], best_score)
+        count('etf_optimizer_candidates_total', evaluated)
+        return self._polish(score, best) if polish else best
+
+    def _result(self, weights, objective):
+        expected_return, volatility, sharpe = self.evaluate(weights[None, :])
+        return OptimizationResult(pd.Series(weights, index=self.tickers, name='weight'),
+                                  float(expected_return[0]), float(volatility[0]), float(sharpe[0]), objective)
+
+    @timed('mean_variance')
+    def optimize(self, objective='max_sharpe', candidates=4000, rounds=25, seed=0):
+        """Weights maximizing the Sharpe ratio or minimizing the variance within the bounds"""
+        if objective not in OBJECTIVES:
+            raise ValueError(f"Unknown objective: {objective} (expected one of {', '.join(OBJECTIVES)})")
+        if objective == 'max_sharpe':
+            score = lambda r, v, s: -np.nan_to_num(s, nan=-np.inf)
+        else:
+            score = lambda r, v, s: v
+        return self._result(self._search(score, 1, candidates, rounds, seed)[0], objective)
+
+    @timed('mean_variance')
+    def efficient_frontier(self, points=30, candidates=1000, rounds=25, seed=0):
+        """Lowest-volatility weights for `points` expected returns from the min-variance portfolio to the best
+        reachable return, searched together. Returns one row per point: expected_return, volatility,
+        sharpe_ratio and the weight of every ETF."""
+        low = self._search(lambda r, v, s: v, 1, candidates * 4, rounds, seed)
+        # Highest reachable return: all the weight the bounds allow on the best ETFs
+        high = self._search(lambda r, v, s: -r, 1, candidates * 4, rounds, seed)
+        # The bounds are convex, so the mixes of both portfolios are feasible and reach every target return
+        mixes = np.linspace(0, 1, points)[:, None]
+        line = (1 - mixes) * low + mixes * high
+        targets = self.evaluate(line)[0]
+        penalty = 100 * max(float(np.sqrt(np.max(np.diag(self.covariance)))), 1e-6) / max(np.ptp(targets), 1e-9)
+        score = lambda r, v, s: v + penalty * np.maximum(targets[:, None] - r, 0)
+        best = self._search(score, points, candidates, rounds, seed, initial=line, polish=False)
+        # Polished on the weights reaching each target, where the penalty is 0 and only the volatility is left
+        best = self._polish(lambda r, v, s: v, best, min_return=targets)
+
+        expected_return, volatility, sharpe = self.evaluate(best)
+        frontier = pd.DataFrame(best, columns=self.tickers)
+        frontier.insert(0, 'sharpe_ratio', sharpe)
+        frontier.insert(0, 'volatility', volatility)
+        frontier.insert(0, 'expected_return', expected_return)
+        # Points that missed their target and are dominated by another one are not on the frontier
+        order = np.argsort(-expected_return, kind='stable')
+        dominated = np.zeros(len(best), dtype=bool)
+        dominated[order[1:]] = volatility[order[1:]] > np.minimum.accumulate(volatility[order])[:-1] + 1e-12
+        return frontier[~dominated].sort_values('expected_return').reset_index(drop=True)
@@ -0,0 +1,228 @@
+import numpy as np
+import pandas as pd
+from pandas.tseries.offsets import BDay
+from contributionschedule import build_contribution_schedule
+from purchaseengine import purchase_step
+from instrumentation import timed, count
+
+METHODS = ('bootstrap', 'block_bootstrap', 'gbm')
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+# Net worth bands are histograms of net worth / cumulative investment on a log scale, so memory does not
+# grow with the number of paths: BAND_BINS bins between 10^BAND_RANGE[0] and 10^BAND_RANGE[1] (~0.6% wide)
+BAND_BINS = 2400
+BAND_RANGE = (-3.0, 3.0)
+
+
+class ForecastResult:
+    """Percentile bands of a Monte Carlo projection.
+
+    bands: net worth per percentile (columns p5, p50, ...) on the band dates, cumulative_investment on
+    the same dates, final_net_worth and cagr: the exact value of every path at the horizon.
+    """
+
+    def __init__(self, bands, cumulative_investment, final_net_worth, cagr, percentiles, method, years):
+        self.bands = bands
+        self.cumulative_investment = cumulative_investment
+        self.final_net_worth = final_net_worth
+        self.cagr = cagr
+        self.percentiles = list(percentiles)
+        self.method = method
+        self.years = years
+
+    @property
+    def paths(self):
+        return len(self.final_net_worth)
+
+    def summary(self):
+        invested = float(self.cumulative_investment.iloc[-1])
+        return {
+            'method': self.method,
+            'paths': self.paths,
+            'years': self.years,
+            'invested': invested,
+            'final_net_worth': {f"p{p:g}": float(v) for p, v in
+                                zip(self.percentiles, np.percentile(self.final_net_worth, self.percentiles))},
+            'cagr': {f"p{p:g}": float(v) for p, v in zip(self.percentiles, np.percentile(self.cagr, self.percentiles))},
+            'probability_of_loss': float(np.mean(self.final_net_worth < invested))
+        }
+
+
+class MonteCarloForecaster:
+    """Forward projections of a DCA plan on simulated future prices.
+
+    Daily log returns of the ETFs on their common trading days are resampled day by day (bootstrap),
+    in blocks of consecutive days (block_bootstrap, keeps autocorrelation) or drawn from a multivariate
+    normal fitted on them (gbm, keeps the correlation matrix). Every path is then invested with the
+    same schedule and the same whole-unit purchase rule with fees as apply_ETF_purchase. Paths are
+    simulated in chunks, only their prices on the contribution dates are generated.
+    """
+
+    def __init__(self, close, fees, allocations):
+        close = close.dropna()
+        self.tickers = list(close.columns)
+        self.last_close = close.iloc[-1].to_numpy(dtype=float)
+        self.last_date = pd.Timestamp(close.index[-1]).tz_localize(None)
+        self.fees = np.array([fees[t] for t in self.tickers], dtype=float)
+        self.allocations = np.array([allocations[t] for t in self.tickers], dtype=float)
+        self.log_returns = np.diff(np.log(close.to_numpy(dtype=float)), axis=0)
+        if len(self.log_returns) < 2:
+            raise ValueError("Not enough common price history to forecast")
+        # Prefix sums of the returns (wrapped by one block), the sum over any run of days is one subtraction
+        self._cumulative = {}  # block_size -> prefix sums
+        self.mean = self.log_returns.mean(axis=0)
+        self.covariance = np.atleast_2d(np.cov(self.log_returns, rowvar=False))
+
+    @classmethod
+    def from_portfolio(cls, portfolio):
+        """Forecaster on the prices, fees and allocations a configured Portfolio loaded"""
+        closes, fees, allocations = {}, {}, {}
+        for ticker, data in portfolio.dict_of_dfs.items():
+            closes[ticker] = pd.Series(data['Close'].to_numpy(), index=pd.DatetimeIndex(data.index).tz_localize(None))
+            fees[ticker] = float(data['fees'].iloc[0])
+            allocations[ticker] = float(data['etf_allocation'].iloc[0])
+        return cls(pd.DataFrame(closes).sort_index(), fees, allocations)
+
+    def schedule(self, initial_amount, periodic_amount, years, frequency='M', start_date=None):
+        """Rows of the projection: contribution dates and the horizon, with their business-day
+        offsets from the last known close and the contribution per ETF on each"""
+        start = pd.Timestamp(start_date) if start_date is not None else self.last_date + BDay(1)
+        end = start + pd.DateOffset(years=years)
+        calendar = pd.bdate_range(start, end, inclusive='left')
+        initial_date, periodic_dates = build_contribution_schedule(calendar, start, frequency)
+
+        contributions = pd.Series(0.0, index=calendar)
+        if initial_date is not None:
+            contributions[initial_date] += initial_amount
+        contributions[periodic_dates] = periodic_amount
+        contributions = contributions[contributions != 0]
+        if contributions.empty:
+            raise ValueError("The plan has no contribution")
+
+        # A purchase at row r uses the previous close, `offsets` returns after the last known close
+        offset_of_start = max(len(pd.bdate_range(self.last_date, start, inclusive='neither')), 0)
+        offsets = offset_of_start + calendar.get_indexer(contributions.index)
+        dates = contributions.index.append(pd.DatetimeIndex([calendar[-1]]))
+        offsets = np.append(offsets, offset_of_start + len(calendar))
+        amounts = np.append(contributions.to_numpy(), 0.0)  # the horizon row only values the portfolio
+        return dates, offsets, amounts[:, None] * self.allocations
+
+    def _block_sums(self, rng, n_paths, first_day, n_days, block_size, state):
+        """Sum of the block-bootstrapped log returns of days [first_day, first_day + n_days) of every path.
+
+        Day d of a path is day (d % block_size) of its block d // block_size, blocks start at random days of
+        the history (circularly), state keeps the current block start of each path between calls.
+        """
+        n = len(self.log_returns)
+        if block_size not in self._cumulative:
+            wrapped = np.concatenate([self.log_returns, np.resize(self.log_returns, (block_size, len(self.tickers)))])
+            self._cumulative[block_size] = np.concatenate([np.zeros((1, wrapped.shape[1])), np.cumsum(wrapped, axis=0)])
+        cumulative = self._cumulative[block_size]
+        total = np.zeros((n_paths, len(self.tickers)))
+        day = first_day
+        end = first_day + n_days
+        while day < end:
+            block, offset = divmod(day, block_size)
+            if block != state['block']:
+                state['start'] = rng.integers(0, n, n_paths)
+                state['block'] = block
+            length = min(block_size - offset, end - day)
+            begin = state['start'] + offset
+            total += cumulative[begin + length] - cumulative[begin]
+            day += length
+        return total
+
+    def _period_returns(self, rng, method, n_paths, first_day, n_days, block_size, state, cholesky):
+        if n_days == 0:
+            return np.zeros((n_paths, len(self.tickers)))
+        if method == 'gbm':
+            z = rng.standard_normal((n_paths, len(self.tickers)))
+            return n_days * self.mean + np.sqrt(n_days) * z @ cholesky.T
+        if method == 'block_bootstrap':
+            return self._block_sums(rng, n_paths, first_day, n_days, block_size, state)
+        days = rng.integers(0, len(self.log_returns), (n_paths, n_days))
+        return self.log_returns[days].sum(axis=1)
+
+    @timed('forecast')
+    def forecast(self, initial_amount, periodic_amount, years, frequency='M', paths=10000, method='bootstrap',
+                 block_size=20, percentiles=DEFAULT_PERCENTILES, seed=None, start_date=None, chunk_size=None,
+                 band_points=200, max_chunk_elements=4_000_000):
+        """Simulate `paths` futures of the plan, returns a ForecastResult.
+
+        Results are reproducible for a given seed and chunk_size. chunk_size defaults to the number of
+        paths whose per-period draws fit in max_chunk_elements floats.
+        """
+        if method not in METHODS:
+            raise ValueError(f"Unknown forecast method: {method} (expected one of {', '.join(METHODS)})")
+        dates, offsets, contributions = self.schedule(initial_amount, periodic_amount, years, frequency, start_date)
+        period_days = np.diff(np.concatenate([[0], offsets]))
+        n_rows, n_etfs = contributions.shape
+        if chunk_size is None:
+            per_path = n_etfs * (int(period_days.max()) if method == 'bootstrap' else 4)
+            chunk_size = int(np.clip(max_chunk_elements // max(per_path, 1), 256, 100_000))
+        cholesky = np.linalg.cholesky(self.covariance + 1e-12 * np.eye(n_etfs)) if method == 'gbm' else None
+
+        price_factor = 1 + self.fees  # purchases pay the fees on top of the previous close
+        cumulative_investment = np.cumsum(contributions.sum(axis=1))
+        band_rows = np.unique(np.linspace(0, n_rows - 1, min(band_points, n_rows)).round().astype(int))
+        histograms = np.zeros((len(band_rows), BAND_BINS), dtype=np.int64)
+        band_slot = np.full(n_rows, -1)
+        band_slot[band_rows] = np.arange(len(band_rows))
+        final_net_worth = np.empty(paths)
+
+        seeds = np.random.SeedSequence(seed).spawn(-(-paths // chunk_size))
+        for chunk, chunk_seed in enumerate(seeds):
+            rng = np.random.default_rng(chunk_seed)
+            first = chunk * chunk_size
+            n_paths = min(chunk_size, paths - first)
+            log_price = np.broadcast_to(np.log(self.last_close), (n_paths, n_etfs)).copy()
+            leftover = np.zeros((n_paths, n_etfs))
+            total_units = np.zeros((n_paths, n_etfs))
+            state = {'block': -1, 'start': None}
+            day = 0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for row in range(n_rows):
+                    log_price += self._period_returns(rng, method, n_paths, day, period_days[row], block_size, state,
+                                                      cholesky)
+                    day += period_days[row]
+                    price = np.exp(log_price) * price_factor
+                    active = contributions[row] != 0
+                    _, leftover, total_units, net_worth = purchase_step(contributions[row], leftover, total_units,
+                                                                        price, active)
+                    if band_slot[row] >= 0:
+                        self._add_to_histogram(histograms[band_slot[row]],
+                                               net_worth.sum(axis=1) / cumulative_investment[row])
+            final_net_worth[first:first + n_paths] = net_worth.sum(axis=1)
+        count('etf_forecast_paths_total', paths, method=method)
+
+        invested = cumulative_investment[-1]
+        cagr = ((final_net_worth / invested) ** (1 / years) - 1) * 100
+        band_dates = dates[band_rows]
+        bands = pd.DataFrame({
+            f"p{p:g}": self._histogram_percentile(histograms, p) * cumulative_investment[band_rows]
+            for p in percentiles
+        }, index=pd.DatetimeIndex(band_dates, name='Date'))
+        return ForecastResult(bands, pd.Series(cumulative_investment[band_rows], index=bands.index,
+                                               name='cumulative_investment'),
+                              final_net_worth, cagr, percentiles, method, years)
+
+    @staticmethod
+    def _add_to_histogram(histogram, multiples):
+        low, high = BAND_RANGE
+        with np.errstate(divide='ignore'):
+            position = (np.log10(multiples) - low) / (high - low) * BAND_BINS
+        bins = np.clip(np.nan_to_num(position, nan=0.0, neginf=0.0, posinf=BAND_BINS - 1), 0, BAND_BINS - 1)
+        histogram += np.bincount(bins.astype(np.int64), minlength=BAND_BINS)
+
+    @staticmethod
+    def _histogram_percentile(histograms, percentile):
+        """Multiple at the percentile of each histogram, interpolated inside its bin on the log scale"""
+        low, high = BAND_RANGE
+        cumulative = np.cumsum(histograms, axis=1)
+        target = cumulative[:, -1] * percentile / 100
+        bins = np.minimum((cumulative < target[:, None]).sum(axis=1), BAND_BINS - 1)
+        rows = np.arange(len(histograms))
+        below = np.where(bins > 0, cumulative[rows, np.maximum(bins - 1, 0)], 0)
+        inside = histograms[rows, bins]
+        fraction = np.where(inside > 0, (target - below) / np.maximum(inside, 1), 0.5)
+        return 10 ** (low + (bins + fraction) / BAND_BINS * (high - low))
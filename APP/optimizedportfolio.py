@@ -1,61 +1,48 @@
+import os
 from portfolio import Portfolio
-import matplotlib.pyplot as plt
+from etfscreener import ETFScreener
+from meanvariance import MeanVarianceOptimizer
+from chartcache import chart_cache
+from instrumentation import timed
+from visualizer import new_figure
+
+# How the composition is chosen: equal weights on the top 5 performers, or mean-variance weights
+STRATEGIES = {
+    'top_performers': 'TOP 5 ETFs Portfolio',
+    'max_sharpe': 'Max Sharpe Portfolio',
+    'min_variance': 'Min Variance Portfolio'
+}
 
 class OptimizedPortfolio(Portfolio):
-    def __init__(self):
-        super().__init__()
-        self.etf_categories = {
-            'US Large Cap': ['SPY'],          # SPDR S&P 500 ETF (most popular)
-            'US Growth': ['QQQ'],             # Invesco QQQ (Nasdaq-100, very popular)
-            'US Value': ['VTV'],              # Vanguard Value ETF
-            'US Small Cap': ['IWM'],          # iShares Russell 2000 ETF
-            'International Developed': ['VEA'], # Vanguard FTSE Developed Markets
-            'Emerging Markets': ['VWO'],      # Vanguard FTSE Emerging Markets
-            'Sector ETFs': ['XLK'],           # Technology Select Sector SPDR
-            'Fixed Income': ['BND'],          # Vanguard Total Bond Market ETF
-            'Real Estate': ['VNQ'],           # Vanguard Real Estate ETF
-            'Commodities': ['GLD'],           # SPDR Gold Shares
-            'Alternative': ['ARKK'],          # ARK Innovation ETF
-            'Thematic': ['SOXX'],             # iShares Semiconductor ETF
-            'Factor ETFs': ['MTUM'],          # iShares MSCI USA Momentum Factor
-            'Dividend': ['SCHD']              # Schwab US Dividend Equity ETF
-        }
+    def __init__(self, universe_path=None, workers=None, provider=None, data_retrieval=None, strategy=None,
+                 weight_bounds=(0.0, 1.0), category_bounds=None):
+        super().__init__(provider, data_retrieval)
+        # {category: [tickers]} screened for the top performers, read from etf_universe.json by default
+        self.etf_categories = ETFScreener.load_universe(universe_path)
+        self.screener = None
+        # Worker processes used to evaluate the ETFs, opt-in through ETF_SCREENER_WORKERS
+        self.workers = workers if workers is not None else int(os.environ.get('ETF_SCREENER_WORKERS', 1))
+        # Strategy from ETF_OPTIMIZER, the mean-variance ones take (min, max) weight and {category: (min, max)} bounds
+        self.strategy = strategy or os.environ.get('ETF_OPTIMIZER', 'top_performers')
+        if self.strategy not in STRATEGIES:
+            raise ValueError(f"Unknown optimization strategy: {self.strategy}")
+        self.weight_bounds = weight_bounds
+        self.category_bounds = category_bounds
+        self.optimizer = None
+        self.optimization = None
     
     def calculate_etf_performance(self, initial_amount, monthly_amount, start_date, duration, frequency):
         """Calculate performance of all ETFs in our categories"""
+        # All ETFs are loaded in one price matrix and simulated at 100% allocation in one pass
+        self.screener = ETFScreener(self.etf_categories, data_retrieval=self.data_retrieval, workers=self.workers)
+        ranking = self.screener.screen(initial_amount, monthly_amount, start_date, duration, frequency)
+
         etf_performance = {}
-        
-        # Test each ETF individually
-        for category, etfs in self.etf_categories.items():
-            for etf in etfs:
-                try:
-                    # Create portfolio with 100% allocation to this ETF
-                    temp_portfolio = Portfolio()
-                    temp_portfolio.configure_from_input(
-                        initial_amount,
-                        monthly_amount,
-                        start_date,
-                        duration,
-                        [(etf, 1.0)],
-                        frequency
-                    )
-                    
-                    # Get the performance data
-                    temp_data = temp_portfolio.apply_ETF_purchase()
-                    
-                    # Get the final PnL%
-                    final_pnl = temp_data['ETF_PnL_%'].iloc[-1]
-                    
-                    # Store the performance
-                    etf_performance[etf] = {
-                        'category': category,
-                        'final_pnl': final_pnl,
-                        'data': temp_data
-                    }
-                except Exception as e:
-                    print(f"Error processing {etf}: {str(e)}")
-                    continue
-        
+        for etf, row in ranking.iterrows():
+            etf_performance[etf] = {
+                'category': row['category'],
+                'final_pnl': row['final_pnl']
+            }
         return etf_performance
     
     def get_top_performers(self, etf_performance, top_n=5):
@@ -77,50 +64,96 @@ class OptimizedPortfolio(Portfolio):
         optimized_composition = [(etf[0], allocation) for etf in top_etfs]
         
         # Get the performance data for each top ETF
-        top_performers_data = {etf[0]: etf[1]['data'] for etf in top_etfs}
+        top_performers_data = {etf[0]: self.screener.etf_simulation(etf[0]) for etf in top_etfs}
         
         return optimized_composition, top_performers_data
     
+    def mean_variance_optimizer(self, tickers):
+        """Optimizer on the prices loaded by the screener, with the strategy's bounds"""
+        return MeanVarianceOptimizer.from_prices(
+            self.screener.close[tickers],
+            source=self.data_retrieval.provider.name,
+            bounds=self.weight_bounds,
+            categories=self.etf_categories,
+            category_bounds=self.category_bounds
+        )
+
+    def get_mean_variance_allocation(self, etf_performance, objective):
+        """Max-Sharpe or min-variance weights over the screened ETFs"""
+        self.optimizer = self.mean_variance_optimizer(list(etf_performance))
+        self.optimization = self.optimizer.optimize(objective)
+        optimized_composition = self.optimization.composition()
+        performers_data = {etf: self.screener.etf_simulation(etf) for etf, _ in optimized_composition}
+        return optimized_composition, performers_data
+
+    def efficient_frontier(self, points=30):
+        """Efficient frontier of the screened ETFs, once the portfolio was optimized with a mean-variance strategy"""
+        if self.optimizer is None:
+            raise ValueError("The efficient frontier needs a mean-variance strategy")
+        return self.optimizer.efficient_frontier(points)
+
+    @property
+    def label(self):
+        return STRATEGIES[self.strategy]
+
+    @timed('optimize')
     def create_optimized_portfolio(self, initial_amount, monthly_amount, start_date, duration, frequency):
-        """Create an optimized portfolio from top performers"""
+        """Create an optimized portfolio from top performers (or mean-variance weights, see strategy)"""
         # Calculate performance of all ETFs
         etf_performance = self.calculate_etf_performance(
             initial_amount, monthly_amount, start_date, duration, frequency
         )
         
         # Get top performers
-        optimized_composition, top_performers_data = self.get_top_performers(etf_performance)
+        if self.strategy == 'top_performers':
+            optimized_composition, top_performers_data = self.get_top_performers(etf_performance)
+        else:
+            optimized_composition, top_performers_data = self.get_mean_variance_allocation(
+                etf_performance, self.strategy
+            )
         
-        # Create the optimized portfolio
-        self.configure_from_input(
+        # Create the optimized portfolio from the prices already loaded by the screener
+        self.configure_from_data(
             initial_amount,
             monthly_amount,
             start_date,
             duration,
             optimized_composition,
+            self.screener.portfolio_data(optimized_composition),
             frequency
         )
         return optimized_composition, top_performers_data
     
+    def comparison_data(self, user_portfolio_data):
+        """PnL % per date of the user portfolio (its PortfolioMatrix) and of this one"""
+        # Get our portfolio data (cached simulation, also used for the CAGR and Sharpe ratio)
+        optimized_data = self.simulation_matrix
+        return {
+            'user': user_portfolio_data.portfolio_series('Portfolio_PnL_%'),
+            'optimized': optimized_data.portfolio_series('Portfolio_PnL_%')
+        }
+
     def compare_with_user_portfolio(self, user_portfolio_data):
         """Compare optimized portfolio with user's portfolio"""
-        # Get our portfolio data
-        optimized_data = self.apply_ETF_purchase()
-        
         # Prepare comparison data
-        comparison_data = {
-            'user': user_portfolio_data.groupby('Date')['Portfolio_PnL_%'].first(),
-            'optimized': optimized_data.groupby('Date')['Portfolio_PnL_%'].first()
-        }
+        comparison_data = self.comparison_data(user_portfolio_data)
         
         # Create comparison plot
-        fig, ax = plt.subplots(figsize=(10, 6))
+        fig, ax = new_figure()
         comparison_data['user'].plot(ax=ax, label='Your Portfolio')
-        comparison_data['optimized'].plot(ax=ax, label='TOP 5 ETFs Portfolio')
+        comparison_data['optimized'].plot(ax=ax, label=self.label)
         
-        ax.set_title('Portfolio PnL Comparison: Your Portfolio vs Top 5 ETFs')
+        ax.set_title('Portfolio PnL Comparison: Your Portfolio vs ' +
+                     ('Top 5 ETFs' if self.strategy == 'top_performers' else self.label))
         ax.set_ylabel('PnL (%)')
         ax.grid(True)
         ax.legend()
         
         return fig
+
+    def encoded_comparison_plot(self, user_portfolio_data):
+        """Comparison plot as base64 PNG, from the chart cache when the same series were already drawn"""
+        comparison_data = self.comparison_data(user_portfolio_data)
+        labels = [] if self.strategy == 'top_performers' else [self.label]  # legend of the other strategies
+        key = chart_cache.make_key('comparison', comparison_data['user'], comparison_data['optimized'], *labels)
+        return chart_cache.get_or_render(key, lambda: self.compare_with_user_portfolio(user_portfolio_data))
@@ -1,10 +1,22 @@
 from etfdataretrieval import ETFDataRetrieval
-from visualizer import Visualizer
+from rebalancing import simulate_rebalancing
+from contributionschedule import build_contribution_schedule
+from benchmarkcache import BenchmarkCache, benchmark_cache
+from portfoliomatrix import PortfolioMatrix
+from montecarlo import MonteCarloForecaster
+from portfoliostate import PortfolioState
+from instrumentation import timed, count
 import pandas as pd
 import numpy as np
 
 class Portfolio:
-    def __init__(self):
+    def __init__(self, provider=None, data_retrieval=None, rebalance=None, rebalance_threshold=None):
+        # Source of prices and ETF info, the configured price provider unless another one is given
+        self.data_retrieval = data_retrieval if data_retrieval is not None else ETFDataRetrieval(provider=provider)
+        # Rebalancing to the allocations: on the first trading day of every period of a frequency code
+        # ('M', 'Q', 'Y'...) and/or when an ETF weight drifts more than rebalance_threshold (0.05 = 5 points)
+        self.rebalance = rebalance
+        self.rebalance_threshold = rebalance_threshold
         self.investment_initial_amount = None
         self.investment_monthly_amount = None
         self.investment_start_date = None
@@ -17,8 +29,15 @@ class Portfolio:
         self.sharpe_ratio = None
         self.volatility = None
         self.investment_frequency = None
+        self._simulation = None
+        self.simulation_runs = 0  # times the purchase simulation actually ran since the last configuration
     
     def configure_from_input(self, initial_amount, monthly_amount, start_date, duration, etfs, frequency='M'):
+        self.configure_from_data(initial_amount, monthly_amount, start_date, duration, etfs, None, frequency)
+
+    @timed('configure')
+    def configure_from_data(self, initial_amount, monthly_amount, start_date, duration, etfs, data_dict, frequency='M'):
+        """Same as configure_from_input, with prices already downloaded by portfolio_data_retrieval (None fetches them)"""
         self.investment_initial_amount = initial_amount
         self.investment_monthly_amount = monthly_amount
         self.investment_start_date = pd.to_datetime(start_date)
@@ -26,141 +45,118 @@ class Portfolio:
         self.etfs = etfs
         self.end_date = (self.investment_start_date + pd.DateOffset(years=duration)).strftime("%Y-%m-%d")
         self.investment_frequency = frequency
+        self._simulation = None  # inputs changed, the cached simulation is no longer valid
+        self.simulation_runs = 0
         
         # Get ETF data
-        etf_retriever = ETFDataRetrieval()
-        data_dict = etf_retriever.portfolio_data_retrieval(etfs, start_date, self.end_date)
+        etf_retriever = self.data_retrieval
+        if data_dict is None:
+            data_dict = etf_retriever.portfolio_data_retrieval(etfs, start_date, self.end_date)
         self.df_etf = etf_retriever.data_cleaning(data_dict)
         self.df_etf['previous_day_price_closure'] = self.df_etf['Close'].shift(1)
         self.df_etf = self.df_etf.iloc[1:].sort_index()
         self.dict_of_dfs = {ticker: group for ticker, group in self.df_etf.groupby('ticker')}
 
-    def apply_periodic_investment(self):
+    @timed('periodic_investment')
+    def apply_periodic_investment(self, all_dates=False):
+        """Contribution of every ETF on its investment dates (on all its trading days with all_dates)"""
         dict_etf = {}
+        schedules = {}  # one schedule per trading calendar, shared by the tickers trading on it
         
         for ticker, ticker_df in self.dict_of_dfs.items():
             df = ticker_df.copy()
-            df.index = pd.to_datetime(df.index)
+            if not isinstance(df.index, pd.DatetimeIndex):
+                df.index = pd.to_datetime(df.index)
             df.index = df.index.tz_localize(None)
-            start_date = pd.to_datetime(self.investment_start_date)
             df['investment'] = 0.0
 
-            # Initial investment
-            if start_date in df.index:
-                df.at[start_date, 'investment'] += self.investment_initial_amount * float(df.loc[start_date, 'etf_allocation'])
-            else:
-                closest = df.index[df.index >= start_date].min()
-                if pd.notna(closest):
-                    df.at[closest, 'investment'] += self.investment_initial_amount * float(df.loc[closest, 'etf_allocation'])
-                    start_date = closest
-
-            # Determine frequency and first investment date
-            if self.investment_frequency == 'M':
-                freq_offset = pd.DateOffset(months=1)
-                period = 'M'
-            elif self.investment_frequency == 'Q':
-                freq_offset = pd.DateOffset(months=3)
-                period = 'Q'
-            elif self.investment_frequency == '6M':
-                freq_offset = pd.DateOffset(months=6)
-                period = '6M'
-            elif self.investment_frequency == 'Y':
-                freq_offset = pd.DateOffset(years=1)
-                period = 'Y'
-            
-            first_periodic_date = start_date + freq_offset
-            
-            # Get unique periods based on frequency
-            periods = df.index.to_series().dt.to_period(period).unique()
-            
-            for p in periods:
-                period_start = pd.Period(p).start_time
-                if period_start >= first_periodic_date:
-                    first_day = df[df.index.to_series().dt.to_period(period) == p].index.min()
-                    if pd.notna(first_day):
-                        df.at[first_day, 'investment'] = self.investment_monthly_amount * float(df.loc[first_day, 'etf_allocation'])
-
-            df = df[df['investment'] != 0.0]
+            calendar_key = (len(df.index), hash(df.index.asi8.tobytes()))
+            if calendar_key not in schedules:
+                schedules[calendar_key] = build_contribution_schedule(
+                    df.index, self.investment_start_date, self.investment_frequency
+                )
+            initial_date, periodic_dates = schedules[calendar_key]
+
+            # Initial investment on the first trading day from the start date, then one per period
+            if initial_date is not None:
+                df.at[initial_date, 'investment'] += self.investment_initial_amount * float(df.loc[initial_date, 'etf_allocation'])
+            df.loc[periodic_dates, 'investment'] = self.investment_monthly_amount * df.loc[periodic_dates, 'etf_allocation'].astype(float)
+
+            if not all_dates:
+                df = df[df['investment'] != 0.0]
             df['etf_cumulative_investment'] = df['investment'].cumsum()
             dict_etf[ticker] = df
             
         return dict_etf
 
-    def apply_ETF_purchase(self):
-        dict_etf = self.apply_periodic_investment()
-        
-        for ticker, df in dict_etf.items():
-            df = df.copy()
-            
-            df['etf_units_purchased'] = 0
-            df['total_etf_units'] = 0
-            df['cash'] = 0.0
-            df['ETF_net_worth'] = 0.0
-            df['ETF_PnL'] = 0.0
-            df['ETF_PnL_%'] = 0.0
-            df['ticker'] = ticker  
-            
-            leftover = 0.0
-            total_units = 0.0
-
-            for idx in df.index:
-                investment = df.at[idx, 'investment'] + leftover
-                price = df.at[idx, 'previous_day_price_closure'] * (1 + df.at[idx, 'fees'])                
-                
-                units_bought = np.floor(investment / price)
-                spent = units_bought * price
-                leftover = investment - spent
-                total_units += units_bought
-
-                df.at[idx, 'etf_units_purchased'] = units_bought
-                df.at[idx, 'cash'] = leftover
-                df.at[idx, 'total_etf_units'] = total_units
-                df.at[idx, 'ETF_net_worth'] = total_units * price + leftover
-                df.at[idx, 'ETF_PnL'] = df.at[idx, 'ETF_net_worth'] - df.at[idx, 'etf_cumulative_investment']
-                df.at[idx, 'ETF_PnL_%'] = ((df.at[idx, 'ETF_net_worth'] / df.at[idx, 'etf_cumulative_investment'] - 1) * 100).round(2)
-            
-            dict_etf[ticker] = df
-        
-        # Merging ETF dataframe and sort per date
-        consolidated_df = pd.concat(dict_etf).sort_index().sort_values(['Date', 'ticker'])
-
-        daily_totals_Inv = consolidated_df.groupby('Date')['investment'].sum().reset_index()
-        daily_totals_Inv['cumulative_investment'] = daily_totals_Inv['investment'].cumsum()
-        consolidated_df = pd.merge(
-            consolidated_df,
-            daily_totals_Inv[['Date', 'cumulative_investment']],
-            on='Date',
-            how='left'
-        )
+    @property
+    def simulation_matrix(self):
+        """Simulated portfolio as a PortfolioMatrix, computed on first access and reused until
+        configure_from_input is called again"""
+        if self._simulation is None:
+            self._simulation = self._simulate_ETF_purchase()
+            self.simulation_runs += 1
+        return self._simulation
 
-        daily_totals_PnL = consolidated_df.groupby('Date')['ETF_PnL'].sum().reset_index()
-        daily_totals_PnL['Portfolio_PnL'] = daily_totals_PnL['ETF_PnL']
-        consolidated_df = pd.merge(
-            consolidated_df,
-            daily_totals_PnL[['Date', 'Portfolio_PnL']],
-            on='Date',
-            how='left'
-        )
-        
-        daily_totals_networth = consolidated_df.groupby('Date')['ETF_net_worth'].sum().reset_index()
-        daily_totals_networth['Portfolio_net_worth'] = daily_totals_networth['ETF_net_worth']
-        consolidated_df = pd.merge(
-            consolidated_df,
-            daily_totals_networth[['Date', 'Portfolio_net_worth']],
-            on='Date',
-            how='left'
-        )
+    @property
+    def simulation(self):
+        """Simulated portfolio as the long frame (one row per ETF and investment date), built on first access"""
+        return self.simulation_matrix.to_frame()
+
+    def apply_ETF_purchase(self):
+        return self.simulation
 
-        for idx in consolidated_df.index:
-            consolidated_df.at[idx, 'Portfolio_PnL_%'] = ((consolidated_df.at[idx, 'Portfolio_net_worth'] / consolidated_df.at[idx, 'cumulative_investment'] - 1) * 100).round(2)
+    @property
+    def rebalancing(self):
+        return self.rebalance is not None or self.rebalance_threshold is not None
 
-        return consolidated_df
+    @timed('purchase')
+    def _simulate_ETF_purchase(self):
+        if self.rebalancing:
+            return self._simulate_rebalanced_purchase()
+        # All ETFs on one date x ticker grid, purchases simulated column-wise and portfolio totals as row sums
+        matrix = PortfolioMatrix.from_frames(self.apply_periodic_investment())
+        matrix.apply_purchases()
+        matrix.compute_totals()
+        count('etf_rows_simulated_total', int(matrix.active.sum()))
+        return matrix
     
+    def _simulate_rebalanced_purchase(self):
+        # Every trading day on the date x ticker grid, the rows kept are the contribution and rebalancing days
+        daily = PortfolioMatrix.from_frames(self.apply_periodic_investment(all_dates=True))
+        rebalance_dates = None
+        if self.rebalance is not None:
+            _, dates = build_contribution_schedule(daily.dates, self.investment_start_date, self.rebalance)
+            rebalance_dates = daily.dates.isin(dates)
+        # Per-date targets, carried over the days a ticker does not trade
+        targets = pd.DataFrame(np.where(daily.active, daily['etf_allocation'], np.nan)).ffill().fillna(0.0)
+        rows, columns, _ = simulate_rebalancing(
+            np.where(daily.active, daily['investment'], 0.0),
+            daily['previous_day_price_closure'],
+            daily['fees'],
+            targets.to_numpy(),
+            rebalance_dates,
+            self.rebalance_threshold
+        )
+        matrix = daily.select(rows, columns.pop('active') & daily.active[rows])
+        for col in ('etf_units_purchased', 'etf_units_sold', 'total_etf_units'):
+            matrix.set_column(col, columns.pop(col), np.int64)
+        for col, values in columns.items():
+            matrix.set_column(col, values)
+        # The PnL of an ETF is against its own contributions, rebalancing moves value between ETFs
+        with np.errstate(divide='ignore', invalid='ignore'):
+            matrix.set_column('ETF_PnL', matrix['ETF_net_worth'] - matrix['etf_cumulative_investment'])
+            matrix.set_column('ETF_PnL_%', ((matrix['ETF_net_worth'] / matrix['etf_cumulative_investment'] - 1)
+                                            * 100).round(2))
+        matrix.compute_totals()
+        count('etf_rows_simulated_total', int(matrix.active.sum()))
+        return matrix
+
     def apply_CAGR_ratio(self):
-        df = self.apply_ETF_purchase()
+        matrix = self.simulation_matrix
         
         # Collection of last row for each ETF
-        cagr = df.groupby('ticker').last()[['ETF_net_worth', 'etf_cumulative_investment']].copy()
+        cagr = matrix.last_values(['ETF_net_worth', 'etf_cumulative_investment'])
         
         # ETF CAGR
         cagr['CAGR'] = (
@@ -184,65 +180,111 @@ class Portfolio:
         return result
     
     def apply_SHARPE_ratio(self):
-        df = self.apply_ETF_purchase()
-        volatility_df = df.groupby('ticker')['ETF_PnL_%'].std().round(2)
+        matrix = self.simulation_matrix
+        etf_pnl, tickers = matrix.ticker_column('ETF_PnL_%')
+        volatility_df = etf_pnl.groupby(pd.Index(tickers, name='ticker')).std().round(2)
         volatility_df = volatility_df.to_frame(name='volatility')
 
-        global_volatility = df['Portfolio_PnL_%'].std().round(2)
+        # Over the rows of the long frame, where each date appears once per ETF invested that day
+        portfolio_pnl = matrix.portfolio_rows('Portfolio_PnL_%')['Portfolio_PnL_%']
+        global_volatility = portfolio_pnl.std().round(2)
         total_row = pd.DataFrame({
         'volatility': [global_volatility],
         }, index=['TOTAL'])
 
         volatility_df = pd.concat([volatility_df, total_row])[['volatility']]
 
-        sharpe_ratio = ((df['Portfolio_PnL_%'].iloc[-1] - 2) / volatility_df['volatility'].iloc[-1]).round(2)
+        sharpe_ratio = ((portfolio_pnl.iloc[-1] - 2) / volatility_df['volatility'].iloc[-1]).round(2)
 
         return volatility_df, sharpe_ratio
         
-    def calculate_all_metrics(self):
-        """Calculate all metrics and prepare visualizations"""
-        df_result = self.apply_ETF_purchase()
+    @timed('metrics')
+    def calculate_all_metrics(self, render_plots=True):
+        """Calculate all metrics and prepare visualizations (render_plots=False leaves the charts to the browser)"""
+        from visualizer import Visualizer  # matplotlib, only loaded by the portfolios that are charted
+        simulation = self.simulation_matrix
         self.cagr = self.apply_CAGR_ratio()
         self.volatility, self.sharpe_ratio = self.apply_SHARPE_ratio()
         
         # Calculate ACWI metrics for comparison
         acwi_metrics = self.calculate_acwi_comparison()
         
-        self.visualizer = Visualizer(df_result, acwi_data=acwi_metrics['acwi_data'])
+        self.visualizer = Visualizer(simulation, acwi_data=acwi_metrics['acwi_data'])
         return {    
-            "data": df_result,
+            "data": simulation,  # PortfolioMatrix, to_frame() gives the long frame
             "cagr": self.cagr,
             "volatility": self.volatility, #To be removed?
             "sharpe_ratio": self.sharpe_ratio,
             "acwi_cagr": acwi_metrics['acwi_cagr'],
             "acwi_sharpe": acwi_metrics['acwi_sharpe'],
             "acwi_data": acwi_metrics['acwi_data'],
-            "plots": self.visualizer.get_plots(cagr_data=self.cagr.iloc[:-1])
+            "plots": self.visualizer.get_encoded_plots() if render_plots else []  # base64 PNGs
         }
     
+    def forecast(self, years, paths=10000, method='bootstrap', **options):
+        """Monte Carlo projection of this plan over `years` after the loaded history, see MonteCarloForecaster"""
+        return MonteCarloForecaster.from_portfolio(self).forecast(
+            self.investment_initial_amount,
+            self.investment_monthly_amount,
+            years,
+            self.investment_frequency,
+            paths,
+            method,
+            **options
+        )
+
+    def simulation_state(self):
+        """PortfolioState after the last loaded bar, advance() carries the simulation on with new daily bars"""
+        return PortfolioState.from_portfolio(self)
+
     def calculate_acwi_comparison(self):
         # Calculate ACWI performance with same investment pattern
-        # Create a temporary portfolio with 100% ACWI
-        acwi_portfolio = Portfolio()
-        acwi_portfolio.configure_from_input(
+        benchmark = self.calculate_benchmark_comparison('ACWI')
+        return {
+            'acwi_data': benchmark['data'],
+            'acwi_cagr': benchmark['cagr'],
+            'acwi_sharpe': benchmark['sharpe']
+        }
+
+    def calculate_benchmark_comparison(self, ticker):
+        """Metrics of a 100% benchmark portfolio invested with the same pattern as this one"""
+        return Portfolio.benchmark_metrics(
+            ticker,
             self.investment_initial_amount,
             self.investment_monthly_amount,
             self.investment_start_date.strftime("%Y-%m-%d"),
             self.investment_durations,
-            [('ACWI', 1.0)]
+            self.investment_frequency,
+            self.data_retrieval
         )
-        
-        # Get ACWI data
-        acwi_data = acwi_portfolio.apply_ETF_purchase()
-        
-        # Calculate ACWI CAGR
-        acwi_cagr = acwi_portfolio.apply_CAGR_ratio().loc['TOTAL', 'CAGR']
-        
-        # Calculate ACWI Sharpe ratio
-        _, acwi_sharpe = acwi_portfolio.apply_SHARPE_ratio()
-        
-        return {
-            'acwi_data': acwi_data,
-            'acwi_cagr': acwi_cagr,
-            'acwi_sharpe': acwi_sharpe
-        }
+
+    @staticmethod
+    def benchmark_metrics(ticker, initial_amount, monthly_amount, start_date, duration, frequency='M',
+                          data_retrieval=None):
+        """Benchmark simulation, CAGR and Sharpe ratio, shared across requests through the benchmark cache"""
+        @timed('benchmark')
+        def compute():
+            # Create a temporary portfolio with 100% of the benchmark
+            benchmark_portfolio = Portfolio(data_retrieval=data_retrieval)
+            benchmark_portfolio.configure_from_input(
+                initial_amount,
+                monthly_amount,
+                start_date,
+                duration,
+                [(ticker, 1.0)],
+                frequency
+            )
+            # Simulated once and shared by the CAGR and Sharpe ratio below
+            data = benchmark_portfolio.simulation_matrix
+            cagr = benchmark_portfolio.apply_CAGR_ratio().loc['TOTAL', 'CAGR']
+            _, sharpe = benchmark_portfolio.apply_SHARPE_ratio()
+            return {'data': data, 'cagr': cagr, 'sharpe': sharpe}
+
+        if data_retrieval is None:
+            data_retrieval = ETFDataRetrieval()
+        key = BenchmarkCache.make_key(ticker, initial_amount, monthly_amount, start_date, duration, frequency,
+                                      data_retrieval.provider.name)
+        # A window reaching today gets new bars every day, it is only cached until they may have changed
+        end_date = pd.Timestamp(start_date) + pd.DateOffset(years=duration)
+        ttl = benchmark_cache.open_window_ttl if end_date > pd.Timestamp.today().normalize() else None
+        return benchmark_cache.get(key, compute, ttl)
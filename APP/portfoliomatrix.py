@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+from purchaseengine import simulate_purchases
+
+PORTFOLIO_COLUMNS = ['cumulative_investment', 'Portfolio_PnL', 'Portfolio_net_worth', 'Portfolio_PnL_%']
+
+
+def compensated_row_sum(values, mask):
+    """Sum of the masked cells of every row, with the Kahan summation groupby().sum() uses,
+    so the totals are bit-identical to summing the long frame by date"""
+    total = np.zeros(values.shape[0])
+    compensation = np.zeros(values.shape[0])
+    with np.errstate(invalid='ignore'):
+        for j in range(values.shape[1]):
+            m = mask[:, j]
+            y = values[:, j] - compensation
+            t = total + y
+            c = (t - total) - y
+            compensation = np.where(m, np.where(np.isnan(c), 0.0, c), compensation)  # inf values give a NaN compensation
+            total = np.where(m, t, total)
+    return total
+
+
+class PortfolioMatrix:
+    """Simulated portfolio as aligned date x ticker arrays.
+
+    Every per-ETF column is a (dates x tickers) array, `active` marks the cells where a ticker has a row
+    (its investment dates). Portfolio totals are per-date vectors computed as row sums. The long frame
+    apply_ETF_purchase returns, one row per active cell sorted by date and ticker, is only built by
+    to_frame().
+    """
+
+    def __init__(self, dates, tickers, active):
+        self.dates = pd.DatetimeIndex(dates, name='Date')
+        self.tickers = list(tickers)
+        self.active = active
+        self.cells = {}  # column -> (dates x tickers) array, meaningful on active cells only
+        self.dtypes = {}  # column -> dtype of the column in the long frame
+        self.totals = {}  # portfolio column -> per-date vector
+        self._frame = None
+
+    @classmethod
+    def from_frames(cls, frames):
+        """Align {ticker: date-indexed frame} on the union of their dates, tickers sorted"""
+        tickers = sorted(frames)
+        dates = np.unique(np.concatenate([frames[t].index.values for t in tickers])) if tickers else np.array([], 'datetime64[ns]')
+        positions = {t: np.searchsorted(dates, frames[t].index.values) for t in tickers}
+        active = np.zeros((len(dates), len(tickers)), dtype=bool)
+        for j, ticker in enumerate(tickers):
+            active[positions[ticker], j] = True
+        matrix = cls(dates, tickers, active)
+
+        columns = list(dict.fromkeys(col for t in tickers for col in frames[t].columns))
+        for col in columns:
+            present = [frames[t][col].dtype for t in tickers if col in frames[t].columns]
+            dtype = present[0] if all(d == present[0] for d in present) else np.dtype(object)
+            if len(present) < len(tickers) and dtype.kind in 'biu':
+                dtype = np.dtype(float)  # missing cells become NaN, as pd.concat would do
+            storage = np.dtype(object) if dtype.kind == 'O' else np.dtype(float)
+            values = np.full(active.shape, np.nan, dtype=storage)
+            for j, ticker in enumerate(tickers):
+                if col in frames[ticker].columns:
+                    values[positions[ticker], j] = frames[ticker][col].to_numpy()
+            matrix.set_column(col, values, dtype)
+        return matrix
+
+    def select(self, rows, active):
+        """Matrix restricted to some rows (positions in self.dates), with new active cells on them"""
+        matrix = PortfolioMatrix(self.dates[rows], self.tickers, active)
+        for col, values in self.cells.items():
+            matrix.set_column(col, values[rows], self.dtypes[col])
+        return matrix
+
+    def __getitem__(self, column):
+        return self.cells[column]
+
+    def set_column(self, column, values, dtype=float):
+        self.cells[column] = values
+        self.dtypes[column] = np.dtype(dtype)
+        self._frame = None
+
+    def apply_purchases(self, leftover=None, total_units=None, cumulative_investment=None):
+        """Whole-unit purchases of the contributions on the active cells (simulate_purchases), sets the units,
+        cash, net worth and PnL columns. The optional per-ETF state continues an earlier simulation."""
+        purchases = simulate_purchases(
+            np.where(self.active, self.cells['investment'], 0.0),
+            self.cells['previous_day_price_closure'],
+            self.cells['fees'],
+            leftover,
+            total_units,
+            cumulative_investment
+        )
+        self.set_column('etf_units_purchased', purchases['etf_units_purchased'], np.int64)
+        self.set_column('total_etf_units', purchases['total_etf_units'], np.int64)
+        for col in ('cash', 'ETF_net_worth', 'ETF_PnL', 'ETF_PnL_%'):
+            self.set_column(col, purchases[col])
+
+    def compute_totals(self, cumulative_investment=0.0):
+        """Daily portfolio investment, PnL and net worth as row sums of the active cells, the cumulative
+        investment summed on from cumulative_investment (the total of the earlier dates)"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            daily_investment = compensated_row_sum(self.cells['investment'], self.active)
+            self.totals['cumulative_investment'] = np.cumsum(np.concatenate([[cumulative_investment],
+                                                                             daily_investment]))[1:]
+            self.totals['Portfolio_PnL'] = compensated_row_sum(self.cells['ETF_PnL'], self.active)
+            self.totals['Portfolio_net_worth'] = compensated_row_sum(self.cells['ETF_net_worth'], self.active)
+            self.totals['Portfolio_PnL_%'] = (
+                (self.totals['Portfolio_net_worth'] / self.totals['cumulative_investment'] - 1) * 100
+            ).round(2)
+        self._frame = None
+
+    @property
+    def rows_per_date(self):
+        return self.active.sum(axis=1)
+
+    @property
+    def nbytes(self):
+        arrays = list(self.cells.values()) + list(self.totals.values()) + [self.active]
+        return sum(a.nbytes if a.dtype != object else a.size * 64 for a in arrays)
+
+    def portfolio_series(self, column):
+        """Per-date portfolio column, what long_frame.groupby('Date')[column].first() returns"""
+        return pd.Series(self.totals[column], index=self.dates, name=column)
+
+    def portfolio_frame(self, columns=PORTFOLIO_COLUMNS):
+        return pd.DataFrame({col: self.totals[col] for col in columns}, index=self.dates)
+
+    def portfolio_rows(self, column):
+        """Date and a portfolio column repeated once per active ticker, the rows of the long frame"""
+        counts = self.rows_per_date
+        return pd.DataFrame({'Date': np.repeat(self.dates.values, counts),
+                             column: np.repeat(self.totals[column], counts)})
+
+    def ticker_column(self, column):
+        """Values of a per-ETF column on the active cells, with the ticker of each, in long-frame order"""
+        tickers = np.broadcast_to(np.array(self.tickers, dtype=object), self.active.shape)[self.active]
+        return pd.Series(self.cells[column][self.active], name=column), tickers
+
+    def last_values(self, columns):
+        """Per-ETF columns on each ticker's last active date, indexed by ticker"""
+        last = self.active.shape[0] - 1 - np.argmax(self.active[::-1], axis=0)
+        j = np.arange(len(self.tickers))
+        return pd.DataFrame({col: self.cells[col][last, j].astype(self.dtypes[col]) for col in columns},
+                            index=pd.Index(self.tickers, name='ticker'))
+
+    def append(self, other):
+        """Matrix of these dates followed by the (later) dates of another matrix on the same tickers"""
+        if other.tickers != self.tickers:
+            raise ValueError("Only matrices of the same tickers can be appended")
+        if len(other.dates) == 0:
+            return self
+        matrix = PortfolioMatrix(self.dates.append(other.dates), self.tickers,
+                                 np.concatenate([self.active, other.active]))
+        for col, values in self.cells.items():
+            if col in other.cells:
+                dtype = self.dtypes[col] if self.dtypes[col] == other.dtypes[col] else np.dtype(object)
+                matrix.set_column(col, np.concatenate([values, other.cells[col]]), dtype)
+        matrix.totals = {col: np.concatenate([values, other.totals[col]]) for col, values in self.totals.items()
+                         if col in other.totals}
+        return matrix
+
+    def to_frame(self):
+        """Long frame: one row per active cell sorted by date then ticker, with the portfolio totals of its date"""
+        if self._frame is None:
+            rows = np.nonzero(self.active)[0]
+            data = {'Date': self.dates.values[rows]}
+            for col, values in self.cells.items():
+                data[col] = values[self.active].astype(self.dtypes[col])
+            for col in PORTFOLIO_COLUMNS:
+                data[col] = self.totals[col][rows]
+            self._frame = pd.DataFrame(data)
+        return self._frame
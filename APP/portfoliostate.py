@@ -0,0 +1,174 @@
+import numpy as np
+import pandas as pd
+from etfdataretrieval import ETFDataRetrieval
+from contributionschedule import build_contribution_schedule, next_contribution_date, period_starts, schedule_phase
+from portfoliomatrix import PortfolioMatrix
+from instrumentation import timed, count
+
+
+class PortfolioState:
+    """Where a DCA simulation stands after its last daily bar, to carry it on one day at a time.
+
+    Per ETF: units held, cash left over, cumulative investment, last bar (date and close, the previous
+    close of the next purchase), initial investment date and the day the next periodic contribution is
+    due. to_dict()/from_dict() give a JSON-friendly copy. advance(new_bars) simulates only the new days,
+    with the rows a full Portfolio recompute over the longer history would have on them, bit for bit.
+    """
+
+    def __init__(self, initial_amount, periodic_amount, start_date, frequency, tickers, cumulative_investment=0.0,
+                 data_retrieval=None):
+        self.initial_amount = initial_amount
+        self.periodic_amount = periodic_amount
+        self.start_date = pd.Timestamp(start_date)
+        self.frequency = frequency
+        self.tickers = tickers  # ticker -> per-ETF state, see from_portfolio
+        self.cumulative_investment = cumulative_investment  # whole portfolio
+        self.data_retrieval = data_retrieval if data_retrieval is not None else ETFDataRetrieval()
+
+    @classmethod
+    def from_portfolio(cls, portfolio):
+        """State after the last bar a configured Portfolio loaded"""
+        if portfolio.rebalancing:
+            raise ValueError("Incremental updates do not support rebalanced portfolios")
+        matrix = portfolio.simulation_matrix
+        tickers = {}
+        for j, ticker in enumerate(matrix.tickers):
+            history = portfolio.dict_of_dfs[ticker]
+            dates = pd.DatetimeIndex(history.index).tz_localize(None)
+            rows = np.flatnonzero(matrix.active[:, j])
+            last = rows[-1] if len(rows) else None
+            initial_date, _ = build_contribution_schedule(dates, portfolio.investment_start_date,
+                                                          portfolio.investment_frequency)
+            tickers[ticker] = {
+                'fees': float(history['fees'].iloc[-1]),
+                'etf_allocation': float(history['etf_allocation'].iloc[-1]),
+                'total_etf_units': float(matrix['total_etf_units'][last, j]) if last is not None else 0.0,
+                'cash': float(matrix['cash'][last, j]) if last is not None else 0.0,
+                'etf_cumulative_investment': float(matrix['etf_cumulative_investment'][last, j])
+                if last is not None else 0.0,
+                'last_date': dates[-1],
+                'last_close': float(history['Close'].iloc[-1]),
+                'initial_date': initial_date,
+                'next_contribution': next_contribution_date(initial_date, dates[-1], portfolio.investment_frequency)
+                if initial_date is not None else None
+            }
+        total = matrix.totals['cumulative_investment']
+        return cls(portfolio.investment_initial_amount, portfolio.investment_monthly_amount,
+                   portfolio.investment_start_date, portfolio.investment_frequency, tickers,
+                   float(total[-1]) if len(total) else 0.0, portfolio.data_retrieval)
+
+    def to_dict(self):
+        def encode(value):
+            return value.isoformat() if isinstance(value, pd.Timestamp) else value
+
+        return {
+            'initial_amount': self.initial_amount,
+            'periodic_amount': self.periodic_amount,
+            'start_date': self.start_date.isoformat(),
+            'frequency': self.frequency,
+            'cumulative_investment': self.cumulative_investment,
+            'tickers': {ticker: {key: encode(value) for key, value in state.items()}
+                        for ticker, state in self.tickers.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data, data_retrieval=None):
+        dates = ('last_date', 'initial_date', 'next_contribution')
+        tickers = {ticker: {key: pd.Timestamp(value) if key in dates and value is not None else value
+                            for key, value in state.items()}
+                   for ticker, state in data['tickers'].items()}
+        return cls(data['initial_amount'], data['periodic_amount'], data['start_date'], data['frequency'], tickers,
+                   data['cumulative_investment'], data_retrieval)
+
+    @property
+    def last_date(self):
+        return min(state['last_date'] for state in self.tickers.values())
+
+    def fetch_new_bars(self, end_date=None):
+        """Bars after the last one of every ETF until end_date (excluded, tomorrow by default)"""
+        end_date = pd.Timestamp(end_date) if end_date is not None else pd.Timestamp.today().normalize() + pd.Timedelta(days=1)
+        batch = self.data_retrieval.fetch_batch(list(self.tickers), self.last_date + pd.Timedelta(days=1), end_date)
+        for ticker, error in batch.errors.items():
+            print(f"Error fetching {ticker}: {error}")
+        return batch.data
+
+    def _contributions(self, ticker, dates):
+        """Contribution on each new trading day of an ETF, the same schedule as build_contribution_schedule
+        over the whole history, and updates the ETF's initial and next contribution dates"""
+        state = self.tickers[ticker]
+        allocation = state['etf_allocation']
+        investment = np.zeros(len(dates))
+        first = 0
+        if state['initial_date'] is None:
+            first = dates.searchsorted(self.start_date)
+            if first == len(dates):
+                return investment
+            state['initial_date'] = dates[first]
+            state['next_contribution'] = next_contribution_date(dates[first], dates[first], self.frequency)
+            investment[first] += self.initial_amount * allocation
+            first += 1
+
+        # First trading days of their period on or after the day the next contribution is due
+        previous = dates[first - 1] if first > 0 else state['last_date']
+        calendar = pd.DatetimeIndex([previous]).append(dates[first:])
+        first_of_period, period_start = period_starts(calendar, self.frequency,
+                                                      schedule_phase(state['initial_date'], self.frequency))
+        due = np.flatnonzero(first_of_period[1:] & (period_start[1:] >= state['next_contribution'].to_datetime64()))
+        investment[first + due] = self.periodic_amount * allocation
+        if len(due):
+            state['next_contribution'] = next_contribution_date(state['initial_date'], dates[first + due[-1]],
+                                                                self.frequency)
+        return investment
+
+    @timed('advance')
+    def advance(self, new_bars):
+        """Simulate the new daily bars ({ticker: frame of bars}, the ones on or before an ETF's last bar are
+        skipped) and move the state after them. Returns the PortfolioMatrix of the new contribution dates,
+        which PortfolioMatrix.append adds after the earlier ones."""
+        frames = {}
+        for ticker, state in self.tickers.items():
+            bars = new_bars.get(ticker)
+            if bars is None or bars.empty:
+                continue
+            # Cleaned like the bars portfolio_data_retrieval returns
+            data = bars.copy()
+            data['fees'] = state['fees']
+            data['ticker'] = ticker
+            data['etf_allocation'] = state['etf_allocation']
+            df = self.data_retrieval.data_cleaning({ticker: data})
+            if df.empty:
+                continue
+            df.index = pd.DatetimeIndex(df.index).tz_localize(None)
+            df = df[df.index > state['last_date']].sort_index()
+            if df.empty:
+                continue
+
+            df['previous_day_price_closure'] = np.concatenate([[state['last_close']], df['Close'].to_numpy()[:-1]])
+            df['investment'] = self._contributions(ticker, df.index)
+            state['last_date'] = df.index[-1]
+            state['last_close'] = float(df['Close'].iloc[-1])
+            df = df[df['investment'] != 0.0]
+            df['etf_cumulative_investment'] = np.cumsum(
+                np.concatenate([[state['etf_cumulative_investment']], df['investment'].to_numpy()]))[1:]
+            frames[ticker] = df
+
+        tickers = sorted(self.tickers)
+        template = next((frame.iloc[:0] for frame in frames.values()), None)
+        if template is None:
+            return PortfolioMatrix([], tickers, np.zeros((0, len(tickers)), dtype=bool))
+        matrix = PortfolioMatrix.from_frames({ticker: frames.get(ticker, template) for ticker in tickers})
+        matrix.apply_purchases(*(np.array([self.tickers[t][key] for t in tickers])
+                                 for key in ('cash', 'total_etf_units', 'etf_cumulative_investment')))
+        matrix.compute_totals(self.cumulative_investment)
+
+        for j, ticker in enumerate(tickers):
+            rows = np.flatnonzero(matrix.active[:, j])
+            if len(rows):
+                state = self.tickers[ticker]
+                state['total_etf_units'] = float(matrix['total_etf_units'][rows[-1], j])
+                state['cash'] = float(matrix['cash'][rows[-1], j])
+                state['etf_cumulative_investment'] = float(matrix['etf_cumulative_investment'][rows[-1], j])
+        if len(matrix.dates):
+            self.cumulative_investment = float(matrix.totals['cumulative_investment'][-1])
+        count('etf_rows_simulated_total', int(matrix.active.sum()))
+        return matrix
@@ -0,0 +1,335 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import pandas as pd
+
+
+class PriceProvider:
+    """Source of daily bars and ETF info.
+
+    Contract: download(tickers, start, end) is the bulk path every batch goes through (ETFDataRetrieval.fetch_batch,
+    so portfolios, the screener and the sweep): ({ticker: bars in [start, end)}, {ticker: exception}), a failing
+    ticker does not fail the others. history(tickers, start, end) returns the same bars as one frame aligned on the
+    union of the trading dates, columns (field, ticker) like yfinance.download, tickers without data left out.
+    metadata(tickers) returns {ticker: {'fees', 'ticker'}}. Subclasses implement ticker_history()
+    and ticker_metadata(), the bulk methods are built on them; network sources override download().
+    """
+
+    name = 'provider'  # identifies the source in caches shared by several providers
+
+    def ticker_history(self, ticker_symbol, start_date, end_date, timeout=None):
+        """Daily bars of one ticker in [start_date, end_date), indexed by Date"""
+        raise NotImplementedError
+
+    def ticker_metadata(self, ticker_symbol):
+        raise NotImplementedError
+
+    def download(self, tickers, start_date, end_date, timeout=None, max_workers=None):
+        """Local sources read the tickers one after the other, max_workers is for network sources"""
+        frames, errors = {}, {}
+        for ticker in dict.fromkeys(tickers):
+            try:
+                frames[ticker] = self.ticker_history(ticker, start_date, end_date, timeout=timeout)
+            except Exception as e:
+                errors[ticker] = e
+        return frames, errors
+
+    def history(self, tickers, start_date, end_date):
+        frames, _ = self.download(tickers, start_date, end_date)
+        return align_history({ticker: data for ticker, data in frames.items() if data is not None and not data.empty})
+
+    def metadata(self, tickers):
+        return {ticker: self.ticker_metadata(ticker) for ticker in dict.fromkeys(tickers)}
+
+
+def align_history(frames):
+    """{ticker: bars} as one frame on the union of their dates, columns (field, ticker)"""
+    if not frames:
+        return pd.DataFrame(columns=pd.MultiIndex.from_arrays([[], []], names=['Price', 'Ticker']))
+    aligned = pd.concat(frames, axis=1, names=['Ticker', 'Price']).sort_index()
+    aligned.index.name = 'Date'
+    return aligned.swaplevel(axis=1).sort_index(axis=1, level=0, sort_remaining=False)
+
+
+def slice_history(data, start_date, end_date):
+    """Rows of data in [start_date, end_date), compared in the data's own timezone"""
+    start = pd.Timestamp(start_date).tz_localize(None)
+    end = pd.Timestamp(end_date).tz_localize(None)
+    local = data.index.tz_localize(None) if data.index.tz is not None else data.index
+    return data[(local >= start) & (local < end)].copy()
+
+
+class YFinanceProvider(PriceProvider):
+    """Yahoo Finance through yfinance, bars cached in a PriceStore and info in an ETFMetadataService"""
+
+    name = 'yfinance'
+
+    def __init__(self, price_store=None, metadata_service=None):
+        from pricestore import default_price_store
+        from etfmetadata import default_metadata_service
+        # Local store of daily bars, only the missing date ranges are downloaded (False disables it)
+        self.price_store = price_store if price_store is not None else default_price_store()
+        # Cached ETF info, expense ratios are only downloaded again once their TTL expired
+        self.metadata_service = metadata_service if metadata_service is not None else default_metadata_service()
+
+    def ticker_history(self, ticker_symbol, start_date, end_date, timeout=30):
+        import yfinance as yf
+        ticker_obj = yf.Ticker(ticker_symbol)
+        if not self.price_store:
+            return ticker_obj.history(start=start_date, end=end_date, timeout=timeout)
+        return self.price_store.get_history(
+            ticker_symbol, start_date, end_date,
+            lambda start, end: ticker_obj.history(start=start, end=end, timeout=timeout)
+        )
+
+    def download(self, tickers, start_date, end_date, timeout=30, max_workers=8):
+        """Tickers downloaded concurrently, max_workers at a time (Yahoo has no multi-ticker endpoint,
+        yfinance.download is the same fan-out over Ticker.history but drops the exchange timezones)"""
+        frames, errors = {}, {}
+        tickers = list(dict.fromkeys(tickers))
+        if not tickers:
+            return frames, errors
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(tickers)))
+        try:
+            futures = {executor.submit(self.ticker_history, ticker, start_date, end_date, timeout): ticker
+                       for ticker in tickers}
+            # A ticker takes up to two requests (timezone and bars), queued tickers wait for a free worker first
+            deadline = -(-len(tickers) // max_workers) * 2 * timeout
+            done, not_done = wait(futures, timeout=deadline)
+            for future in done:
+                try:
+                    frames[futures[future]] = future.result()
+                except Exception as e:
+                    errors[futures[future]] = e
+            for future in not_done:
+                errors[futures[future]] = TimeoutError(f"download did not finish within {deadline:.0f}s")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return frames, errors
+
+    def ticker_metadata(self, ticker_symbol):
+        return self.metadata_service.get(ticker_symbol)
+
+    def metadata(self, tickers):
+        tickers = list(dict.fromkeys(tickers))
+        self.metadata_service.prefetch(tickers)  # downloads the expired entries concurrently
+        return {ticker: self.metadata_service.get(ticker) for ticker in tickers}
+
+
+class InMemoryProvider(PriceProvider):
+    """Bars and info held in memory, for tests, benchmarks and data prepared by the caller"""
+
+    name = 'memory'
+
+    def __init__(self, frames=None, metadata=None, default_fees=0.0):
+        self.frames = {}
+        self._metadata = dict(metadata or {})  # {ticker: {'fees': ...}}
+        self.default_fees = default_fees
+        for ticker, data in (frames or {}).items():
+            self.add(ticker, data)
+
+    def add(self, ticker_symbol, data, fees=None):
+        data = data.copy()
+        data.index = pd.DatetimeIndex(data.index, name='Date')
+        self.frames[ticker_symbol] = data.sort_index()
+        if fees is not None:
+            self._metadata[ticker_symbol] = {'fees': fees}
+
+    def ticker_history(self, ticker_symbol, start_date, end_date, timeout=None):
+        if ticker_symbol not in self.frames:
+            raise KeyError(f"No prices for {ticker_symbol}")
+        return slice_history(self.frames[ticker_symbol], start_date, end_date)
+
+    def ticker_metadata(self, ticker_symbol):
+        entry = self._metadata.get(ticker_symbol, {})
+        return {'fees': entry.get('fees', self.default_fees), 'ticker': entry.get('ticker', ticker_symbol)}
+
+
+class LocalDirectoryProvider(PriceProvider):
+    """Bars read from a directory of <TICKER>.parquet or <TICKER>.csv files, e.g. nightly market-data dumps.
+
+    Files have a Date index (or first column) and the yfinance columns, at least Close. ETF info comes
+    from metadata.json ({ticker: {"fees": ...}}) in the same directory. Files are memory-mapped when
+    read and kept in memory until they change on disk, so repeated requests do not parse them again.
+    CSV dates with UTC offsets (yfinance exports) become the dates of the exchange timezone.
+    Parquet needs pyarrow.
+    """
+
+    name = 'local'
+
+    def __init__(self, directory, default_fees=0.0, timezone='America/New_York'):
+        self.directory = directory
+        self.name = f"local:{os.path.abspath(directory)}"
+        self.default_fees = default_fees
+        self.timezone = timezone  # exchange timezone of the bars
+        self._frames = {}  # ticker -> (file version, frame)
+        self._metadata = (None, {})
+        self._lock = threading.Lock()
+
+    def _path(self, ticker_symbol):
+        for extension in ('parquet', 'csv'):
+            path = os.path.join(self.directory, f"{ticker_symbol}.{extension}")
+            if os.path.exists(path):
+                return path
+        raise FileNotFoundError(f"No price file for {ticker_symbol} in {self.directory}")
+
+    def load(self, ticker_symbol):
+        """Whole file of a ticker, parsed again only when it changed on disk"""
+        path = self._path(ticker_symbol)
+        stat = os.stat(path)
+        version = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._frames.get(ticker_symbol)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        if path.endswith('.parquet'):
+            data = pd.read_parquet(path, memory_map=True)
+            if 'Date' in data.columns:
+                data = data.set_index('Date')
+        else:
+            data = pd.read_csv(path, index_col=0, memory_map=True)
+        data.index = self._parse_dates(data.index).rename('Date')
+        data = data.sort_index()
+        with self._lock:
+            self._frames[ticker_symbol] = (version, data)
+        return data
+
+    def _parse_dates(self, index):
+        if isinstance(index, pd.DatetimeIndex):
+            return index
+        if len(index) and pd.Timestamp(index[0]).tzinfo is not None:
+            # UTC offsets change with daylight saving time: parsed as instants, then dated in the exchange timezone
+            return pd.to_datetime(index, utc=True).tz_convert(self.timezone).tz_localize(None)
+        return pd.DatetimeIndex(pd.to_datetime(index))
+
+    def ticker_history(self, ticker_symbol, start_date, end_date, timeout=None):
+        return slice_history(self.load(ticker_symbol), start_date, end_date)
+
+    def load_metadata(self):
+        path = os.path.join(self.directory, 'metadata.json')
+        try:
+            version = os.stat(path).st_mtime_ns
+        except OSError:
+            return {}
+        if version != self._metadata[0]:
+            with open(path) as f:
+                self._metadata = (version, json.load(f))
+        return self._metadata[1]
+
+    def ticker_metadata(self, ticker_symbol):
+        entry = self.load_metadata().get(ticker_symbol, {})
+        return {'fees': entry.get('fees', self.default_fees), 'ticker': entry.get('ticker', ticker_symbol)}
+
+
+class SharedSegmentProvider(PriceProvider):
+    """Bars read from a price segment file (pricesegment.py) shared by every worker process.
+
+    The segment is memory-mapped read-only, so N workers hold one copy of the histories in the page cache
+    instead of N pandas copies, and frames are views of it. A refresher process replaces the file
+    (refresh_price_segment); the provider checks for a new file at most every check_interval seconds
+    and maps it. Tickers missing from the segment come from the fallback provider when there is one.
+    """
+
+    name = 'segment'
+
+    def __init__(self, path, fallback=None, check_interval=5.0):
+        self.path = path
+        self.name = f"segment:{os.path.abspath(path)}"
+        self.fallback = fallback
+        self.check_interval = check_interval
+        self._segment = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def segment(self):
+        """Current segment, mapped again when the file was replaced (None while there is no file)"""
+        now = time.monotonic()
+        with self._lock:
+            if self._segment is None or now - self._checked_at >= self.check_interval:
+                self._checked_at = now
+                try:
+                    stat = os.stat(self.path)
+                except OSError:
+                    return self._segment
+                if self._segment is None or self._segment.version != (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+                    from pricesegment import PriceSegment
+                    self._segment = PriceSegment(self.path)
+            return self._segment
+
+    def ticker_history(self, ticker_symbol, start_date, end_date, timeout=None):
+        segment = self.segment
+        if segment is not None and ticker_symbol in segment:
+            return segment.history(ticker_symbol, start_date, end_date)
+        if self.fallback is not None:
+            return self.fallback.ticker_history(ticker_symbol, start_date, end_date, timeout=timeout)
+        raise KeyError(f"No prices for {ticker_symbol} in {self.path}")
+
+    def download(self, tickers, start_date, end_date, timeout=None, max_workers=8):
+        """Tickers of the segment read from it, the others downloaded together from the fallback"""
+        segment = self.segment
+        tickers = list(dict.fromkeys(tickers))
+        mapped = [ticker for ticker in tickers if segment is not None and ticker in segment]
+        frames = {ticker: segment.history(ticker, start_date, end_date) for ticker in mapped}
+        missing = [ticker for ticker in tickers if ticker not in frames]
+        if missing and self.fallback is not None:
+            fetched, errors = self.fallback.download(missing, start_date, end_date, timeout=timeout,
+                                                     max_workers=max_workers)
+            frames.update(fetched)
+            return frames, errors
+        return frames, {ticker: KeyError(f"No prices for {ticker} in {self.path}") for ticker in missing}
+
+    def ticker_metadata(self, ticker_symbol):
+        segment = self.segment
+        if segment is not None and ticker_symbol in segment and segment.metadata(ticker_symbol):
+            return segment.metadata(ticker_symbol)
+        if self.fallback is not None:
+            return self.fallback.ticker_metadata(ticker_symbol)
+        return {'fees': 0.0, 'ticker': ticker_symbol}
+
+
+PROVIDERS = {
+    'yfinance': YFinanceProvider,
+    'local': LocalDirectoryProvider,
+    'memory': InMemoryProvider,
+    'segment': SharedSegmentProvider
+}
+
+_default_providers = {}
+_default_provider_lock = threading.Lock()
+
+
+def create_price_provider(kind, **options):
+    """Provider by name: 'yfinance', 'local' (directory=...), 'memory' or 'segment' (path=...)"""
+    if kind not in PROVIDERS:
+        raise ValueError(f"Unknown price provider: {kind} (expected one of {', '.join(PROVIDERS)})")
+    return PROVIDERS[kind](**options)
+
+
+def default_price_provider():
+    """Process-wide provider configured by ETF_PRICE_PROVIDER (yfinance, local or segment),
+    ETF_PRICE_DIR and ETF_PRICE_TZ (directory and exchange timezone of the local provider),
+    ETF_PRICE_SEGMENT (file of the segment provider) and ETF_SEGMENT_FALLBACK (0: tickers missing from the segment fail instead of coming from yfinance).
+    The memory provider is filled by the code that creates it (tests, benchmarks), it cannot be configured here."""
+    kind = os.environ.get('ETF_PRICE_PROVIDER', 'yfinance')
+    if kind == 'memory':
+        raise ValueError("ETF_PRICE_PROVIDER=memory would serve no prices, pass an InMemoryProvider to "
+                         "ETFDataRetrieval instead (expected yfinance, local or segment)")
+    options = {}
+    if kind == 'local':
+        options = {'directory': os.environ['ETF_PRICE_DIR'],
+                   'timezone': os.environ.get('ETF_PRICE_TZ', 'America/New_York')}
+    elif kind == 'segment':
+        options = {'path': os.environ['ETF_PRICE_SEGMENT']}
+    if kind == 'yfinance':
+        return YFinanceProvider()  # the store and metadata service behind it are already process-wide
+    key = (kind, tuple(sorted(options.items())))
+    with _default_provider_lock:
+        if key not in _default_providers:
+            if kind == 'segment' and os.environ.get('ETF_SEGMENT_FALLBACK', '1') == '1':
+                options['fallback'] = YFinanceProvider()
+            _default_providers[key] = create_price_provider(kind, **options)
+        return _default_providers[key]
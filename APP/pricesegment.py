@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+import struct
+import sys
+import numpy as np
+import pandas as pd
+
+# File layout, every section 64-byte aligned, little-endian:
+#   header     MAGIC, then uint64 table length, n_tickers, n_rows, n_fields
+#   table      JSON {'created', 'fields', 'tickers': [{'symbol', 'tz', 'fields', 'metadata'}]}
+#   offsets    int64[n_tickers + 1], rows of ticker i are offsets[i]:offsets[i + 1]
+#   dates      int64[n_rows], exchange-local dates (ns) of the rows, sorted within a ticker
+#   values     float64[n_rows, n_fields], NaN for the fields a ticker does not have
+MAGIC = b'ETFSEG01'
+HEADER = struct.Struct('<8s4Q')
+ALIGNMENT = 64
+
+# Columns of yfinance daily bars, in the order they are stored
+SEGMENT_FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits', 'Capital Gains']
+
+
+def _aligned(position):
+    return -(-position // ALIGNMENT) * ALIGNMENT
+
+
+class PriceSegment:
+    """Read-only view of a price segment file, mapped once and shared through the page cache by every
+    process that opens it. history() frames are views of the mapping (read-only), nothing is parsed or
+    copied per ticker. A refresh replaces the file with a new one, a segment already open keeps reading
+    the old one until it is dropped."""
+
+    def __init__(self, path):
+        self.path = path
+        stat = os.stat(path)
+        self.version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self._buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        magic, table_length, n_tickers, n_rows, n_fields = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a price segment")
+        start = _aligned(HEADER.size)
+        table = json.loads(bytes(self._buffer[start:start + table_length]))
+        self.created = table['created']
+        self.fields = table['fields']
+        self.tickers = {entry['symbol']: i for i, entry in enumerate(table['tickers'])}
+        self._entries = table['tickers']
+
+        position = _aligned(start + table_length)
+        self.offsets = np.frombuffer(self._buffer, np.int64, n_tickers + 1, position)
+        position = _aligned(position + self.offsets.nbytes)
+        self.dates = np.frombuffer(self._buffer, np.int64, n_rows, position)
+        position = _aligned(position + self.dates.nbytes)
+        self.values = np.frombuffer(self._buffer, np.float64, n_rows * n_fields, position).reshape(n_rows, n_fields)
+
+    def __contains__(self, ticker_symbol):
+        return ticker_symbol in self.tickers
+
+    def metadata(self, ticker_symbol):
+        return self._entries[self.tickers[ticker_symbol]]['metadata']
+
+    def history(self, ticker_symbol, start_date=None, end_date=None):
+        """Bars of a ticker in [start_date, end_date) (compared in its own timezone), indexed by Date.
+        Every field is float64, Volume included."""
+        i = self.tickers[ticker_symbol]
+        entry = self._entries[i]
+        first, last = self.offsets[i], self.offsets[i + 1]
+        dates = self.dates[first:last]
+        if start_date is not None:
+            first += np.searchsorted(dates, pd.Timestamp(start_date).tz_localize(None).value)
+        if end_date is not None:
+            last = self.offsets[i] + np.searchsorted(dates, pd.Timestamp(end_date).tz_localize(None).value)
+        last = max(first, last)
+
+        index = pd.DatetimeIndex(self.dates[first:last].view('datetime64[ns]'), name='Date')
+        if entry['tz'] is not None:
+            index = index.tz_localize(entry['tz'])
+        columns = [self.fields.index(field) for field in entry['fields']]
+        # Contiguous fields (the usual case, a ticker has all the fields or the first ones) are a view
+        if not columns:
+            values = self.values[first:last, :0]
+        elif columns == list(range(columns[0], columns[-1] + 1)):
+            values = self.values[first:last, columns[0]:columns[-1] + 1]
+        else:
+            values = self.values[first:last, columns]
+        return pd.DataFrame(values, index=index, columns=entry['fields'], copy=False)
+
+    @staticmethod
+    def write(path, frames, metadata=None, fields=SEGMENT_FIELDS):
+        """Write {ticker: bars} (and {ticker: info}) as a segment at path, atomically: the file is built
+        next to it then renamed over it, readers see either the old or the new segment"""
+        metadata = metadata or {}
+        tickers = [ticker for ticker, data in frames.items() if data is not None and not data.empty]
+        entries, dates, values = [], [], []
+        for ticker in tickers:
+            data = frames[ticker].sort_index()
+            index = pd.DatetimeIndex(data.index)
+            tz = str(index.tz) if index.tz is not None else None
+            present = [field for field in fields if field in data.columns]
+            block = np.full((len(data), len(fields)), np.nan)
+            for field in present:
+                block[:, fields.index(field)] = data[field].to_numpy(dtype=float)
+            entries.append({'symbol': ticker, 'tz': tz, 'fields': present, 'metadata': metadata.get(ticker, {})})
+            dates.append((index.tz_localize(None) if tz else index).asi8)
+            values.append(block)
+        offsets = np.concatenate([[0], np.cumsum([len(d) for d in dates])]).astype(np.int64)
+        dates = np.concatenate(dates) if dates else np.array([], dtype=np.int64)
+        values = np.concatenate(values) if values else np.empty((0, len(fields)))
+        table = json.dumps({'created': pd.Timestamp.now(tz='UTC').isoformat(), 'fields': list(fields),
+                            'tickers': entries}).encode()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, len(table), len(entries), len(dates), len(fields)))
+                for section in (table, offsets.tobytes(), dates.astype('<i8').tobytes(),
+                                np.ascontiguousarray(values, dtype='<f8').tobytes()):
+                    f.write(b'\0' * (_aligned(f.tell()) - f.tell()))
+                    f.write(section)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        if hasattr(os, 'O_DIRECTORY'):  # persist the rename itself
+            fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        return len(entries)
+
+
+def refresh_price_segment(path, tickers=(), start_date='1990-01-01', end_date=None, data_retrieval=None):
+    """Download the full history of the tickers (and of the ones already in the segment) and replace the
+    segment with it. Tickers whose download fails keep their previous bars. Meant to run in one process
+    (cron, a sidecar), the web workers only read the segment."""
+    from etfdataretrieval import ETFDataRetrieval
+    from priceproviders import YFinanceProvider
+    data_retrieval = data_retrieval if data_retrieval is not None else ETFDataRetrieval(provider=YFinanceProvider())
+    previous = PriceSegment(path) if os.path.exists(path) else None
+    tickers = list(dict.fromkeys(list(previous.tickers if previous else []) + list(tickers)))
+    end_date = end_date if end_date is not None else pd.Timestamp.today().normalize() + pd.Timedelta(days=1)
+
+    batch = data_retrieval.fetch_batch(tickers, start_date, end_date, with_info=True)
+    frames, metadata = {}, {}
+    for ticker in tickers:
+        if ticker in batch.errors:
+            print(f"Error fetching {ticker}: {batch.errors[ticker]}")
+            if previous is not None and ticker in previous:
+                frames[ticker], metadata[ticker] = previous.history(ticker), previous.metadata(ticker)
+            continue
+        frames[ticker], metadata[ticker] = batch.data[ticker], batch.info[ticker]
+    return PriceSegment.write(path, frames, metadata)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refresh the shared price segment read by the web workers")
+    parser.add_argument('path', nargs='?', default=os.environ.get('ETF_PRICE_SEGMENT'))
+    parser.add_argument('--tickers', nargs='*', default=[], help="tickers to add to the ones already in the segment")
+    parser.add_argument('--universe', action='store_true', help="also add the tickers of etf_universe.json")
+    parser.add_argument('--start', default='1990-01-01')
+    args = parser.parse_args(argv)
+    if not args.path:
+        parser.error("no segment path (argument or ETF_PRICE_SEGMENT)")
+
+    tickers = list(args.tickers)
+    if args.universe:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'etf_universe.json')) as f:
+            tickers += [ticker for group in json.load(f).values() for ticker in group]
+    written = refresh_price_segment(args.path, tickers, args.start)
+    print(f"{written} tickers written to {args.path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+import os
+import sqlite3
+import threading
+import pandas as pd
+
+
+DEFAULT_STORE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'investment_forecasting', 'prices.sqlite')
+
+# Columns returned by yf.Ticker(...).history for daily bars
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits', 'Capital Gains']
+EVENT_COLUMNS = ['Dividends', 'Stock Splits', 'Capital Gains']
+SQL_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'dividends', 'stock_splits', 'capital_gains']
+
+
+class PriceStore:
+    """Local SQLite store of daily bars keyed by ticker, filled incrementally from a fetch callback"""
+
+    def __init__(self, path=DEFAULT_STORE_PATH, max_staleness=pd.Timedelta(hours=1)):
+        self.path = path
+        # How long a range reaching the fetch day (whose last bar may still move) stays valid
+        self.max_staleness = pd.Timedelta(max_staleness)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._memory_conn = sqlite3.connect(path, check_same_thread=False) if path == ':memory:' else None
+        self._create_tables()
+
+    def _connect(self):
+        if self._memory_conn is not None:
+            return self._memory_conn
+        # One connection per thread, reused across calls
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+        return conn
+
+    def _create_tables(self):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS bars (ticker TEXT NOT NULL, date TEXT NOT NULL, "
+                f"{', '.join(c + ' REAL' for c in SQL_COLUMNS)}, PRIMARY KEY (ticker, date))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (ticker TEXT PRIMARY KEY, tz TEXT)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS coverage (ticker TEXT NOT NULL, start TEXT NOT NULL, "
+                "end TEXT NOT NULL, fetched_at TEXT NOT NULL)"
+            )
+
+    def get_history(self, ticker_symbol, start_date, end_date, fetch):
+        """Return bars for [start_date, end_date), calling fetch(start, end) only for the missing ranges"""
+        start = pd.Timestamp(start_date).tz_localize(None).normalize()
+        end = pd.Timestamp(end_date).tz_localize(None).normalize()
+        if end <= start:
+            end = start + pd.Timedelta(days=1)
+
+        for gap_start, gap_end in self.missing_ranges(ticker_symbol, start, end):
+            fetched_at = pd.Timestamp.now()
+            # A fetch that raises records nothing, an empty answer (no trading days, before inception) is covered
+            data = fetch(gap_start.strftime('%Y-%m-%d'), gap_end.strftime('%Y-%m-%d'))
+            if data is None or data.empty:
+                data = pd.DataFrame(columns=PRICE_COLUMNS)
+            elif self._adjusts_stored_bars(ticker_symbol, data):
+                # Adjusted prices before a new dividend or split were rewritten, the stored ones are on the
+                # old basis: the whole window is downloaded again rather than mixing both at the seam
+                self.clear(ticker_symbol)
+                fetched_at = pd.Timestamp.now()
+                data = fetch(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+                if data is None or data.empty:
+                    data = pd.DataFrame(columns=PRICE_COLUMNS)
+                self._write(ticker_symbol, data, start, end, fetched_at)
+                break
+            self._write(ticker_symbol, data, gap_start, gap_end, fetched_at)
+
+        return self._read(ticker_symbol, start, end)
+
+    def _adjusts_stored_bars(self, ticker_symbol, data):
+        """Whether the fetched bars have a dividend or split event after some stored bar of the ticker"""
+        events = data.reindex(columns=EVENT_COLUMNS).fillna(0.0).ne(0.0).any(axis=1).to_numpy()
+        if not events.any():
+            return False
+        last_event = pd.DatetimeIndex(data.index).tz_localize(None)[events].max()
+        row = self._connect().execute("SELECT 1 FROM bars WHERE ticker = ? AND date < ? LIMIT 1",
+                                      (ticker_symbol, last_event.strftime('%Y-%m-%d'))).fetchone()
+        return row is not None
+
+    def missing_ranges(self, ticker_symbol, start, end):
+        """Sub-ranges of [start, end) that are not covered by fresh data in the store"""
+        now = pd.Timestamp.now()
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT start, end, fetched_at FROM coverage WHERE ticker = ? AND start < ? AND end > ?",
+            (ticker_symbol, end.strftime('%Y-%m-%d'), start.strftime('%Y-%m-%d'))
+        ).fetchall()
+
+        intervals = []
+        for row_start, row_end, fetched_at in rows:
+            row_start, row_end, fetched_at = pd.Timestamp(row_start), pd.Timestamp(row_end), pd.Timestamp(fetched_at)
+            fetch_day = fetched_at.normalize()
+            # The bar of the fetch day (and anything after it) is provisional until it goes stale
+            if row_end > fetch_day and now - fetched_at > self.max_staleness:
+                row_end = fetch_day
+            if row_end > row_start:
+                intervals.append((row_start, row_end))
+
+        gaps = []
+        cursor = start
+        for row_start, row_end in sorted(intervals):
+            if row_end <= cursor:
+                continue
+            if row_start >= end:
+                break
+            if row_start > cursor:
+                gaps.append((cursor, row_start))
+            cursor = row_end
+            if cursor >= end:
+                break
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def _write(self, ticker_symbol, data, start, end, fetched_at):
+        tz = None
+        if isinstance(data.index, pd.DatetimeIndex) and data.index.tz is not None:
+            tz = str(data.index.tz)
+
+        rows = []
+        if not data.empty:
+            dates = pd.DatetimeIndex(data.index).tz_localize(None).normalize().strftime('%Y-%m-%d')
+            values = data.reindex(columns=PRICE_COLUMNS).astype(float)
+            values = values.astype(object).where(values.notna(), None)
+            rows = [(ticker_symbol, date, *vals) for date, vals in zip(dates, values.itertuples(index=False))]
+
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO bars (ticker, date, {', '.join(SQL_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * (len(SQL_COLUMNS) + 2))})",
+                    rows
+                )
+                if tz is not None:
+                    conn.execute("INSERT OR REPLACE INTO meta (ticker, tz) VALUES (?, ?)", (ticker_symbol, tz))
+                conn.execute(
+                    "INSERT INTO coverage (ticker, start, end, fetched_at) VALUES (?, ?, ?, ?)",
+                    (ticker_symbol, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'), fetched_at.isoformat())
+                )
+                self._compact_coverage(conn, ticker_symbol)
+
+    def _compact_coverage(self, conn, ticker_symbol):
+        """Merge overlapping ranges and trim stale provisional ones so the coverage table stays small"""
+        now = pd.Timestamp.now()
+        rows = conn.execute(
+            "SELECT start, end, fetched_at FROM coverage WHERE ticker = ? ORDER BY start", (ticker_symbol,)
+        ).fetchall()
+
+        closed, fresh = [], []
+        for row_start, row_end, fetched_at in rows:
+            fetch_day = fetched_at[:10]
+            if row_end > fetch_day and now - pd.Timestamp(fetched_at) <= self.max_staleness:
+                fresh.append((row_start, row_end, fetched_at))
+            elif min(row_end, fetch_day) > row_start:
+                closed.append([row_start, min(row_end, fetch_day), fetched_at])
+
+        merged = []
+        for row_start, row_end, fetched_at in closed:
+            if merged and row_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], row_end)
+                merged[-1][2] = max(merged[-1][2], fetched_at)
+            else:
+                merged.append([row_start, row_end, fetched_at])
+
+        conn.execute("DELETE FROM coverage WHERE ticker = ?", (ticker_symbol,))
+        conn.executemany(
+            "INSERT INTO coverage (ticker, start, end, fetched_at) VALUES (?, ?, ?, ?)",
+            [(ticker_symbol, *r) for r in merged + fresh]
+        )
+
+    def _read(self, ticker_symbol, start, end):
+        conn = self._connect()
+        rows = conn.execute(
+            f"SELECT date, {', '.join(SQL_COLUMNS)} FROM bars WHERE ticker = ? AND date >= ? AND date < ? ORDER BY date",
+            (ticker_symbol, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+        ).fetchall()
+        tz_row = conn.execute("SELECT tz FROM meta WHERE ticker = ?", (ticker_symbol,)).fetchone()
+
+        df = pd.DataFrame([r[1:] for r in rows], columns=PRICE_COLUMNS, dtype=float)
+        index = pd.DatetimeIndex(pd.to_datetime([r[0] for r in rows]), name='Date')
+        if tz_row is not None and tz_row[0]:
+            index = index.tz_localize(tz_row[0])
+        df.index = index
+
+        # Event columns missing from some downloads mean "no event"; columns never returned are dropped
+        for col in EVENT_COLUMNS:
+            if df[col].notna().any():
+                df[col] = df[col].fillna(0.0)
+        df = df.dropna(axis=1, how='all') if not df.empty else df[PRICE_COLUMNS[:7]]
+        if 'Volume' in df and df['Volume'].notna().all():
+            df['Volume'] = df['Volume'].astype('int64')
+        return df
+
+    def clear(self, ticker_symbol=None):
+        """Drop stored bars, for one ticker or for the whole store"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for table in ('bars', 'meta', 'coverage'):
+                    if ticker_symbol is None:
+                        conn.execute(f"DELETE FROM {table}")
+                    else:
+                        conn.execute(f"DELETE FROM {table} WHERE ticker = ?", (ticker_symbol,))
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def default_price_store():
+    """Process-wide store configured by ETF_PRICE_STORE (path, empty to disable) and
+    ETF_PRICE_STORE_MAX_STALENESS (seconds)"""
+    global _default_store
+    path = os.environ.get('ETF_PRICE_STORE', DEFAULT_STORE_PATH)
+    if not path:
+        return None
+    with _default_store_lock:
+        if _default_store is None or _default_store.path != path:
+            max_staleness = pd.Timedelta(seconds=float(os.environ.get('ETF_PRICE_STORE_MAX_STALENESS', 3600)))
+            _default_store = PriceStore(path, max_staleness=max_staleness)
+        return _default_store
@@ -0,0 +1,106 @@
+import math
+import numpy as np
+
+
+def simulate_purchases(investment, previous_close, fees, leftover=None, total_units=None,
+                       cumulative_investment=None):
+    """Whole-unit ETF purchases on plain arrays, for one ETF (1-D) or a date x ticker matrix (2-D).
+
+    On every row the contribution plus the cash left over from the previous purchase buys as many
+    whole units as possible at the previous close increased by the fees. Returns the columns
+    apply_ETF_purchase adds to the ETF frames, as arrays of the same shape as `investment`.
+    leftover, total_units and cumulative_investment (per ETF) continue an earlier simulation
+    from its last row, with the same results as simulating both ranges at once.
+    """
+    investment = np.asarray(investment, dtype=float)
+    previous_close = np.asarray(previous_close, dtype=float)
+    fees = np.asarray(fees, dtype=float)
+    price = previous_close * (1 + fees)
+    start = np.zeros(investment.shape[1:])
+
+    if investment.ndim == 1:
+        columns = _purchase_series(investment, price, float(leftover or 0.0), float(total_units or 0.0))
+    else:
+        columns = _purchase_matrix(investment, np.broadcast_to(price, investment.shape),
+                                   start if leftover is None else np.asarray(leftover, dtype=float),
+                                   start if total_units is None else np.asarray(total_units, dtype=float))
+
+    if cumulative_investment is None:
+        cumulative_investment = np.cumsum(investment, axis=0)
+    else:
+        # Summed on from the earlier total, in the same order as one cumsum over both ranges
+        first = np.broadcast_to(np.asarray(cumulative_investment, dtype=float), start.shape)
+        cumulative_investment = np.cumsum(np.concatenate([first[None], investment]), axis=0)[1:]
+    columns['etf_cumulative_investment'] = cumulative_investment
+    columns['ETF_PnL'] = columns['ETF_net_worth'] - cumulative_investment
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns['ETF_PnL_%'] = ((columns['ETF_net_worth'] / cumulative_investment - 1) * 100).round(2)
+    return columns
+
+
+def _purchase_series(investment, price, leftover=0.0, total=0.0):
+    # The leftover cash carried from one purchase to the next makes this a sequential recurrence,
+    # it runs on Python floats which is much cheaper than indexing numpy scalars in the loop
+    n = len(investment)
+    units_purchased = np.empty(n)
+    total_units = np.empty(n)
+    cash = np.empty(n)
+    net_worth = np.empty(n)
+
+    for i, (amount, unit_price) in enumerate(zip(investment.tolist(), price.tolist())):
+        amount += leftover
+        quotient = amount / unit_price
+        units = float(math.floor(quotient)) if math.isfinite(quotient) else quotient
+        leftover = amount - units * unit_price
+        total += units
+
+        units_purchased[i] = units
+        total_units[i] = total
+        cash[i] = leftover
+        net_worth[i] = total * unit_price + leftover
+
+    return {
+        'etf_units_purchased': units_purchased,
+        'total_etf_units': total_units,
+        'cash': cash,
+        'ETF_net_worth': net_worth
+    }
+
+
+def purchase_step(contribution, leftover, total_units, price, active):
+    """One date of the purchase recurrence for many ETFs (or simulated paths) at once.
+
+    Active cells buy whole units with the contribution plus the cash left over, the others only carry
+    their units and cash forward. Returns (units bought, leftover cash, total units, net worth).
+    """
+    amount = contribution + leftover
+    units = np.where(active, np.floor(amount / price), 0.0)
+    leftover = np.where(active, amount - units * price, leftover)
+    total_units = total_units + units
+    return units, leftover, total_units, total_units * price + leftover
+
+
+def _purchase_matrix(investment, price, leftover, total):
+    # Same recurrence as _purchase_series, vectorized across tickers and looped over dates.
+    # Cells without a contribution or without a price only carry units and cash forward.
+    n_dates, n_tickers = investment.shape
+    active = (investment != 0) & np.isfinite(price)
+    units_purchased = np.zeros((n_dates, n_tickers))
+    total_units = np.empty((n_dates, n_tickers))
+    cash = np.empty((n_dates, n_tickers))
+    net_worth = np.empty((n_dates, n_tickers))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for t in range(n_dates):
+            units, leftover, total, worth = purchase_step(investment[t], leftover, total, price[t], active[t])
+            units_purchased[t] = units
+            total_units[t] = total
+            cash[t] = leftover
+            net_worth[t] = worth
+
+    return {
+        'etf_units_purchased': units_purchased,
+        'total_etf_units': total_units,
+        'cash': cash,
+        'ETF_net_worth': net_worth
+    }
@@ -0,0 +1,129 @@
+import numpy as np
+from purchaseengine import purchase_step
+
+# Columns of the rows simulate_rebalancing returns, in addition to the purchase kernel ones
+REBALANCING_COLUMNS = ['etf_units_purchased', 'etf_units_sold', 'total_etf_units', 'cash', 'ETF_net_worth',
+                       'target_weight', 'etf_weight']
+
+
+def rebalance_step(units, cash, price, sell_price, target, tradable):
+    """Bring the ETFs trading today back to their target weights with whole units.
+
+    Overweight ETFs sell the whole units above their target value at sell_price. Their proceeds and the cash
+    of the tradable ETFs then buy whole units at price, first to fill the ETFs below their target value, the
+    rest split by target weight. Returns (units bought, units sold, total units, cash).
+    """
+    weights = np.where(tradable, target, 0.0)
+    if weights.sum() <= 0:
+        return np.zeros_like(units), np.zeros_like(units), units, cash
+    weights = weights / weights.sum()
+    value = np.where(tradable, units * price, 0.0)
+    pooled_cash = np.where(tradable, cash, 0.0)
+    desired = weights * (value + pooled_cash).sum()
+
+    sold = np.where(tradable, np.maximum(np.floor((value - desired) / price), 0.0), 0.0)
+    units = units - sold
+    pool = pooled_cash.sum() + np.where(tradable, sold * sell_price, 0.0).sum()
+
+    shortfall = np.where(tradable, np.maximum(desired - units * price, 0.0), 0.0)
+    budget = shortfall * min(1.0, pool / shortfall.sum()) if shortfall.sum() > 0 else np.zeros_like(units)
+    budget = budget + (pool - budget.sum()) * weights
+    bought = np.where(tradable, np.floor(budget / price), 0.0)
+    cash = np.where(tradable, budget - bought * price, cash)
+    return bought, sold, units + bought, cash
+
+
+def holding_weights(units, cash, price):
+    """Weight of every ETF (its units at price plus its cash) in the portfolio, for one or many price rows"""
+    value = units * price + cash
+    return value / np.sum(value, axis=-1, keepdims=True)
+
+
+def simulate_rebalancing(investment, previous_close, fees, target_weights, rebalance_dates=None, threshold=None):
+    """Whole-unit DCA purchases on a daily date x ticker matrix, with the holdings rebalanced to their targets.
+
+    investment holds the contributions (0 on the other days), previous_close is NaN on the days a ticker does
+    not trade, target_weights is a (dates x tickers) matrix of per-date targets or one row for every date.
+    Contributions buy like apply_ETF_purchase: whole units at the previous close plus fees, leftover cash
+    kept per ETF. Holdings are rebalanced (rebalance_step, sales at the previous close minus fees) on the
+    rebalance_dates rows and, with a threshold, whenever an ETF weight drifts more than threshold from
+    its target.
+
+    Holdings only change on contribution and rebalancing rows, so the loop jumps from one to the next and the
+    drift of all the days in between is checked at once. Returns (rows, columns, rebalanced): the rows
+    where something happened, the REBALANCING_COLUMNS on these rows plus the `active` cells (ETFs that
+    received a contribution or were rebalanced), and whether each row was rebalanced.
+    """
+    investment = np.asarray(investment, dtype=float)
+    previous_close = np.asarray(previous_close, dtype=float)
+    n_dates, n_tickers = investment.shape
+    fees = np.broadcast_to(np.asarray(fees, dtype=float), investment.shape)
+    target = np.nan_to_num(np.broadcast_to(np.asarray(target_weights, dtype=float), investment.shape))
+    buy_price = previous_close * (1 + fees)
+    sell_price = previous_close * (1 - fees)
+    tradable = np.isfinite(buy_price)
+    # Holdings are valued at the last known price on the days an ETF does not trade (0 before its first one)
+    last_row = np.maximum.accumulate(np.where(tradable, np.arange(n_dates)[:, None], 0), axis=0)
+    valuation = np.nan_to_num(buy_price[last_row, np.arange(n_tickers)])
+
+    scheduled = (investment != 0).any(axis=1)
+    if rebalance_dates is not None:
+        scheduled |= np.asarray(rebalance_dates, dtype=bool)
+    events = np.flatnonzero(scheduled)
+    calendar = np.zeros(n_dates, dtype=bool) if rebalance_dates is None else np.asarray(rebalance_dates, dtype=bool)
+
+    units = np.zeros(n_tickers)
+    cash = np.zeros(n_tickers)
+    rows, rebalanced = [], []
+    columns = {col: [] for col in REBALANCING_COLUMNS + ['active']}
+    k, last = 0, -1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        while True:
+            row = events[k] if k < len(events) else n_dates
+            drifted = False
+            if threshold is not None and units.any() and row > last + 1:
+                # First day before the next event whose drift exceeds the threshold
+                weights = holding_weights(units, cash, valuation[last + 1:row])
+                drift = np.abs(weights - target[last + 1:row]).max(axis=1)
+                hit = np.flatnonzero(drift > threshold)
+                if len(hit):
+                    row, drifted = last + 1 + hit[0], True
+            if row >= n_dates:
+                break
+
+            price = buy_price[row]
+            contribution = investment[row]
+            invested = (contribution != 0) & tradable[row]
+            bought, cash, units, _ = purchase_step(contribution, cash, units, price, invested)
+            sold = np.zeros(n_tickers)
+            held = units > 0
+            if not drifted and threshold is not None and units.any():
+                drifted = np.abs(holding_weights(units, cash, valuation[row]) - target[row]).max() > threshold
+            if (calendar[row] or drifted) and units.any():
+                extra, sold, units, cash = rebalance_step(units, cash, price, sell_price[row], target[row],
+                                                          tradable[row])
+                bought = bought + extra
+                rebalanced.append(True)
+                active = invested | (tradable[row] & ((target[row] > 0) | held))
+            else:
+                rebalanced.append(False)
+                active = invested
+
+            rows.append(row)
+            columns['etf_units_purchased'].append(bought)
+            columns['etf_units_sold'].append(sold)
+            columns['total_etf_units'].append(units)
+            columns['cash'].append(cash)
+            columns['ETF_net_worth'].append(units * price + cash)
+            columns['target_weight'].append(target[row])
+            columns['etf_weight'].append(holding_weights(units, cash, valuation[row]))
+            columns['active'].append(active)
+
+            last = row
+            while k < len(events) and events[k] <= row:
+                k += 1
+
+    rows = np.array(rows, dtype=np.int64)
+    shape = (len(rows), n_tickers)
+    columns = {col: np.array(values).reshape(shape) for col, values in columns.items()}
+    return rows, columns, np.array(rebalanced, dtype=bool)
@@ -0,0 +1,66 @@
+// Line charts drawn in the browser from the downsampled series returned by the server
+function drawLineChart(canvas, title, yLabel, lines) {
+    const ctx = canvas.getContext('2d');
+    const width = canvas.width, height = canvas.height;
+    const margin = { top: 40, right: 20, bottom: 40, left: 70 };
+    const plotWidth = width - margin.left - margin.right;
+    const plotHeight = height - margin.top - margin.bottom;
+
+    const parsed = lines.filter(line => line.series).map(line => ({
+        ...line,
+        x: line.series.dates.map(d => new Date(d).getTime()),
+        y: line.series.values
+    }));
+    const allX = parsed.flatMap(line => line.x), allY = parsed.flatMap(line => line.y);
+    if (!allX.length) return;
+    const xMin = Math.min(...allX), xMax = Math.max(...allX);
+    let yMin = Math.min(...allY), yMax = Math.max(...allY);
+    if (yMin === yMax) { yMin -= 1; yMax += 1; }
+    const px = x => margin.left + (x - xMin) / Math.max(xMax - xMin, 1) * plotWidth;
+    const py = y => margin.top + (1 - (y - yMin) / (yMax - yMin)) * plotHeight;
+
+    ctx.clearRect(0, 0, width, height);
+    ctx.font = '12px Arial';
+    ctx.fillStyle = '#000';
+    ctx.textAlign = 'center';
+    ctx.fillText(title, width / 2, 20);
+
+    // Grid and axis labels
+    ctx.strokeStyle = '#ddd';
+    ctx.textAlign = 'right';
+    for (let i = 0; i <= 5; i++) {
+        const y = yMin + (yMax - yMin) * i / 5;
+        ctx.beginPath();
+        ctx.moveTo(margin.left, py(y));
+        ctx.lineTo(width - margin.right, py(y));
+        ctx.stroke();
+        ctx.fillText(y.toFixed(0), margin.left - 5, py(y) + 4);
+    }
+    ctx.textAlign = 'center';
+    const firstYear = new Date(xMin).getFullYear(), lastYear = new Date(xMax).getFullYear();
+    const yearStep = Math.max(1, Math.ceil((lastYear - firstYear) / 10));
+    for (let year = firstYear + 1; year <= lastYear; year += yearStep) {
+        const x = px(new Date(year, 0, 1).getTime());
+        ctx.fillText(year, x, height - margin.bottom + 15);
+    }
+    ctx.save();
+    ctx.translate(15, margin.top + plotHeight / 2);
+    ctx.rotate(-Math.PI / 2);
+    ctx.fillText(yLabel, 0, 0);
+    ctx.restore();
+
+    // Series and legend
+    parsed.forEach((line, i) => {
+        ctx.strokeStyle = line.color;
+        ctx.setLineDash(line.dashed ? [6, 4] : []);
+        ctx.beginPath();
+        line.x.forEach((x, j) => j ? ctx.lineTo(px(x), py(line.y[j])) : ctx.moveTo(px(x), py(line.y[j])));
+        ctx.stroke();
+        ctx.setLineDash([]);
+        ctx.fillStyle = line.color;
+        ctx.textAlign = 'left';
+        ctx.fillRect(margin.left + 10, margin.top + 10 + i * 16, 12, 3);
+        ctx.fillStyle = '#000';
+        ctx.fillText(line.label, margin.left + 28, margin.top + 15 + i * 16);
+    });
+}
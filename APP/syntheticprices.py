@@ -0,0 +1,66 @@
+import zlib
+import numpy as np
+import pandas as pd
+from etfdataretrieval import ETFDataRetrieval
+from priceproviders import PriceProvider, LocalDirectoryProvider, slice_history
+
+# Every synthetic ticker is one series over this range, requests are slices of it
+SYNTHETIC_START = '1970-01-01'
+SYNTHETIC_END = '2035-12-31'
+
+
+class SyntheticPriceProvider(PriceProvider):
+    """Deterministic prices without network access, for benchmarks.
+
+    Each ticker gets a geometric random walk on business days seeded by its name, so the same ticker
+    always has the same prices whatever range is asked. With fixture_dir, the files of a
+    LocalDirectoryProvider on that directory are served instead when they exist.
+    """
+
+    name = 'synthetic'
+
+    def __init__(self, fixture_dir=None, tz='America/New_York'):
+        self.fixtures = LocalDirectoryProvider(fixture_dir) if fixture_dir else None
+        self.tz = tz  # yfinance returns exchange-local timestamps
+        self._series = {}
+
+    def full_history(self, ticker_symbol):
+        if ticker_symbol not in self._series:
+            try:
+                data = self.fixtures.load(ticker_symbol) if self.fixtures else None
+            except FileNotFoundError:
+                data = None
+            self._series[ticker_symbol] = data if data is not None else self._generate(ticker_symbol)
+        return self._series[ticker_symbol]
+
+    def _generate(self, ticker_symbol):
+        rng = np.random.default_rng(zlib.crc32(ticker_symbol.encode()))
+        dates = pd.bdate_range(SYNTHETIC_START, SYNTHETIC_END, tz=self.tz, name='Date')
+        drift, volatility = rng.uniform(0.0001, 0.0005), rng.uniform(0.006, 0.02)
+        close = rng.uniform(20, 200) * np.exp(np.cumsum(rng.normal(drift, volatility, len(dates))))
+        spread = np.abs(rng.normal(0, volatility / 2, len(dates)))
+        return pd.DataFrame({
+            'Open': close * (1 + rng.normal(0, volatility / 4, len(dates))),
+            'High': close * (1 + spread),
+            'Low': close * (1 - spread),
+            'Close': close,
+            'Volume': rng.integers(10 ** 4, 10 ** 7, len(dates)),
+            'Dividends': 0.0,
+            'Stock Splits': 0.0
+        }, index=dates)
+
+    def ticker_history(self, ticker_symbol, start_date, end_date, timeout=None):
+        return slice_history(self.full_history(ticker_symbol), start_date, end_date)
+
+    def ticker_metadata(self, ticker_symbol):
+        if self.fixtures is not None and ticker_symbol in self.fixtures.load_metadata():
+            return self.fixtures.ticker_metadata(ticker_symbol)
+        seed = zlib.crc32(ticker_symbol.encode())
+        return {'fees': round((seed % 76) / 10000, 4), 'ticker': ticker_symbol}
+
+
+class SyntheticDataRetrieval(ETFDataRetrieval):
+    """ETFDataRetrieval on a SyntheticPriceProvider"""
+
+    def __init__(self, fixture_dir=None, tz='America/New_York'):
+        super().__init__(provider=SyntheticPriceProvider(fixture_dir, tz), max_workers=1)
@@ -0,0 +1,34 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules of the app are imported by name from APP/, nothing is written to the user's caches
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('ETF_PRICE_STORE', '')
+os.environ.setdefault('ETF_METADATA_CACHE', '')
+
+from priceproviders import InMemoryProvider  # noqa: E402
+
+TICKERS = {'SPY': 0.0009, 'QQQ': 0.002, 'VEA': 0.0005, 'ACWI': 0.0032}
+
+
+def synthetic_bars(seed, start='2008-01-01', end='2024-01-01', drop_every=None):
+    """Daily bars shaped like yfinance's: a geometric random walk on New York business days"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, end, tz='America/New_York', name='Date')
+    if drop_every:
+        dates = dates[np.arange(len(dates)) % drop_every != 3]  # a calendar with holidays of its own
+    close = 50 * np.exp(np.cumsum(rng.normal(0.0003, 0.012, len(dates))))
+    return pd.DataFrame({'Open': close * 0.995, 'High': close * 1.01, 'Low': close * 0.99, 'Close': close,
+                         'Volume': rng.integers(10 ** 5, 10 ** 6, len(dates)), 'Dividends': 0.0,
+                         'Stock Splits': 0.0}, index=dates)
+
+
+@pytest.fixture(scope='session')
+def provider():
+    provider = InMemoryProvider()
+    for seed, (ticker, fees) in enumerate(TICKERS.items()):
+        provider.add(ticker, synthetic_bars(seed, drop_every=29 if ticker == 'VEA' else None), fees=fees)
+    return provider
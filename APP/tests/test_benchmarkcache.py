@@ -0,0 +1,17 @@
+from benchmarkcache import BenchmarkCache
+
+
+def test_open_window_entries_expire():
+    cache = BenchmarkCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'data': None, 'cagr': len(calls), 'sharpe': 0.0}
+
+    closed = BenchmarkCache.make_key('ACWI', 1000, 100, '2010-01-01', 5, 'M')
+    today = BenchmarkCache.make_key('ACWI', 1000, 100, '2022-01-01', 10, 'M')
+    assert cache.get(closed, compute)['cagr'] == cache.get(closed, compute)['cagr'] == 1
+    assert cache.get(today, compute, ttl=0)['cagr'] == 2
+    assert cache.get(today, compute, ttl=0)['cagr'] == 3  # expired, simulated again
+    assert cache.stats()['entries'] == 2 and cache.current_bytes == 2048
@@ -0,0 +1,10 @@
+import pandas as pd
+from chartcache import ChartCache
+
+
+def test_key_depends_on_the_series_and_the_dpi(tmp_path):
+    series = pd.Series([1.0, 2.0, 3.0], index=pd.date_range('2020-01-01', periods=3), name='pnl')
+    low, high = ChartCache(directory=str(tmp_path), dpi=72), ChartCache(directory=str(tmp_path), dpi=150)
+    assert low.make_key('pnl', series) == ChartCache(dpi=72).make_key('pnl', series.copy())
+    assert low.make_key('pnl', series) != low.make_key('pnl', series * 2)
+    assert low.make_key('pnl', series) != high.make_key('pnl', series)
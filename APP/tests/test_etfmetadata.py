@@ -0,0 +1,24 @@
+import threading
+import time
+from etfmetadata import ETFMetadataService
+
+
+def test_prefetch_gives_up_on_a_hanging_ticker():
+    service = ETFMetadataService(path=None)
+    release = threading.Event()
+
+    def fetch(ticker):
+        if ticker == 'SLOW':
+            release.wait(10)
+        return {'fees': 0.001, 'ticker': ticker, 'fetched_at': time.time()}
+
+    service._fetch = fetch
+    try:
+        started = time.perf_counter()
+        errors = service.prefetch(['A', 'SLOW', 'B'], timeout=0.2)
+        assert time.perf_counter() - started < 2
+    finally:
+        release.set()
+    assert list(errors) == ['SLOW'] and isinstance(errors['SLOW'], TimeoutError)
+    assert service.get('A') == {'fees': 0.001, 'ticker': 'A'}
+    assert (service.hits, service.misses) == (1, 0)
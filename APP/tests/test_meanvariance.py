@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from meanvariance import RISK_FREE_RATE, MeanVarianceOptimizer
+
+
+@pytest.fixture(scope='module')
+def optimizer():
+    """30 ETFs whose tangency and min-variance portfolios are inside the long-only bounds, so both are known in
+    closed form"""
+    rng = np.random.default_rng(3)
+    n = 30
+    factors = rng.normal(0, 0.05, (n, 3))
+    covariance = factors @ factors.T + np.diag(rng.uniform(0.02, 0.06, n))
+    tangency = rng.dirichlet(np.full(n, 5.0))
+    mean = RISK_FREE_RATE + covariance @ tangency * 2
+    return MeanVarianceOptimizer(mean, covariance, [f"ETF{i}" for i in range(n)]), tangency
+
+
+def test_max_sharpe_reaches_the_tangency_portfolio(optimizer):
+    optimizer, tangency = optimizer
+    result = optimizer.optimize('max_sharpe')
+    best = optimizer.evaluate(tangency[None, :])[2][0]
+    assert result.sharpe_ratio == pytest.approx(best, rel=1e-9)
+    np.testing.assert_allclose(result.weights.to_numpy(), tangency, atol=1e-4)
+
+
+def test_min_variance_reaches_the_closed_form(optimizer):
+    optimizer, _ = optimizer
+    inverse = np.linalg.solve(optimizer.covariance, np.ones(len(optimizer.tickers)))
+    weights = inverse / inverse.sum()
+    assert (weights > 0).all()
+    result = optimizer.optimize('min_variance')
+    assert result.volatility == pytest.approx(np.sqrt(weights @ optimizer.covariance @ weights), rel=1e-9)
+
+
+def test_polish_stays_within_the_weight_and_category_bounds(optimizer):
+    optimizer, _ = optimizer
+    tickers = optimizer.tickers
+    bounded = MeanVarianceOptimizer(optimizer.mean, optimizer.covariance, tickers, bounds=(0.0, 0.1),
+                                    categories={'bonds': tickers[:5], 'tech': tickers[5:12]},
+                                    category_bounds={'bonds': (0.3, 0.5), 'tech': (0.0, 0.2)})
+    score = lambda r, v, s: -np.nan_to_num(s, nan=-np.inf)
+    searched = bounded._search(score, 1, 1000, 10, 0, polish=False)
+    polished = bounded._search(score, 1, 1000, 10, 0)
+    assert bounded.feasible(polished, tolerance=1e-9).all()
+    assert bounded.evaluate(polished)[2][0] >= bounded.evaluate(searched)[2][0]
+
+    frontier = bounded.efficient_frontier(points=8, candidates=200, rounds=5)
+    weights = frontier[tickers].to_numpy()
+    assert bounded.feasible(weights, tolerance=1e-9).all()
+    np.testing.assert_allclose(weights.sum(axis=1), 1)
@@ -0,0 +1,94 @@
+import pandas as pd
+import pytest
+
+from portfolio import Portfolio
+
+ETFS = [('SPY', 0.5), ('QQQ', 0.3), ('VEA', 0.2)]
+
+
+def configured(provider, frequency='M', start_date='2012-03-06', duration=5, etfs=ETFS):
+    portfolio = Portfolio(provider)
+    portfolio.configure_from_input(1000, 200, start_date, duration, etfs, frequency)
+    return portfolio
+
+
+def test_simulation_runs_once_across_metrics(provider):
+    portfolio = configured(provider)
+    portfolio.calculate_all_metrics(render_plots=False)
+    portfolio.apply_CAGR_ratio()
+    portfolio.apply_SHARPE_ratio()
+    portfolio.apply_ETF_purchase()
+    assert portfolio.simulation_runs == 1
+
+
+def test_configure_resets_the_simulation(provider):
+    portfolio = configured(provider)
+    first = portfolio.apply_CAGR_ratio()
+    portfolio.configure_from_input(1000, 200, '2014-01-01', 3, ETFS, 'Q')
+    assert portfolio.simulation_runs == 0
+    second = portfolio.apply_CAGR_ratio()
+    portfolio.apply_SHARPE_ratio()
+    assert portfolio.simulation_runs == 1
+    assert not first.equals(second)
+
+
+def baseline_simulation(portfolio):
+    """The long frame apply_ETF_purchase built before the date x ticker matrix: the row-by-row purchase
+    loop per ETF, then portfolio totals merged back by date"""
+    from benchmark import legacy_purchase_loop
+    frames = {}
+    for ticker, df in portfolio.apply_periodic_investment().items():
+        df = legacy_purchase_loop(df)
+        df['ticker'] = ticker
+        frames[ticker] = df
+    df = pd.concat(frames).sort_index().sort_values(['Date', 'ticker'])
+    totals = df.groupby('Date').agg(investment=('investment', 'sum'), Portfolio_PnL=('ETF_PnL', 'sum'),
+                                    Portfolio_net_worth=('ETF_net_worth', 'sum')).reset_index()
+    totals['cumulative_investment'] = totals['investment'].cumsum()
+    for col in ('cumulative_investment', 'Portfolio_PnL', 'Portfolio_net_worth'):
+        df = pd.merge(df, totals[['Date', col]], on='Date', how='left')
+    df['Portfolio_PnL_%'] = ((df['Portfolio_net_worth'] / df['cumulative_investment'] - 1) * 100).round(2)
+    return df
+
+
+@pytest.mark.parametrize('frequency', ['M', 'Q', '6M', 'Y', 'W'])
+def test_matrix_simulation_matches_the_baseline(provider, frequency):
+    portfolio = configured(provider, frequency)
+    pd.testing.assert_frame_equal(portfolio.simulation, baseline_simulation(portfolio), check_exact=True)
+
+
+def test_sweep_matches_one_portfolio_per_scenario(provider):
+    from backtestsweep import BacktestSweep
+    from etfdataretrieval import ETFDataRetrieval
+    # Tickers trading on every business day, see the BacktestSweep docstring
+    etfs = [('SPY', 0.6), ('QQQ', 0.4)]
+    data_retrieval = ETFDataRetrieval(provider=provider)
+    results = BacktestSweep(etfs, data_retrieval=data_retrieval).run(
+        pd.date_range('2010-01-01', periods=4, freq='QS'), [2, 5], ['M', 'W'], [(1000, 200), (0, 500)])
+    assert len(results) == 32
+    for scenario in results.itertuples():
+        portfolio = Portfolio(data_retrieval=data_retrieval)
+        portfolio.configure_from_input(scenario.initial_amount, scenario.periodic_amount,
+                                       scenario.start_date.strftime('%Y-%m-%d'), scenario.duration, etfs,
+                                       scenario.frequency)
+        volatility, sharpe = portfolio.apply_SHARPE_ratio()
+        assert (portfolio.apply_CAGR_ratio().loc['TOTAL', 'CAGR'], volatility.loc['TOTAL', 'volatility'], sharpe) \
+            == (scenario.cagr, scenario.volatility, scenario.sharpe_ratio)
+
+
+@pytest.mark.parametrize('frequency', ['M', 'W', 'Q'])
+def test_advance_matches_a_full_recompute(provider, frequency):
+    import json
+    from portfoliostate import PortfolioState
+    before, after = configured(provider, frequency, duration=5), configured(provider, frequency, duration=7)
+    state = PortfolioState.from_dict(json.loads(json.dumps(before.simulation_state().to_dict())),
+                                     before.data_retrieval)
+    bars = before.data_retrieval.fetch_batch([ticker for ticker, _ in ETFS], before.end_date, after.end_date).data
+    days = sorted(set().union(*(data.index for data in bars.values())))
+
+    # The first days one bar at a time, then the rest at once, a day overlapping the previous call
+    matrix = before.simulation_matrix
+    for first, last in [(max(i - 1, 0), i) for i in range(10)] + [(9, len(days) - 1)]:
+        chunk = {ticker: data[(data.index >= days[first]) & (data.index <= days[last])] for ticker, data in bars.items()}
+        matrix = matrix.append(state.advance(chunk))
+    pd.testing.assert_frame_equal(matrix.to_frame(), after.simulation, check_exact=True)
@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+from conftest import synthetic_bars
+from etfdataretrieval import ETFDataRetrieval
+from priceproviders import InMemoryProvider, LocalDirectoryProvider, default_price_provider
+
+
+def test_batches_go_through_the_bulk_download():
+    provider = InMemoryProvider({'AAA': synthetic_bars(1), 'BBB': synthetic_bars(2)})
+    calls = []
+    download = provider.download
+    provider.download = lambda tickers, *args, **kwargs: calls.append(list(tickers)) or download(tickers, *args, **kwargs)
+
+    batch = ETFDataRetrieval(provider=provider, retries=1, retry_backoff=0).fetch_batch(
+        ['AAA', 'BBB', 'MISSING'], '2015-01-01', '2016-01-01', with_info=True)
+    assert calls == [['AAA', 'BBB', 'MISSING'], ['MISSING']]  # one bulk call, then the failed ticker again
+    assert sorted(batch.data) == ['AAA', 'BBB'] and sorted(batch.info) == ['AAA', 'BBB']
+    assert isinstance(batch.errors['MISSING'], KeyError)
+
+
+def test_history_aligns_the_downloaded_tickers():
+    provider = InMemoryProvider({'AAA': synthetic_bars(1), 'BBB': synthetic_bars(2, drop_every=7)})
+    history = provider.history(['AAA', 'BBB', 'MISSING'], '2015-01-01', '2016-01-01')
+    assert list(history['Close'].columns) == ['AAA', 'BBB']
+    expected = provider.ticker_history('BBB', '2015-01-01', '2016-01-01')['Close']
+    pd.testing.assert_series_equal(history['Close']['BBB'].dropna(), expected, check_names=False, check_freq=False)
+
+
+def test_memory_provider_is_not_configurable(monkeypatch):
+    monkeypatch.setenv('ETF_PRICE_PROVIDER', 'memory')
+    with pytest.raises(ValueError, match='memory'):
+        default_price_provider()
+
+
+def test_local_csv_dates_are_exchange_dates(tmp_path):
+    dates = pd.DatetimeIndex(['2020-03-06', '2020-03-09', '2020-11-02'])
+    bars = pd.DataFrame({'Close': [1.0, 2.0, 3.0]}, index=dates.rename('Date'))
+    bars.to_csv(tmp_path / 'NAIVE.csv')
+    for ticker, timezone in (('NY', 'America/New_York'), ('TOKYO', 'Asia/Tokyo')):
+        # yfinance exports: midnight in the exchange timezone, offsets changing with daylight saving time
+        bars.set_axis(dates.tz_localize(timezone).rename('Date')).to_csv(tmp_path / f'{ticker}.csv')
+
+    assert LocalDirectoryProvider(str(tmp_path)).load('NAIVE').index.equals(dates)
+    assert LocalDirectoryProvider(str(tmp_path)).load('NY').index.equals(dates)
+    assert LocalDirectoryProvider(str(tmp_path), timezone='Asia/Tokyo').load('TOKYO').index.equals(dates)
@@ -0,0 +1,22 @@
+import json
+import pandas as pd
+from conftest import synthetic_bars
+from syntheticprices import SyntheticDataRetrieval
+
+
+def test_fixtures_are_served_and_other_tickers_generated(tmp_path):
+    fixture = synthetic_bars(7, start='2019-01-01', end='2021-01-01')
+    fixture.to_csv(tmp_path / 'FIX.csv')
+    with open(tmp_path / 'metadata.json', 'w') as f:
+        json.dump({'FIX': {'fees': 0.0042}}, f)
+
+    data_retrieval = SyntheticDataRetrieval(fixture_dir=str(tmp_path))
+    batch = data_retrieval.fetch_batch(['FIX', 'SYN001'], '2020-01-01', '2020-07-01', with_info=True)
+    assert not batch.errors
+    expected = fixture[(fixture.index >= pd.Timestamp('2020-01-01', tz='America/New_York'))
+                       & (fixture.index < pd.Timestamp('2020-07-01', tz='America/New_York'))]
+    # CSV dates with DST-dependent offsets come back as exchange-local dates (LocalDirectoryProvider)
+    expected.index = expected.index.tz_localize(None)
+    pd.testing.assert_frame_equal(batch.data['FIX'][expected.columns], expected, check_freq=False)
+    assert batch.info['FIX']['fees'] == 0.0042
+    assert len(batch.data['SYN001']) > 100
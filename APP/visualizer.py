@@ -1,23 +1,41 @@
 import matplotlib
 matplotlib.use('Agg')  # Set the backend to non-interactive
 import matplotlib.pyplot as plt
-import seaborn as sns
+from matplotlib.figure import Figure
 import pandas as pd
+from chartcache import chart_cache
+from downsampling import downsample_series
+from instrumentation import timed
+
+
+def new_figure(figsize=(10, 6), pyplot=False):
+    """Figure and axes outside pyplot's global state: charts are rendered concurrently by the job threads.
+    pyplot=True creates them through pyplot instead, for the plots shown by plt.show() outside Flask."""
+    fig = plt.figure(figsize=figsize) if pyplot else Figure(figsize=figsize)
+    return fig, fig.add_subplot()
 
 
 class Visualizer:
     def __init__(self, data, acwi_data=None):
-        self.data = data
+        self.data = data  # PortfolioMatrix of the simulated portfolio
         self.acwi_data = acwi_data
     
+    def portfolio_value_data(self):
+        # Get portfolio value and cumulative investment
+        return self.data.portfolio_frame(['Portfolio_net_worth', 'cumulative_investment'])
+
+    def pnl_percentage_data(self):
+        pnl = self.data.portfolio_series('Portfolio_PnL_%')
+        acwi_pnl = None
+        if self.acwi_data is not None:
+            acwi_pnl = self.acwi_data.portfolio_series('Portfolio_PnL_%')
+        return pnl, acwi_pnl
+
     def plot_portfolio_value(self, for_flask=False):
-        fig, ax = plt.subplots(figsize=(10, 6))
+        fig, ax = new_figure(pyplot=not for_flask)
         
         # Get portfolio value and cumulative investment
-        portfolio_data = self.data.groupby('Date').agg({
-            'Portfolio_net_worth': 'first',
-            'cumulative_investment': 'first'
-        })
+        portfolio_data = self.portfolio_value_data()
         
         # Plot both lines
         portfolio_data['Portfolio_net_worth'].plot(ax=ax, label='Your Portfolio Value')
@@ -35,13 +53,12 @@ class Visualizer:
         plt.show()
     
     def plot_pnl_percentage(self, for_flask=False):
-        fig, ax = plt.subplots(figsize=(10, 6))
-        pnl = self.data.groupby('Date')['Portfolio_PnL_%'].first()
+        fig, ax = new_figure(pyplot=not for_flask)
+        pnl, acwi_pnl = self.pnl_percentage_data()
         pnl.plot(ax=ax, label='Your Portfolio')
         
         # Add ACWI comparison if available
-        if self.acwi_data is not None:
-            acwi_pnl = self.acwi_data.groupby('Date')['Portfolio_PnL_%'].first()
+        if acwi_pnl is not None:
             acwi_pnl.plot(ax=ax, label='ACWI', color='green')
         
         ax.set_title('Portfolio PnL Percentage vs Benchmark')
@@ -54,10 +71,12 @@ class Visualizer:
         plt.show()
     
     def plot_pnl_boxplot(self, for_flask=False):
-        df = self.data.copy()
+        df = self.data.portfolio_rows('Portfolio_PnL_%')
         df['Year'] = pd.to_datetime(df['Date']).dt.year
 
-        fig, ax = plt.subplots(figsize=(10, 6))
+        import seaborn as sns  # only this chart uses it, and it is slow to import
+
+        fig, ax = new_figure(pyplot=not for_flask)
         sns.boxplot(data=df, x='Year', y='Portfolio_PnL_%', ax=ax)
 
         ax.set_title('Distribution of Portfolio PnL Percentage by Year')
@@ -79,4 +98,29 @@ class Visualizer:
     
     def get_plots(self, cagr_data=None):
         return self.plot_all(for_flask=True, cagr_data=cagr_data)
+
+    @timed('downsample')
+    def get_series(self, points=500):
+        """Plotted series downsampled to `points` points each, for charts drawn by the browser"""
+        portfolio_data = self.portfolio_value_data()
+        pnl, acwi_pnl = self.pnl_percentage_data()
+        series = {
+            'portfolio_value': downsample_series(portfolio_data['Portfolio_net_worth'], points),
+            'cumulative_investment': downsample_series(portfolio_data['cumulative_investment'], points),
+            'pnl_percentage': downsample_series(pnl, points)
+        }
+        if acwi_pnl is not None:
+            series['benchmark_pnl_percentage'] = downsample_series(acwi_pnl, points)
+        return series
+
+    @timed('render')
+    def get_encoded_plots(self):
+        """Base64 PNGs of the plots, charts already drawn for the same series come from the chart cache"""
+        pnl, acwi_pnl = self.pnl_percentage_data()
+        charts = [
+            (chart_cache.make_key('portfolio_value', self.portfolio_value_data()), self.plot_portfolio_value),
+            (chart_cache.make_key('pnl_percentage', pnl, acwi_pnl), self.plot_pnl_percentage),
+            (chart_cache.make_key('pnl_boxplot', self.data.portfolio_rows('Portfolio_PnL_%')), self.plot_pnl_boxplot)
+        ]
+        return [chart_cache.get_or_render(key, lambda plot=plot: plot(for_flask=True)) for key, plot in charts]
   
\ No newline at end of file